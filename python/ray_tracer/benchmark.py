@@ -0,0 +1,499 @@
+import ch10_program
+import math
+import multiprocessing
+import numpy as np
+import os
+import sys
+import timeit
+import tracemalloc
+
+import matrix
+import virtual_cannon
+
+from canvas import Canvas, Color, MappedCanvas, SharedCanvas
+from matrix import Rotation_Axis, Rotation_Matrix, Scaling_Matrix, Translation_Matrix
+from ray_tracer import Camera, PointLight, Ray, World
+from shape import Plane, Sphere
+from tuple import Point, Vector
+
+
+def report(label, seconds, number):
+  print("  {0:<32} {1:10.3f} us".format(label, seconds / number * 1e6))
+
+
+def report_seconds(label, seconds):
+  print("  {0:<32} {1:10.3f} s".format(label, seconds))
+
+
+def bench_tuple_backends(number=200000):
+  print("Matrix * Tuple backends ({0} calls each)".format(number))
+  m = Translation_Matrix(1, 2, 3) * Rotation_Matrix(Rotation_Axis.Y, 30) * Scaling_Matrix(2, 2, 2)
+  p = Point(1, 2, 3)
+  v = Vector(1, 2, 3)
+  ray = Ray(p, v)
+  original = matrix.tuple_backend
+  try:
+    for backend in matrix.TUPLE_BACKENDS:
+      matrix.set_tuple_backend(backend)
+      report(backend + ": matrix * point", timeit.timeit(lambda: m * p, number=number), number)
+      report(backend + ": matrix * vector", timeit.timeit(lambda: m * v, number=number), number)
+      report(backend + ": ray.transform", timeit.timeit(lambda: ray.transform(m), number=number), number)
+  finally:
+    matrix.set_tuple_backend(original)
+
+
+def default_scene(hsize, vsize):
+  world = World.default_world()
+  camera = Camera(hsize, vsize, math.pi / 2.0)
+  camera.transform = world.view_transform(Point(0, 0, -5), Point(0, 0, 0), Vector(0, 1, 0))
+  return world, camera
+
+
+def count_allocations(fn, classes=(Point, Vector, Color)):
+  # count constructor calls by temporarily wrapping each class's __init__
+  counts = dict.fromkeys(classes, 0)
+  originals = {cls: cls.__dict__['__init__'] for cls in classes}
+
+  def counting(cls, init):
+    def wrapper(self, *args):
+      counts[cls] += 1
+      init(self, *args)
+    return wrapper
+
+  for cls in classes:
+    cls.__init__ = counting(cls, originals[cls])
+  try:
+    fn()
+  finally:
+    for cls in classes:
+      cls.__init__ = originals[cls]
+  return counts
+
+
+def instance_size(make, count=10000):
+  # measure through tracemalloc so per-instance dicts are included
+  tracemalloc.start()
+  before = tracemalloc.get_traced_memory()[0]
+  objects = [make() for i in range(count)]
+  after = tracemalloc.get_traced_memory()[0]
+  tracemalloc.stop()
+  return (after - before - sys.getsizeof(objects)) / count
+
+
+def bench_allocations(size=20, number=200000):
+  print("Value type footprint and allocations per pixel ({0}x{0} default world)".format(size))
+  sizes = {}
+  for cls, make in ((Point, lambda: Point(1.0, 2.0, 3.0)),
+                    (Vector, lambda: Vector(1.0, 2.0, 3.0)),
+                    (Color, lambda: Color(0.1, 0.2, 0.3))):
+    sizes[cls] = instance_size(make)
+    print("  {0:<32} {1:10.1f} bytes".format(cls.__name__ + " instance", sizes[cls]))
+    report(cls.__name__ + " construction", timeit.timeit(make, number=number), number)
+  world, camera = default_scene(size, size)
+  counts = count_allocations(lambda: camera.render(world))
+  pixels = size * size
+  for cls, count in counts.items():
+    print("  {0:<32} {1:10.1f} per pixel".format(cls.__name__ + " objects", count / pixels))
+  print("  {0:<32} {1:10.1f} per pixel".format("total objects", sum(counts.values()) / pixels))
+  total_bytes = sum(count * sizes[cls] for cls, count in counts.items())
+  print("  {0:<32} {1:10.1f} per pixel".format("total bytes", total_bytes / pixels))
+  # a single primary ray that hits the front sphere and is shaded
+  counts = count_allocations(lambda: world.color_at(camera.ray_for_pixel(size // 2, size // 2)))
+  print("  {0:<32} {1:10d} per ray".format("objects for one shaded hit", sum(counts.values())))
+
+
+def bench_primary_rays(hsize=640, vsize=360):
+  print("Primary ray generation ({0}x{1})".format(hsize, vsize))
+  world, camera = default_scene(hsize, vsize)
+  start = timeit.default_timer()
+  for y in range(vsize):
+    for x in range(hsize):
+      camera.ray_for_pixel(x, y)
+  report("ray_for_pixel, per pixel", timeit.default_timer() - start, hsize * vsize)
+  start = timeit.default_timer()
+  camera.rays_for_region(0, 0, hsize, vsize)
+  report("rays_for_region, per pixel", timeit.default_timer() - start, hsize * vsize)
+
+
+def random_canvas(width, height):
+  canvas = Canvas(width, height)
+  canvas.pixels[...] = np.random.default_rng(0).random((height, width, 3), dtype=np.float32)
+  return canvas
+
+
+def timed(fn):
+  start = timeit.default_timer()
+  fn()
+  return timeit.default_timer() - start
+
+
+def bench_ppm(path="bench_canvas.ppm"):
+  print("Canvas.to_ppm on random images")
+  try:
+    for label, width, height in (("1080p", 1920, 1080), ("4K", 3840, 2160)):
+      canvas = random_canvas(width, height)
+      report_seconds(label + " P3 text", timed(lambda: canvas.to_ppm(path)))
+      report_seconds(label + " P6 binary", timed(lambda: canvas.to_ppm(path, binary=True)))
+  finally:
+    if os.path.exists(path):
+      os.remove(path)
+
+
+def smooth_canvas(width, height):
+  # gradients with a little noise, closer to a render than random pixels
+  canvas = Canvas(width, height)
+  ys, xs = np.mgrid[0:height, 0:width]
+  canvas.pixels[..., 0] = xs / width
+  canvas.pixels[..., 1] = ys / height
+  canvas.pixels[..., 2] = 0.5 + 0.5 * np.sin(xs / 50.0) * np.cos(ys / 70.0)
+  canvas.pixels += np.random.default_rng(0).normal(0, 0.01, canvas.pixels.shape).astype(np.float32)
+  return canvas
+
+
+def bench_png(path="bench_canvas.png"):
+  print("Canvas.to_png on a 1080p image")
+  canvas = smooth_canvas(1920, 1080)
+  try:
+    for filter_type, level in (('none', 6), ('up', 6), ('paeth', 6), ('adaptive', 1),
+                               ('adaptive', 6), ('adaptive', 9)):
+      seconds = timed(lambda: canvas.to_png(path, filter_type=filter_type, level=level))
+      label = "{0}, level {1}".format(filter_type, level)
+      print("  {0:<32} {1:10.3f} s {2:8d} KB".format(label, seconds, os.path.getsize(path) // 1024))
+    start = timeit.default_timer()
+    future = canvas.to_png(path, background=True)
+    report_seconds("background: returns after", timeit.default_timer() - start)
+    future.result()
+    report_seconds("background: written after", timeit.default_timer() - start)
+  finally:
+    if os.path.exists(path):
+      os.remove(path)
+
+
+def resident_mb():
+  # current resident set size, Linux only
+  with open('/proc/self/status') as f:
+    for line in f:
+      if line.startswith('VmRSS:'):
+        return int(line.split()[1]) / 1024.0
+  return float('nan')
+
+
+def bench_mapped(path="bench_canvas.raw", width=7680, height=4320, tile=256):
+  print("MappedCanvas at {0}x{1} ({2} MB file)".format(width, height, width * height * 12 >> 20))
+  try:
+    with MappedCanvas(width, height, path) as canvas:
+      rng = np.random.default_rng(0)
+      tiles = rng.random((tile, tile, 3), dtype=np.float32)
+      def fill():
+        for y0 in range(0, height, tile):
+          for x0 in range(0, width, tile):
+            x1, y1 = min(x0 + tile, width), min(y0 + tile, height)
+            canvas.write_region(x0, y0, x1, y1, tiles[:y1 - y0, :x1 - x0])
+      report_seconds("write tiles", timed(fill))
+      print("  {0:<32} {1:10.1f} MB".format("resident after tiles", resident_mb()))
+      canvas.release(0, height)
+      report_seconds("P6 from mapping", timed(lambda: canvas.to_ppm(path + ".ppm", binary=True)))
+      print("  {0:<32} {1:10.1f} MB".format("resident after P6", resident_mb()))
+  finally:
+    for name in (path, path + ".ppm"):
+      if os.path.exists(name):
+        os.remove(name)
+
+
+def traced_peak(fn):
+  # seconds and peak traced allocation in MB
+  tracemalloc.start()
+  seconds = timed(fn)
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  return seconds, peak / (1 << 20)
+
+
+def bench_streaming(hsize=320, vsize=180, path="bench_render.ppm"):
+  print("Render to file ({0}x{1} default world)".format(hsize, vsize))
+  world, camera = default_scene(hsize, vsize)
+  try:
+    for label, fn in (("render + to_ppm", lambda: camera.render(world).to_ppm(path, binary=True)),
+                      ("render_to_file", lambda: camera.render_to_file(world, path, binary=True))):
+      seconds, peak = traced_peak(fn)
+      print("  {0:<32} {1:10.3f} s {2:8.2f} MB peak".format(label, seconds, peak))
+  finally:
+    if os.path.exists(path):
+      os.remove(path)
+
+
+def bench_image_io(path="bench_canvas"):
+  print("Image loading and float output on a 1080p image")
+  canvas = random_canvas(1920, 1080)
+  names = (path + ".ppm", path + ".pfm")
+  try:
+    canvas.to_ppm(names[0])
+    report_seconds("from_ppm P3", timed(lambda: Canvas.from_ppm(names[0])))
+    canvas.to_ppm(names[0], binary=True)
+    report_seconds("from_ppm P6", timed(lambda: Canvas.from_ppm(names[0])))
+    report_seconds("to_pfm", timed(lambda: canvas.to_pfm(names[1])))
+    report_seconds("from_pfm", timed(lambda: Canvas.from_pfm(names[1])))
+  finally:
+    for name in names:
+      if os.path.exists(name):
+        os.remove(name)
+
+
+def bench_cannon(count=1000):
+  print("Projectile trajectories ({0} projectiles)".format(count))
+  env = virtual_cannon.Environment(Vector(0, -0.1, 0), Vector(-0.01, 0, 0))
+  speeds = np.linspace(11.25, 11.25 / 4.0, count)
+  direction = Vector(1, 1.8, 0).normalize()
+  red = Color(1, 0, 0)
+
+  def scalar():
+    canvas = Canvas(900, 550)
+    for speed in speeds.tolist():
+      p = virtual_cannon.Projectile(Point(0, 1, 0), direction.scalar_multiply(speed))
+      while p.position.y > 0:
+        p = virtual_cannon.tick(env, p)
+        canvas.write_pixel(round(p.position.x), canvas.height - round(p.position.y), red)
+
+  def batched():
+    canvas = Canvas(900, 550)
+    path, reached = virtual_cannon.simulate_trajectories(
+      env, np.tile([0.0, 1.0, 0.0], (count, 1)), np.outer(speeds, [direction.x, direction.y, direction.z]))
+    virtual_cannon.rasterize(canvas, path[1:], reached[1:], red)
+
+  report_seconds("tick + write_pixel", timed(scalar))
+  report_seconds("simulate_trajectories", timed(batched))
+
+
+def shade_rows(width, y0, y1):
+  # stand-in for a worker rendering rows y0 <= y < y1
+  return np.random.default_rng(y0).random((y1 - y0, width, 3), dtype=np.float32)
+
+
+def rows_returned(args):
+  return args[1], shade_rows(*args)
+
+
+def rows_shared(args):
+  canvas, y0, y1 = args
+  canvas.write_region(0, y0, canvas.width, y1, shade_rows(canvas.width, y0, y1))
+  canvas.close()
+
+
+def bench_shared(width=3840, height=2160, processes=4, rows=64):
+  print("Collecting {0}x{1} rows from {2} worker processes".format(width, height, processes))
+  blocks = [(y0, min(y0 + rows, height)) for y0 in range(0, height, rows)]
+  with multiprocessing.get_context('spawn').Pool(processes) as pool:
+    pool.map(abs, range(processes))
+    def returned():
+      canvas = Canvas(width, height)
+      for y0, pixels in pool.imap_unordered(rows_returned, [(width, y0, y1) for y0, y1 in blocks]):
+        canvas.pixels[y0:y0 + len(pixels)] = pixels
+    report_seconds("pickled back to the parent", timed(returned))
+    with SharedCanvas(width, height) as canvas:
+      def shared():
+        list(pool.imap_unordered(rows_shared, [(canvas, y0, y1) for y0, y1 in blocks]))
+      report_seconds("written into SharedCanvas", timed(shared))
+
+
+def turntable_cameras(world, count, hsize, vsize):
+  cameras = []
+  for i in range(count):
+    angle = 2.0 * math.pi * i / count
+    camera = Camera(hsize, vsize, math.pi / 3.0)
+    camera.transform = world.view_transform(Point(5 * math.sin(angle), 1.5, -5 * math.cos(angle)),
+                                            Point(0, 1, 0), Vector(0, 1, 0))
+    cameras.append(camera)
+  return cameras
+
+
+def bench_views(count=8, hsize=60, vsize=30, number=100000):
+  print("Rendering {0} views of the chapter 10 scene at {1}x{2}".format(count, hsize, vsize))
+  world = ch10_program.build_world()
+  shape = world.shapes[2]
+  pattern = shape.material.pattern
+  point = Point(-0.5, 1.5, 0.5)
+  report("pattern lookup, two products",
+         timeit.timeit(lambda: pattern.transform.inverse() * (shape.world_to_object * point), number=number), number)
+  report("pattern lookup, world_to_pattern",
+         timeit.timeit(lambda: pattern.world_to_pattern(shape) * point, number=number), number)
+
+  world = ch10_program.build_world()
+  cameras = turntable_cameras(world, count, hsize, vsize)
+
+  def independent():
+    for camera in cameras:
+      # each job prepares the scene again, as separate Camera.render runs
+      # would; reassigning a pattern's transform empties its cache
+      world.prepared = False
+      for shape in world.shapes:
+        if shape.material.pattern:
+          shape.material.pattern.transform = shape.material.pattern.transform
+      camera.render(world)
+
+  seconds = timed(independent)
+  report_seconds("independent renders, per view", seconds / count)
+  world = ch10_program.build_world()
+  canvases, stats = world.render_views(turntable_cameras(world, count, hsize, vsize))
+  report_seconds("render_views, prepare", stats.prepare_seconds)
+  report_seconds("render_views, per view", stats.per_view_seconds())
+
+
+def sphere_field(count, seed=0):
+  # a floor plane and count small spheres scattered above it
+  rng = np.random.default_rng(seed)
+  world = World()
+  world.light = PointLight(Point(-10, 10, -10), Color(1, 1, 1))
+  world.add_shape(Plane())
+  for x, z, radius in zip(rng.uniform(-6, 6, count), rng.uniform(-2, 10, count), rng.uniform(0.1, 0.4, count)):
+    sphere = Sphere()
+    sphere.transform = Translation_Matrix(x, radius, z) * Scaling_Matrix(radius, radius, radius)
+    sphere.material.color = Color(*rng.uniform(0.2, 1.0, 3))
+    world.add_shape(sphere)
+  return world
+
+
+def sphere_field_camera(world, hsize, vsize):
+  camera = Camera(hsize, vsize, math.pi / 3.0)
+  camera.transform = world.view_transform(Point(0, 2, -6), Point(0, 0.5, 2), Vector(0, 1, 0))
+  return camera
+
+
+def linear_intersect(world, ray):
+  for shape in world.shapes:
+    ray.intersect(shape)
+  return ray.intersections
+
+
+def primary_rays(camera):
+  origins, directions = camera.rays_for_region(0, 0, camera.hsize, camera.vsize)
+  return [Ray(camera.origin, direction) for direction in directions.to_tuples()]
+
+
+def bench_culling(count=50, hsize=40, vsize=30):
+  # primary rays go through World.intersect one at a time here, since
+  # render traces them as packets
+  print("Bounding box culling ({0} spheres and a plane, {1}x{2})".format(count, hsize, vsize))
+  world = sphere_field(count)
+  camera = sphere_field_camera(world, hsize, vsize)
+  rays = primary_rays(camera)
+  report_seconds("without culling", timed(lambda: [linear_intersect(world, Ray(r.origin, r.direction))
+                                                   for r in rays]))
+  world.reset_culling_stats()
+  report_seconds("with culling", timed(lambda: [world.intersect(Ray(r.origin, r.direction)) for r in rays]))
+  tests, rejections = world.culling_stats()
+  print("  {0:<32} {1:10.1f} %".format("shape tests rejected", 100.0 * rejections / max(1, tests)))
+
+
+def bench_bvh(counts=(100, 1000, 10000), hsize=32, vsize=24, linear_limit=1000):
+  print("BVH against the culled linear loop (sphere field, {0}x{1})".format(hsize, vsize))
+  for count in counts:
+    world = sphere_field(count)
+    camera = sphere_field_camera(world, hsize, vsize)
+    if count <= linear_limit:
+      report_seconds("{0} spheres, linear".format(count), timed(lambda: camera.render(world)))
+    report_seconds("{0} spheres, BVH build".format(count), timed(world.build_bvh))
+    report_seconds("{0} spheres, BVH render".format(count), timed(lambda: camera.render(world)))
+    print("  {0:<32} {1:10.1f} per ray".format("node tests", world.bvh.node_tests / (hsize * vsize)))
+
+
+def bench_bvh_update(count=2000, moved=100, frames=5):
+  print("Keeping a BVH current ({0} spheres, {1} moved per frame)".format(count, moved))
+  world = sphere_field(count)
+  world.build_bvh()
+  rng = np.random.default_rng(1)
+  spheres = world.shapes[1:]
+
+  def move():
+    for index in rng.choice(len(spheres), moved, replace=False):
+      spheres[index].transform = Translation_Matrix(*rng.uniform(-0.05, 0.05, 3)) * spheres[index].transform
+
+  refit = 0.0
+  rebuild = 0.0
+  for frame in range(frames):
+    move()
+    refit += timed(world.prepare)
+    rebuild += timed(lambda: world.build_bvh())
+  report_seconds("refit, per frame", refit / frames)
+  report_seconds("full rebuild, per frame", rebuild / frames)
+  added = timed(lambda: [world.add_shape(Sphere()) for i in range(moved)])
+  report_seconds("insert {0} shapes".format(moved), added)
+  report_seconds("remove {0} shapes".format(moved), timed(lambda: [world.remove_shape(s) for s in spheres[:moved]]))
+  print("  {0:<32} {1:10d}".format("rebuilds", world.bvh_builds - 1 - frames))
+
+
+def bench_packets(counts=(100, 1000, 10000), hsize=64, vsize=48):
+  print("Primary hits, one ray at a time against packets (sphere field, {0}x{1})".format(hsize, vsize))
+  for count in counts:
+    world = sphere_field(count)
+    camera = sphere_field_camera(world, hsize, vsize)
+    world.build_bvh()
+    rays = primary_rays(camera)
+    report_seconds("{0} spheres, closest_hit".format(count), timed(lambda: [world.bvh.closest_hit(r) for r in rays]))
+    rows = [camera.rays_for_region(0, y, hsize, y + 1) for y in range(vsize)]
+    report_seconds("{0} spheres, row packets".format(count),
+                   timed(lambda: [world.closest_hits(origins, directions) for origins, directions in rows]))
+    origins, directions = camera.rays_for_region(0, 0, hsize, vsize)
+    report_seconds("{0} spheres, frame packet".format(count), timed(lambda: world.closest_hits(origins, directions)))
+
+
+def shadow_queries(world, camera):
+  # (point, direction to the light, distance) for every primary hit
+  queries = []
+  for ray in primary_rays(camera):
+    hit = ray.hit() if world.intersect(ray) else None
+    if hit:
+      point = hit.prepare_computations(ray).over_point
+      v = world.light.position.subtract(point)
+      queries.append((point, v.normalize(), v.magnitude()))
+  return queries
+
+
+def nearest_hit_shadowed(world, point, direction, distance):
+  # is_shadowed before any-hit queries
+  ray = Ray(point, direction)
+  world.intersect(ray)
+  hit = ray.hit()
+  return hit is not None and hit.t < distance
+
+
+def bench_shadows(counts=(50, 1000), hsize=40, vsize=30, linear_limit=100):
+  print("Shadow rays, nearest hit against any hit (sphere field, {0}x{1})".format(hsize, vsize))
+  for count in counts:
+    world = sphere_field(count)
+    queries = shadow_queries(world, sphere_field_camera(world, hsize, vsize))
+    labels = ("linear", "BVH") if count <= linear_limit else ("BVH",)
+    for label in labels:
+      if label == "BVH":
+        world.build_bvh()
+      report_seconds("{0} spheres, {1}, nearest hit".format(count, label),
+                     timed(lambda: [nearest_hit_shadowed(world, *q) for q in queries]))
+      report_seconds("{0} spheres, {1}, any hit".format(count, label),
+                     timed(lambda: [world.is_occluded(*q) for q in queries]))
+    print("  {0:<32} {1:10.1f} %".format("occluded", 100.0 * sum(world.is_occluded(*q) for q in queries) /
+                                         max(1, len(queries))))
+
+
+BENCHMARKS = {
+  'tuple_backends': bench_tuple_backends,
+  'allocations': bench_allocations,
+  'primary_rays': bench_primary_rays,
+  'ppm': bench_ppm,
+  'png': bench_png,
+  'mapped': bench_mapped,
+  'streaming': bench_streaming,
+  'image_io': bench_image_io,
+  'cannon': bench_cannon,
+  'shared': bench_shared,
+  'views': bench_views,
+  'culling': bench_culling,
+  'bvh': bench_bvh,
+  'bvh_update': bench_bvh_update,
+  'packets': bench_packets,
+  'shadows': bench_shadows,
+}
+
+if __name__ == '__main__':
+
+  names = sys.argv[1:] or list(BENCHMARKS)
+  for name in names:
+    BENCHMARKS[name]()
@@ -0,0 +1,106 @@
+import math
+
+from tuple import Point
+
+
+class BoundingBox:
+  # axis-aligned box from minimum to maximum; components may be infinite.
+  # A new box is empty (minimum above maximum) until points are added
+  def __init__(self, minimum=None, maximum=None):
+    self.minimum = minimum if minimum is not None else Point(math.inf, math.inf, math.inf)
+    self.maximum = maximum if maximum is not None else Point(-math.inf, -math.inf, -math.inf)
+
+  @staticmethod
+  def infinite():
+    return BoundingBox(Point(-math.inf, -math.inf, -math.inf), Point(math.inf, math.inf, math.inf))
+
+  def is_empty(self):
+    return (self.minimum.x > self.maximum.x or self.minimum.y > self.maximum.y or
+            self.minimum.z > self.maximum.z)
+
+  def is_infinite(self):
+    return any(math.isinf(v) for v in (self.minimum.x, self.minimum.y, self.minimum.z,
+                                       self.maximum.x, self.maximum.y, self.maximum.z))
+
+  def add_point(self, point):
+    self.minimum = Point(min(self.minimum.x, point.x), min(self.minimum.y, point.y), min(self.minimum.z, point.z))
+    self.maximum = Point(max(self.maximum.x, point.x), max(self.maximum.y, point.y), max(self.maximum.z, point.z))
+
+  def merge(self, box):
+    self.add_point(box.minimum)
+    self.add_point(box.maximum)
+
+  def contains_point(self, point):
+    return (self.minimum.x <= point.x <= self.maximum.x and
+            self.minimum.y <= point.y <= self.maximum.y and
+            self.minimum.z <= point.z <= self.maximum.z)
+
+  def padded(self, amount):
+    return BoundingBox(Point(self.minimum.x - amount, self.minimum.y - amount, self.minimum.z - amount),
+                       Point(self.maximum.x + amount, self.maximum.y + amount, self.maximum.z + amount))
+
+  def transform(self, matrix):
+    # Arvo's method: each world axis adds up the smaller and larger of every
+    # matrix term, skipping zero terms so an infinite extent only spreads to
+    # the axes it actually maps onto
+    if self.is_empty():
+      return BoundingBox()
+    if not matrix.affine:
+      return BoundingBox.infinite()
+    lows = (self.minimum.x, self.minimum.y, self.minimum.z)
+    highs = (self.maximum.x, self.maximum.y, self.maximum.z)
+    minimum = []
+    maximum = []
+    for row in matrix.data[:3].tolist():
+      low = high = row[3]
+      for m, a, b in zip(row, lows, highs):
+        if m != 0:
+          low += min(m * a, m * b)
+          high += max(m * a, m * b)
+      minimum.append(low)
+      maximum.append(high)
+    return BoundingBox(Point(*minimum), Point(*maximum))
+
+  def intersects(self, origin, inverse_direction):
+    # slab test against the whole line through origin, negative t included;
+    # origin is an (x, y, z) tuple and inverse_direction comes from
+    # inverse_direction(). Terms that come out as NaN (origin on a slab
+    # plane with a zero direction) are ignored, so the test never rejects a
+    # box the line touches
+    tmin = -math.inf
+    tmax = math.inf
+    ox, oy, oz = origin
+    ix, iy, iz = inverse_direction
+    t1 = (self.minimum.x - ox) * ix
+    t2 = (self.maximum.x - ox) * ix
+    if t1 > t2:
+      t1, t2 = t2, t1
+    if t1 > tmin:
+      tmin = t1
+    if t2 < tmax:
+      tmax = t2
+    t1 = (self.minimum.y - oy) * iy
+    t2 = (self.maximum.y - oy) * iy
+    if t1 > t2:
+      t1, t2 = t2, t1
+    if t1 > tmin:
+      tmin = t1
+    if t2 < tmax:
+      tmax = t2
+    t1 = (self.minimum.z - oz) * iz
+    t2 = (self.maximum.z - oz) * iz
+    if t1 > t2:
+      t1, t2 = t2, t1
+    if t1 > tmin:
+      tmin = t1
+    if t2 < tmax:
+      tmax = t2
+    # both infinities on the same side mean a zero direction outside a slab
+    return tmin <= tmax and tmin < math.inf and tmax > -math.inf
+
+
+def inverse_direction(direction):
+  # per-axis reciprocals for BoundingBox.intersects; a zero component
+  # becomes an infinity of the same sign
+  return tuple(1.0 / d if d != 0 else math.copysign(math.inf, d)
+               for d in (direction.x, direction.y, direction.z))
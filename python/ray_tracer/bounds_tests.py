@@ -0,0 +1,66 @@
+import math
+import unittest
+
+from bounds import BoundingBox, inverse_direction
+from matrix import Rotation_Axis, Rotation_Matrix, Scaling_Matrix, Translation_Matrix
+from tuple import Point, Vector
+
+class BoundsTestCase(unittest.TestCase):
+
+  def test_bounding_box_init(self):
+    box = BoundingBox()
+    self.assertTrue(box.is_empty())
+    box.add_point(Point(-5, 2, 0))
+    box.add_point(Point(7, 0, -3))
+    self.assertFalse(box.is_empty())
+    self.assertTrue(box.minimum.equals(Point(-5, 0, -3)))
+    self.assertTrue(box.maximum.equals(Point(7, 2, 0)))
+    box.merge(BoundingBox(Point(-1, -1, -1), Point(1, 8, 1)))
+    self.assertTrue(box.maximum.equals(Point(7, 8, 1)))
+    self.assertTrue(box.contains_point(Point(0, 0, 0)))
+    self.assertFalse(box.contains_point(Point(0, 9, 0)))
+    self.assertFalse(box.is_infinite())
+    self.assertTrue(BoundingBox.infinite().is_infinite())
+
+  def test_bounding_box_transform(self):
+    box = BoundingBox(Point(-1, -1, -1), Point(1, 1, 1))
+    moved = box.transform(Translation_Matrix(1, -3, 5) * Scaling_Matrix(0.5, 2, 4))
+    self.assertTrue(moved.minimum.equals(Point(0.5, -5, 1)))
+    self.assertTrue(moved.maximum.equals(Point(1.5, -1, 9)))
+    turned = box.transform(Rotation_Matrix(Rotation_Axis.Y, 45))
+    self.assertTrue(turned.maximum.equals(Point(math.sqrt(2), 1, math.sqrt(2))))
+    # an infinite extent only spreads to the axes it maps onto
+    plane = BoundingBox(Point(-math.inf, 0, -math.inf), Point(math.inf, 0, math.inf))
+    lifted = plane.transform(Translation_Matrix(0, 2, 0))
+    self.assertEqual((lifted.minimum.y, lifted.maximum.y), (2, 2))
+    self.assertEqual(lifted.minimum.x, -math.inf)
+    wall = plane.transform(Rotation_Matrix(Rotation_Axis.X, 90))
+    self.assertEqual(wall.minimum.y, -math.inf)
+    self.assertEqual(wall.maximum.z, math.inf)
+
+  def test_bounding_box_intersects(self):
+    box = BoundingBox(Point(5, -2, 0), Point(11, 4, 7))
+    cases = [(Point(15, 1, 2), Vector(-1, 0, 0), True),
+             (Point(-5, -1, 4), Vector(1, 0, 0), True),
+             (Point(7, 6, 5), Vector(0, -1, 0), True),
+             (Point(9, -5, 6), Vector(0, 1, 0), True),
+             (Point(8, 2, 12), Vector(0, 0, -1), True),
+             (Point(6, 0, -5), Vector(0, 0, 1), True),
+             (Point(8, 1, 3.5), Vector(0, 0, 1), True),
+             # behind the origin still counts: the whole line is tested
+             (Point(20, 1, 2), Vector(1, 0, 0), True),
+             (Point(9, -1, -8), Vector(2, 4, 6), False),
+             (Point(8, 3, -4), Vector(6, 2, 4), False),
+             (Point(9, -1, -2), Vector(4, 6, 2), False),
+             (Point(4, 0, 9), Vector(0, 0, -1), False),
+             (Point(8, 6, -1), Vector(0, -1, 0), False),
+             (Point(12, 5, 4), Vector(-1, 0, 0), False),
+             # zero direction with the origin on a slab plane
+             (Point(5, 1, 2), Vector(0, 0, 1), True)]
+    for origin, direction, expected in cases:
+      self.assertEqual(box.intersects((origin.x, origin.y, origin.z), inverse_direction(direction.normalize())),
+                       expected)
+    self.assertTrue(BoundingBox.infinite().intersects((0, 0, 0), inverse_direction(Vector(0, 0, 1))))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,516 @@
+import math
+import numpy as np
+
+from bounds import inverse_direction
+from tuple import Point, Vector
+
+# most shapes in a leaf; bigger nodes are always split
+LEAF_SIZE = 4
+# centroid bins per axis when searching for the SAH split
+SAH_BINS = 16
+# cost of visiting a node relative to intersecting one shape, for sah_cost
+TRAVERSAL_COST = 0.5
+# rebuild once refits and inserts push sah_cost this far past the cost
+# right after the build
+REBUILD_COST_RATIO = 1.5
+# ...or once this fraction of the shapes has been removed
+REBUILD_REMOVED_FRACTION = 0.25
+# intersect_packet hands a node's rays to the scalar traversal once fewer
+# than this many are left
+PACKET_MIN_RAYS = 32
+
+
+def surface_area(minimum, maximum):
+  # surface areas of the (N,3) boxes minimum..maximum; empty boxes give 0
+  extent = np.maximum(maximum - minimum, 0.0)
+  return 2.0 * (extent[..., 0] * extent[..., 1] + extent[..., 1] * extent[..., 2] +
+                extent[..., 2] * extent[..., 0])
+
+
+def line_range(box, origin, inverse):
+  # (tmin, tmax) where the whole line through origin crosses the box given as
+  # (minx, miny, minz, maxx, maxy, maxz), the same slab test as
+  # BoundingBox.intersects; NaN terms are ignored
+  tmin = -math.inf
+  tmax = math.inf
+  for axis in range(3):
+    t1 = (box[axis] - origin[axis]) * inverse[axis]
+    t2 = (box[axis + 3] - origin[axis]) * inverse[axis]
+    if t1 > t2:
+      t1, t2 = t2, t1
+    if t1 > tmin:
+      tmin = t1
+    if t2 < tmax:
+      tmax = t2
+  return tmin, tmax
+
+
+def crosses(tmin, tmax):
+  return tmin <= tmax and tmin < math.inf and tmax > -math.inf
+
+
+def merge_hits(ts, index, rays, best_t, best_index):
+  # fold shape index's (M,k) packet intersections for the rays indexed by
+  # rays into best_t/best_index with the same rule as BVH._closest
+  for t in ts.T:
+    t_best = best_t[rays]
+    better = (t >= 0) & ((t < t_best) | ((t == t_best) & (index < best_index[rays])))
+    best_t[rays[better]] = t[better]
+    best_index[rays[better]] = index
+
+
+def slab_entry(minimum, maximum, origins, inverse):
+  # line_range and crosses vectorized over the leading axes, broadcasting
+  # boxes against rays: where each line enters its box and whether it
+  # crosses it at or after t = 0. NaN terms are dropped by fmax/fmin the
+  # same way line_range skips them
+  tmin = -math.inf
+  tmax = math.inf
+  for axis in range(3):
+    scale = inverse[..., axis]
+    origin = origins[..., axis]
+    with np.errstate(invalid='ignore'):
+      t1 = (minimum[..., axis] - origin) * scale
+      t2 = (maximum[..., axis] - origin) * scale
+    swap = t1 > t2
+    tmin = np.fmax(tmin, np.where(swap, t2, t1))
+    tmax = np.fmin(tmax, np.where(swap, t1, t2))
+  return tmin, (tmin <= tmax) & (tmin < math.inf) & (tmax > -math.inf) & (tmax >= 0)
+
+
+def enter_packet(minimum, maximum, rays, origins, inverse, best_t):
+  # BVH._enter for the rays indexed by rays: the ones entering the box
+  # minimum..maximum within [0, best_t] and where they enter it
+  tmin, inside = slab_entry(minimum, maximum, origins[rays], inverse[rays])
+  inside &= tmin <= best_t[rays]
+  return rays[inside], tmin[inside]
+
+
+class BVH:
+  # bounding volume hierarchy over a list of shapes, built top down with a
+  # binned surface area heuristic. Nodes are flattened in depth-first order:
+  # an interior node's left child directly follows it and node_right holds
+  # the right child; a leaf has node_right -1 and covers
+  # order[node_start:node_start + node_count].
+  # The numpy arrays (node_min, node_max, ...) are the canonical layout and
+  # nodes mirrors them as plain tuples for fast scalar traversal. Shapes
+  # with infinite bounds (planes) can't be placed in a tree and are kept in
+  # unbounded, which every query tests directly.
+  #
+  # Between rebuilds the tree is kept up to date incrementally: refit()
+  # re-reads the boxes of moved shapes and grows or shrinks their ancestors,
+  # insert() queues new shapes in pending (tested directly, like unbounded)
+  # and remove() leaves a None tombstone so indices keep the shapes' order.
+  # needs_rebuild() says when that has degraded the tree enough to rebuild.
+
+  def __init__(self, shapes, leaf_size=LEAF_SIZE, bins=SAH_BINS):
+    self.shapes = list(shapes)
+    self.leaf_size = leaf_size
+    self.bins = bins
+    self.index_of = {shape: i for i, shape in enumerate(self.shapes)}
+    boxes = [shape.world_bounds for shape in self.shapes]
+    self.unbounded = [i for i, box in enumerate(boxes) if box.is_infinite()]
+    bounded = np.array([i for i, box in enumerate(boxes) if not box.is_infinite()], dtype=np.int64)
+    self.box_min = np.array([(b.minimum.x, b.minimum.y, b.minimum.z) for b in boxes], dtype=float).reshape(-1, 3)
+    self.box_max = np.array([(b.maximum.x, b.maximum.y, b.maximum.z) for b in boxes], dtype=float).reshape(-1, 3)
+    self.boxes = [tuple(lo) + tuple(hi) for lo, hi in zip(self.box_min.tolist(), self.box_max.tolist())]
+    # unbounded shapes get NaN centroids, but only bounded ones are binned
+    with np.errstate(invalid='ignore'):
+      self.centroids = (self.box_min + self.box_max) * 0.5
+    self._build(bounded)
+    self.pending = []
+    self.removed = 0
+    self.node_tests = 0
+    self.refits = 0
+    self.build_cost = self.sah_cost()
+
+  def _build(self, bounded):
+    nodes = []
+    order = []
+    # stack of (indices, parent, is right child); children are emitted
+    # depth first so a left child always follows its parent
+    stack = [(bounded, -1, False)]
+    while stack:
+      indices, parent, right = stack.pop()
+      index = len(nodes)
+      if parent >= 0 and right:
+        nodes[parent][3] = index
+      lo = self.box_min[indices].min(axis=0) if len(indices) else np.zeros(3)
+      hi = self.box_max[indices].max(axis=0) if len(indices) else np.zeros(3)
+      split = self._split(indices) if len(indices) > self.leaf_size else None
+      if split is None:
+        nodes.append([lo, hi, parent, -1, len(order), len(indices)])
+        order.extend(indices.tolist())
+      else:
+        nodes.append([lo, hi, parent, -1, 0, 0])
+        left, right_indices = split
+        stack.append((right_indices, index, True))
+        stack.append((left, index, False))
+    self.order = np.array(order, dtype=np.int64)
+    self.node_min = np.array([n[0] for n in nodes], dtype=float).reshape(-1, 3)
+    self.node_max = np.array([n[1] for n in nodes], dtype=float).reshape(-1, 3)
+    self.node_parent = np.array([n[2] for n in nodes], dtype=np.int64)
+    self.node_right = np.array([n[3] for n in nodes], dtype=np.int64)
+    self.node_start = np.array([n[4] for n in nodes], dtype=np.int64)
+    self.node_count = np.array([n[5] for n in nodes], dtype=np.int64)
+    self.leaf_of = np.full(len(self.shapes), -1, dtype=np.int64)
+    for index in np.nonzero(self.node_right < 0)[0]:
+      self.leaf_of[self.order[self.node_start[index]:self.node_start[index] + self.node_count[index]]] = index
+    self._mirror()
+
+  def _mirror(self):
+    # plain tuples for the scalar traversal: box, right child and, for a
+    # leaf, the list of its live shapes
+    order = self.order.tolist()
+    self.leaf_shapes = [order[start:start + count] if right < 0 else None
+                        for right, start, count in zip(self.node_right.tolist(), self.node_start.tolist(),
+                                                       self.node_count.tolist())]
+    self.nodes = [self._node_tuple(index) for index in range(len(self.leaf_shapes))]
+
+  def _node_tuple(self, index):
+    return (tuple(self.node_min[index].tolist()) + tuple(self.node_max[index].tolist()) +
+            (int(self.node_right[index]), self.leaf_shapes[index]))
+
+  def _split(self, indices):
+    # best binned SAH split as (left, right) index arrays; nodes this big
+    # are always split, so only the plane is chosen here.
+    # All three axes are binned at once: bin b on axis a is row a * bins + b
+    bins = self.bins
+    centroids = self.centroids[indices]
+    cmin = centroids.min(axis=0)
+    extent = centroids.max(axis=0) - cmin
+    axes = extent > 0
+    if not axes.any():
+      # every centroid coincides, so any split is as good as another
+      half = len(indices) // 2
+      return indices[:half], indices[half:]
+    scale = np.where(axes, bins / np.where(axes, extent, 1.0), 0.0)
+    bin_ids = np.minimum(((centroids - cmin) * scale).astype(np.int64), bins - 1)
+    rows = (bin_ids + np.arange(3) * bins).ravel()
+    counts = np.bincount(rows, minlength=3 * bins).reshape(3, bins)
+    bin_min = np.full((3 * bins, 3), math.inf)
+    bin_max = np.full((3 * bins, 3), -math.inf)
+    np.minimum.at(bin_min, rows, np.repeat(self.box_min[indices], 3, axis=0))
+    np.maximum.at(bin_max, rows, np.repeat(self.box_max[indices], 3, axis=0))
+    bin_min = bin_min.reshape(3, bins, 3)
+    bin_max = bin_max.reshape(3, bins, 3)
+    # areas and counts left and right of each of the bins - 1 planes
+    left_area = surface_area(np.minimum.accumulate(bin_min, axis=1)[:, :-1],
+                             np.maximum.accumulate(bin_max, axis=1)[:, :-1])
+    right_area = surface_area(np.minimum.accumulate(bin_min[:, ::-1], axis=1)[:, ::-1][:, 1:],
+                              np.maximum.accumulate(bin_max[:, ::-1], axis=1)[:, ::-1][:, 1:])
+    left_count = np.cumsum(counts, axis=1)[:, :-1]
+    right_count = len(indices) - left_count
+    with np.errstate(invalid='ignore'):
+      cost = left_area * left_count + right_area * right_count
+    cost[(left_count == 0) | (right_count == 0) | ~axes[:, np.newaxis]] = math.inf
+    axis, plane = np.unravel_index(int(np.argmin(cost)), cost.shape)
+    left = bin_ids[:, axis] <= plane
+    return indices[left], indices[~left]
+
+  def sah_cost(self):
+    # expected cost of a random ray relative to the root, by the same
+    # heuristic the builder minimizes; pending shapes are tested by every ray
+    areas = surface_area(self.node_min, self.node_max)
+    root = areas[0]
+    if root <= 0:
+      return float(self.node_count.sum() + len(self.pending))
+    leaves = self.node_right < 0
+    tree = TRAVERSAL_COST * areas[~leaves].sum() + (areas[leaves] * self.node_count[leaves]).sum()
+    return float(tree / root + len(self.pending))
+
+  def needs_rebuild(self):
+    return (self.sah_cost() > REBUILD_COST_RATIO * max(self.build_cost, 1.0) or
+            self.removed > REBUILD_REMOVED_FRACTION * len(self.shapes))
+
+  def insert(self, shape):
+    # add shape after every existing one; it is tested directly until the
+    # next rebuild
+    index = len(self.shapes)
+    self.shapes.append(shape)
+    self.index_of[shape] = index
+    box = shape.world_bounds
+    self.box_min = np.vstack((self.box_min, (box.minimum.x, box.minimum.y, box.minimum.z)))
+    self.box_max = np.vstack((self.box_max, (box.maximum.x, box.maximum.y, box.maximum.z)))
+    self.boxes.append(tuple(self.box_min[index].tolist()) + tuple(self.box_max[index].tolist()))
+    self.leaf_of = np.append(self.leaf_of, -1)
+    if box.is_infinite():
+      self.unbounded.append(index)
+    else:
+      self.pending.append(index)
+    return index
+
+  def remove(self, shape):
+    index = self.index_of.pop(shape)
+    self.shapes[index] = None
+    self.removed += 1
+    if index in self.unbounded:
+      self.unbounded.remove(index)
+    elif index in self.pending:
+      self.pending.remove(index)
+    else:
+      leaf = self.leaf_of[index]
+      self.leaf_of[index] = -1
+      self.leaf_shapes[leaf].remove(index)
+      self.node_count[leaf] -= 1
+      self._refit_nodes([leaf])
+
+  def refit(self, shapes):
+    # re-read the boxes of shapes that moved and refit the nodes above
+    # them; returns False when a shape switched between bounded and
+    # unbounded, which only a rebuild can handle
+    leaves = []
+    for shape in shapes:
+      index = self.index_of.get(shape)
+      if index is None:
+        continue
+      box = shape.world_bounds
+      if box.is_infinite() != (index in self.unbounded):
+        return False
+      self.box_min[index] = (box.minimum.x, box.minimum.y, box.minimum.z)
+      self.box_max[index] = (box.maximum.x, box.maximum.y, box.maximum.z)
+      self.boxes[index] = tuple(self.box_min[index].tolist()) + tuple(self.box_max[index].tolist())
+      if self.leaf_of[index] >= 0:
+        leaves.append(self.leaf_of[index])
+    self._refit_nodes(leaves)
+    self.refits += 1
+    return True
+
+  def _refit_nodes(self, leaves):
+    # recompute the leaves and all their ancestors bottom up; children
+    # always have higher indices than their parent, so descending order
+    # visits every child first
+    nodes = set()
+    for index in leaves:
+      while index >= 0 and index not in nodes:
+        nodes.add(index)
+        index = self.node_parent[index]
+    for index in sorted(nodes, reverse=True):
+      right = self.node_right[index]
+      if right >= 0:
+        self.node_min[index] = np.minimum(self.node_min[index + 1], self.node_min[right])
+        self.node_max[index] = np.maximum(self.node_max[index + 1], self.node_max[right])
+      elif self.leaf_shapes[index]:
+        self.node_min[index] = self.box_min[self.leaf_shapes[index]].min(axis=0)
+        self.node_max[index] = self.box_max[self.leaf_shapes[index]].max(axis=0)
+      else:
+        # an emptied leaf shrinks to a point inside its old box
+        self.node_max[index] = self.node_min[index]
+      self.nodes[index] = self._node_tuple(index)
+
+  def candidates(self, ray):
+    # indices into shapes of every shape whose box the ray's line crosses,
+    # in order, so intersecting them gives exactly the linear result
+    origin = (ray.origin.x, ray.origin.y, ray.origin.z)
+    inverse = inverse_direction(ray.direction)
+    nodes = self.nodes
+    boxes = self.boxes
+    found = list(self.unbounded)
+    for i in self.pending:
+      if crosses(*line_range(boxes[i], origin, inverse)):
+        found.append(i)
+    stack = [0] if nodes else []
+    tests = 0
+    while stack:
+      index = stack.pop()
+      node = nodes[index]
+      tests += 1
+      if not crosses(*line_range(node, origin, inverse)):
+        continue
+      leaf = node[7]
+      if leaf is None:
+        stack.append(node[6])
+        stack.append(index + 1)
+        continue
+      for i in leaf:
+        if crosses(*line_range(boxes[i], origin, inverse)):
+          found.append(i)
+    self.node_tests += tests
+    found.sort()
+    return found
+
+  def closest_hit(self, ray):
+    # (t, shape index) of the hit ray.hit() would return after intersecting
+    # every shape: the smallest t >= 0, ties going to the earlier shape; None
+    # on a miss. Nodes are visited near to far and skipped once they start
+    # beyond the best hit so far
+    origin = (ray.origin.x, ray.origin.y, ray.origin.z)
+    inverse = inverse_direction(ray.direction)
+    best_t = math.inf
+    best_index = -1
+    nodes = self.nodes
+    boxes = self.boxes
+    for i in self.unbounded:
+      best_t, best_index = self._closest(ray, i, best_t, best_index)
+    for i in self.pending:
+      if self._enter(boxes[i], origin, inverse, best_t) is not None:
+        best_t, best_index = self._closest(ray, i, best_t, best_index)
+    if nodes:
+      best_t, best_index = self._traverse(ray, origin, inverse, 0, best_t, best_index)
+    if best_index < 0:
+      return None
+    return best_t, best_index
+
+  def _traverse(self, ray, origin, inverse, root, best_t, best_index):
+    # closest_hit's walk of the subtree under root, continuing from the
+    # best hit so far
+    nodes = self.nodes
+    boxes = self.boxes
+    stack = []
+    entry = self._enter(nodes[root], origin, inverse, best_t)
+    if entry is not None:
+      stack.append((root, entry))
+    tests = 1
+    while stack:
+      index, entry = stack.pop()
+      if entry > best_t:
+        continue
+      node = nodes[index]
+      leaf = node[7]
+      if leaf is None:
+        left = index + 1
+        right = node[6]
+        left_entry = self._enter(nodes[left], origin, inverse, best_t)
+        right_entry = self._enter(nodes[right], origin, inverse, best_t)
+        tests += 2
+        # push the farther child first so the nearer one is visited next
+        if left_entry is not None and right_entry is not None and right_entry < left_entry:
+          stack.append((left, left_entry))
+          stack.append((right, right_entry))
+        else:
+          if right_entry is not None:
+            stack.append((right, right_entry))
+          if left_entry is not None:
+            stack.append((left, left_entry))
+        continue
+      for i in leaf:
+        if self._enter(boxes[i], origin, inverse, best_t) is not None:
+          best_t, best_index = self._closest(ray, i, best_t, best_index)
+    self.node_tests += tests
+    return best_t, best_index
+
+  def any_hit(self, ray, distance):
+    # whether any shape hits ray in [0, distance); stops at the first one
+    # found, so nodes are visited in stack order rather than near to far
+    origin = (ray.origin.x, ray.origin.y, ray.origin.z)
+    inverse = inverse_direction(ray.direction)
+    nodes = self.nodes
+    boxes = self.boxes
+    shapes = self.shapes
+    for i in self.unbounded:
+      if shapes[i].occludes(ray, distance):
+        return True
+    for i in self.pending:
+      if self._enter(boxes[i], origin, inverse, distance) is not None and shapes[i].occludes(ray, distance):
+        return True
+    stack = [0] if nodes else []
+    tests = 0
+    while stack:
+      index = stack.pop()
+      node = nodes[index]
+      tests += 1
+      if self._enter(node, origin, inverse, distance) is None:
+        continue
+      leaf = node[7]
+      if leaf is None:
+        stack.append(node[6])
+        stack.append(index + 1)
+        continue
+      for i in leaf:
+        if self._enter(boxes[i], origin, inverse, distance) is not None and shapes[i].occludes(ray, distance):
+          self.node_tests += tests
+          return True
+    self.node_tests += tests
+    return False
+
+  @staticmethod
+  def _enter(box, origin, inverse, best_t):
+    # where the ray enters the box within [0, best_t], or None if it doesn't
+    tmin, tmax = line_range(box, origin, inverse)
+    if not crosses(tmin, tmax) or tmax < 0 or tmin > best_t:
+      return None
+    return tmin
+
+  def _closest(self, ray, index, best_t, best_index):
+    for t in self.shapes[index].intersect(ray):
+      if t >= 0 and (t < best_t or (t == best_t and index < best_index)):
+        best_t, best_index = t, index
+    return best_t, best_index
+
+  def intersect_packet(self, origins, directions):
+    # closest_hit for N rays at once, given as (N,3) origin and direction
+    # arrays; returns (t, index) arrays holding inf and -1 where a ray
+    # misses. Each stack entry carries the rays still inside that node, so
+    # the tree is walked once for the whole packet with one numpy slab test
+    # per node and one packet intersection per shape, down to where the
+    # packet has thinned out enough that closest_hit's loop is cheaper
+    origins = np.asarray(origins, dtype=float)
+    directions = np.asarray(directions, dtype=float)
+    count = len(origins)
+    with np.errstate(divide='ignore'):
+      inverse = 1.0 / directions
+    best_t = np.full(count, math.inf)
+    best_index = np.full(count, -1, dtype=np.int64)
+    everyone = np.arange(count)
+    for i in self.unbounded:
+      self._closest_packet(i, everyone, origins, directions, best_t, best_index)
+    for i in self.pending:
+      rays, _ = enter_packet(self.box_min[i], self.box_max[i], everyone, origins, inverse, best_t)
+      self._closest_packet(i, rays, origins, directions, best_t, best_index)
+    stack = []
+    if self.nodes and count:
+      rays, entry = enter_packet(self.node_min[0], self.node_max[0], everyone, origins, inverse, best_t)
+      if len(rays):
+        stack.append((0, rays, entry))
+    tests = count
+    while stack:
+      index, rays, entry = stack.pop()
+      rays = rays[entry <= best_t[rays]]
+      if not len(rays):
+        continue
+      if len(rays) < PACKET_MIN_RAYS:
+        # too few rays left to pay for the array operations
+        self._traverse_rays(index, rays, origins, directions, best_t, best_index)
+        continue
+      leaf = self.leaf_shapes[index]
+      if leaf is None:
+        left = index + 1
+        right = self.node_right[index]
+        left_rays, left_entry = enter_packet(self.node_min[left], self.node_max[left], rays,
+                                             origins, inverse, best_t)
+        right_rays, right_entry = enter_packet(self.node_min[right], self.node_max[right], rays,
+                                               origins, inverse, best_t)
+        tests += 2 * len(rays)
+        # push the child the packet enters farther away first, on average
+        if (len(left_rays) and len(right_rays) and
+            right_entry.sum() * len(left_rays) < left_entry.sum() * len(right_rays)):
+          stack.append((left, left_rays, left_entry))
+          stack.append((right, right_rays, right_entry))
+        else:
+          if len(right_rays):
+            stack.append((right, right_rays, right_entry))
+          if len(left_rays):
+            stack.append((left, left_rays, left_entry))
+        continue
+      for i in leaf:
+        hit, _ = enter_packet(self.box_min[i], self.box_max[i], rays, origins, inverse, best_t)
+        self._closest_packet(i, hit, origins, directions, best_t, best_index)
+    self.node_tests += tests
+    return best_t, best_index
+
+  def _traverse_rays(self, root, rays, origins, directions, best_t, best_index):
+    # finish the subtree under root one ray at a time with the scalar
+    # traversal; imported here since ray_tracer imports this module
+    from ray_tracer import Ray
+    for r, origin, direction in zip(rays.tolist(), origins[rays].tolist(), directions[rays].tolist()):
+      ray = Ray(Point(*origin), Vector(*direction))
+      t, index = self._traverse(ray, tuple(origin), inverse_direction(ray.direction), root,
+                                best_t[r], best_index[r])
+      best_t[r] = t
+      best_index[r] = index
+
+  def _closest_packet(self, index, rays, origins, directions, best_t, best_index):
+    if not len(rays):
+      return
+    merge_hits(self.shapes[index].intersect_packet(origins[rays], directions[rays]), index, rays,
+               best_t, best_index)
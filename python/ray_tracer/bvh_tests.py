@@ -0,0 +1,260 @@
+import math
+import numpy as np
+import random
+import unittest
+
+from bvh import BVH
+from canvas import Color
+from matrix import Rotation_Axis, Rotation_Matrix, Scaling_Matrix, Shearing_Matrix, Translation_Matrix
+from ray_tracer import Camera, PointLight, Ray, World
+from shape import Plane, Sphere
+from tuple import Point, Vector
+
+def random_world(count, seed):
+  rng = random.Random(seed)
+  world = World()
+  world.light = PointLight(Point(-10, 10, -10), Color(1, 1, 1))
+  for i in range(count):
+    if i % 20 == 0:
+      shape = Plane()
+      shape.transform = Translation_Matrix(0, rng.uniform(-6, -5), 0)
+    else:
+      shape = Sphere()
+      shape.transform = Translation_Matrix(rng.uniform(-5, 5), rng.uniform(-5, 5), rng.uniform(-5, 5)) * \
+                        Rotation_Matrix(Rotation_Axis.Y, rng.uniform(0, 360)) * \
+                        Shearing_Matrix(*[rng.choice([0, 0.3]) for j in range(6)]) * \
+                        Scaling_Matrix(rng.uniform(0.1, 1), rng.uniform(0.05, 1), rng.uniform(0.1, 1))
+    world.add_shape(shape)
+  # an exact duplicate, so some hits tie
+  twin = Sphere()
+  twin.transform = world.shapes[1].transform
+  world.add_shape(twin)
+  return world
+
+def random_rays(count, seed, target):
+  rng = random.Random(seed)
+  rays = []
+  for i in range(count):
+    origin = Point(rng.uniform(-8, 8), rng.uniform(-8, 8), rng.uniform(-8, 8))
+    direction = Vector(rng.choice([0, rng.uniform(-1, 1)]), rng.uniform(-1, 1), rng.choice([0, rng.uniform(-1, 1)]))
+    if i % 10 == 0:
+      direction = target.subtract(origin)
+    rays.append((origin, direction))
+  return rays
+
+def linear_intersections(world, ray):
+  for shape in world.shapes:
+    ray.intersect(shape)
+  return ray.intersections
+
+def assert_matches_linear(test, world, rays):
+  for origin, direction in rays:
+    expected = linear_intersections(world, Ray(origin, direction))
+    test.assertEqual(world.intersect(Ray(origin, direction)), expected)
+    color = world.color_at(Ray(origin, direction))
+    expected = world_color_linear(world, origin, direction)
+    test.assertEqual((color.r, color.g, color.b), (expected.r, expected.g, expected.b))
+
+def world_color_linear(world, origin, direction):
+  bvh, world.bvh, world.use_bvh = world.bvh, None, False
+  try:
+    return world.color_at(Ray(origin, direction))
+  finally:
+    world.bvh, world.use_bvh = bvh, True
+
+class BVHTestCase(unittest.TestCase):
+
+  def test_bvh_layout(self):
+    world = random_world(200, 1)
+    bvh = BVH(world.shapes, leaf_size=3)
+    self.assertEqual(bvh.unbounded, [i for i in range(len(world.shapes)) if i % 20 == 0 and i < 200])
+    leaves = bvh.node_right < 0
+    self.assertTrue((bvh.node_count[leaves] <= 3).all())
+    self.assertEqual(sorted(bvh.order.tolist()), sorted(set(range(len(world.shapes))) - set(bvh.unbounded)))
+    for index in np.nonzero(~leaves)[0]:
+      for child in (index + 1, bvh.node_right[index]):
+        self.assertEqual(bvh.node_parent[child], index)
+        self.assertTrue((bvh.node_min[child] >= bvh.node_min[index]).all())
+        self.assertTrue((bvh.node_max[child] <= bvh.node_max[index]).all())
+    for index in np.nonzero(leaves)[0]:
+      shapes = bvh.order[bvh.node_start[index]:bvh.node_start[index] + bvh.node_count[index]]
+      self.assertTrue((bvh.box_min[shapes] >= bvh.node_min[index]).all())
+      self.assertTrue((bvh.box_max[shapes] <= bvh.node_max[index]).all())
+    self.assertGreater(bvh.sah_cost(), 0)
+    # a tree without bounded shapes is a single empty leaf
+    empty = BVH([Plane()])
+    self.assertEqual(empty.candidates(Ray(Point(0, 1, 0), Vector(0, -1, 0))), [0])
+    self.assertEqual(empty.closest_hit(Ray(Point(0, 1, 0), Vector(0, -1, 0))), (1, 0))
+
+  def test_bvh_matches_linear(self):
+    world = random_world(120, 2)
+    rays = random_rays(1500, 3, world.shapes[1].transform * Point(0, 0, 0))
+    expected = []
+    for origin, direction in rays:
+      ray = Ray(origin, direction)
+      world.intersect(ray)
+      expected.append((ray.intersections, ray.hit()))
+    bvh = world.build_bvh()
+    for (origin, direction), (xs, hit) in zip(rays, expected):
+      ray = Ray(origin, direction)
+      self.assertEqual(world.intersect(ray), xs)
+      closest = bvh.closest_hit(Ray(origin, direction))
+      if hit is None:
+        self.assertIsNone(closest)
+      else:
+        self.assertEqual(closest, (hit.t, world.shapes.index(hit.shape)))
+
+  def test_bvh_intersect_packet(self):
+    world = random_world(120, 10)
+    rays = random_rays(1000, 11, world.shapes[1].transform * Point(0, 0, 0))
+    origins = np.array([(o.x, o.y, o.z) for o, d in rays])
+    directions = np.array([(d.x, d.y, d.z) for o, d in rays])
+    linear_t, linear_shapes = world.closest_hits(origins, directions)
+    bvh = world.build_bvh(leaf_size=2)
+    ts, indices = bvh.intersect_packet(origins, directions)
+    for (origin, direction), t, index in zip(rays, ts.tolist(), indices.tolist()):
+      closest = bvh.closest_hit(Ray(origin, direction))
+      self.assertEqual((t, index), closest if closest is not None else (math.inf, -1))
+    t, shapes = world.closest_hits(origins, directions)
+    self.assertTrue(np.array_equal(t, linear_t))
+    self.assertEqual(shapes, linear_shapes)
+    # a tile of primary rays, as the renderer traces them
+    camera = Camera(16, 12, math.pi / 2.0)
+    camera.transform = world.view_transform(Point(0, 2, -12), Point(0, 0, 0), Vector(0, 1, 0))
+    origins, directions = camera.rays_for_region(4, 3, 12, 9)
+    ts, shapes = world.closest_hits(origins, directions)
+    for direction, t, shape in zip(directions.to_tuples(), ts.tolist(), shapes):
+      hit = linear_intersections(world, Ray(camera.origin, direction))
+      hit = [x for x in hit if x.t >= 0]
+      self.assertEqual((t, shape), (hit[0].t, hit[0].shape) if hit else (math.inf, None))
+    self.assertEqual(bvh.intersect_packet(np.empty((0, 3)), np.empty((0, 3)))[0].shape, (0,))
+
+  def test_bvh_any_hit(self):
+    world = random_world(120, 12)
+    rays = random_rays(1000, 13, world.shapes[1].transform * Point(0, 0, 0))
+    rng = random.Random(14)
+    queries = []
+    for origin, direction in rays:
+      distance = rng.choice([0.5, 2, 6, 20])
+      hit = Ray(origin, direction)
+      linear_intersections(world, hit)
+      hit = hit.hit()
+      queries.append((origin, direction, distance, hit is not None and hit.t < distance))
+    for origin, direction, distance, expected in queries:
+      self.assertEqual(world.is_occluded(origin, direction, distance), expected)
+    bvh = world.build_bvh()
+    for origin, direction, distance, expected in queries:
+      self.assertEqual(bvh.any_hit(Ray(origin, direction), distance), expected)
+      self.assertEqual(world.is_occluded(origin, direction, distance), expected)
+    self.assertTrue(any(q[3] for q in queries) and not all(q[3] for q in queries))
+
+  def test_world_bvh_render(self):
+    world = random_world(60, 4)
+    world.shapes[5].material.transparency = 0.5
+    world.shapes[5].material.reflective = 0.5
+    world.shapes[7].material.reflective = 0.8
+    camera = Camera(12, 9, math.pi / 2.0)
+    camera.transform = world.view_transform(Point(0, 2, -12), Point(0, 0, 0), Vector(0, 1, 0))
+    expected = camera.render(world).pixels
+    world.build_bvh()
+    self.assertTrue(np.array_equal(camera.render(world).pixels, expected))
+    # added shapes are queued in the existing tree
+    bvh = world.bvh
+    world.add_shape(Sphere())
+    self.assertIs(world.bvh, bvh)
+    self.assertEqual(bvh.pending, [len(world.shapes) - 1])
+
+  def test_world_bvh_refit(self):
+    world = random_world(80, 5)
+    world.build_bvh()
+    bvh = world.bvh
+    rng = random.Random(6)
+    rays = random_rays(300, 7, Point(0, 0, 0))
+    # small moves are refitted in place
+    for shape in world.shapes[1:30:3]:
+      shape.transform = Translation_Matrix(rng.uniform(-0.3, 0.3), 0, 0) * shape.transform
+    self.assertEqual(len(world.dirty), 10)
+    self.assertFalse(world.prepared)
+    assert_matches_linear(self, world, rays)
+    self.assertIs(world.bvh, bvh)
+    self.assertEqual(bvh.refits, 1)
+    self.assertEqual(world.dirty, {})
+    for index in np.nonzero(bvh.node_right >= 0)[0]:
+      for child in (index + 1, bvh.node_right[index]):
+        self.assertTrue((bvh.node_min[child] >= bvh.node_min[index]).all())
+        self.assertTrue((bvh.node_max[child] <= bvh.node_max[index]).all())
+    # scattering most shapes far apart degrades the tree enough to rebuild
+    for shape in world.shapes[1::2]:
+      shape.transform = Translation_Matrix(rng.uniform(-40, 40), rng.uniform(-40, 40), 0) * shape.transform
+    world.prepare()
+    self.assertIsNot(world.bvh, bvh)
+    self.assertEqual(world.bvh_builds, 2)
+    assert_matches_linear(self, world, rays)
+
+  def test_world_bvh_insert_remove(self):
+    world = random_world(60, 8)
+    world.build_bvh()
+    bvh = world.bvh
+    rays = random_rays(300, 9, world.shapes[1].transform * Point(0, 0, 0))
+    plane = Plane()
+    plane.transform = Translation_Matrix(0, 4, 0)
+    world.add_shape(plane)
+    for x in (-2, 0, 2):
+      sphere = Sphere()
+      sphere.transform = Translation_Matrix(x, 1, 0)
+      world.add_shape(sphere)
+    self.assertEqual(bvh.unbounded[-1], 61)
+    self.assertEqual(bvh.pending, [62, 63, 64])
+    world.remove_shape(world.shapes[1])
+    world.remove_shape(world.shapes[3])
+    world.remove_shape(plane)
+    world.remove_shape(world.shapes[-1])
+    self.assertIsNone(bvh.shapes[1])
+    self.assertEqual(bvh.pending, [62, 63])
+    assert_matches_linear(self, world, rays)
+    self.assertIs(world.bvh, bvh)
+    # inserting many shapes makes every ray test them, so the tree is rebuilt
+    for i in range(60):
+      sphere = Sphere()
+      sphere.transform = Translation_Matrix(i * 0.1, 0, 3) * Scaling_Matrix(0.05, 0.05, 0.05)
+      world.add_shape(sphere)
+    world.prepare()
+    self.assertIsNot(world.bvh, bvh)
+    self.assertEqual(world.bvh.pending, [])
+    assert_matches_linear(self, world, rays)
+    # so is removing a large part of the scene
+    bvh = world.bvh
+    for shape in list(world.shapes[::3]):
+      world.remove_shape(shape)
+    world.prepare()
+    self.assertIsNot(world.bvh, bvh)
+    assert_matches_linear(self, world, rays)
+
+  def test_world_bvh_appended_shapes(self):
+    # shapes appended to world.shapes directly are tracked once the tree is
+    # built or the world prepared, and a shape in two worlds tells both
+    world = random_world(40, 14)
+    other = random_world(10, 15)
+    sphere = Sphere()
+    world.shapes.append(sphere)
+    other.shapes.append(sphere)
+    world.build_bvh()
+    other.build_bvh()
+    rays = random_rays(300, 16, Point(3, 0, 0))
+    sphere.transform = Translation_Matrix(3, 0, 0)
+    self.assertFalse(world.prepared)
+    self.assertFalse(other.prepared)
+    assert_matches_linear(self, world, rays)
+    assert_matches_linear(self, other, rays)
+    # appended after the tree was built, it is inserted by prepare()
+    late = Sphere()
+    world.shapes.append(late)
+    late.transform = Translation_Matrix(-3, 0, 0)
+    rays = random_rays(300, 17, Point(-3, 0, 0))
+    assert_matches_linear(self, world, rays)
+    late.transform = Translation_Matrix(-3, 1, 0)
+    self.assertFalse(world.prepared)
+    assert_matches_linear(self, world, rays)
+
+if __name__ == '__main__':
+    unittest.main()
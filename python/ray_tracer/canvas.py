@@ -1,10 +1,32 @@
 
+import mmap
+import multiprocessing
+import numpy as np
+import os
+import queue
+import re
+import struct
+import sys
+import threading
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from tuple_array import TupleArray
 from utils import float_equal
 
 MAX_COLOR_VALUE = 255
 MAX_LINE_LENGTH = 70
+# channel values encoded per block when writing images
+ROW_BLOCK_VALUES = 1 << 20
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# PNG scanline filter types; 'adaptive' picks the best filter per row
+PNG_FILTERS = {'none': 0, 'sub': 1, 'up': 2, 'average': 3, 'paeth': 4, 'adaptive': None}
+# one PPM/PFM header token, after any whitespace and # comments
+HEADER_TOKEN = re.compile(rb"\s*(?:#[^\n]*\n\s*)*(\S+)")
 
 class Color:
+  __slots__ = ('r', 'g', 'b')
 
   def __init__(self, red, green, blue):
     self.r = red
@@ -30,57 +52,694 @@ class Color:
   def hadamard_product(self, color):
     return Color(self.r * color.r, self.g * color.g, self.b * color.b)
 
+  def add_scaled(self, color, scalar, out=None):
+    # fused self + color * scalar
+    return _color_into(self.r + color.r * scalar, self.g + color.g * scalar,
+                       self.b + color.b * scalar, out)
+
+  def lerp(self, color, fraction, out=None):
+    return _color_into(self.r + (color.r - self.r) * fraction,
+                       self.g + (color.g - self.g) * fraction,
+                       self.b + (color.b - self.b) * fraction, out)
+
+  @staticmethod
+  def weighted_sum(colors, weights, out=None):
+    # sum of colors[i] * weights[i] without intermediate Color objects
+    r = g = b = 0.0
+    for color, weight in zip(colors, weights):
+      r += color.r * weight
+      g += color.g * weight
+      b += color.b * weight
+    return _color_into(r, g, b, out)
+
+
+def _color_into(r, g, b, out):
+  # build a new Color, or overwrite out when the caller supplies one
+  if out is None:
+    return Color(r, g, b)
+  out.r = r
+  out.g = g
+  out.b = b
+  return out
+
+
+class ColorArray(TupleArray):
+  # structure-of-arrays counterpart of Color, see TupleArray
+  __slots__ = ()
+  _element = Color
+
+  @staticmethod
+  def _row(color):
+    return (color.r, color.g, color.b)
+
+  @property
+  def r(self):
+    return self.data[:, 0]
+
+  @property
+  def g(self):
+    return self.data[:, 1]
+
+  @property
+  def b(self):
+    return self.data[:, 2]
+
+  def add(self, color, mask=None):
+    return ColorArray(self._apply(np.add, mask, color))
+
+  def subtract(self, color, mask=None):
+    return ColorArray(self._apply(np.subtract, mask, color))
+
+  def scalar_multiply(self, scalar, mask=None):
+    return ColorArray(self._apply(np.multiply, mask, scalar))
+
+  def hadamard_product(self, color, mask=None):
+    return ColorArray(self._apply(np.multiply, mask, color))
+
 
 class Canvas:
 
   def __init__(self, width, height, c = Color(0.0, 0.0, 0.0)):
     self.width = width
     self.height = height
-    self.pixels = [None] * self.height
-    for i in range(self.height):
-      self.pixels[i] = [c] * width
+    # one contiguous float32 buffer indexed as [y, x, channel]
+    self.pixels = np.empty((height, width, 3), dtype=np.float32)
+    self.pixels[...] = (c.r, c.g, c.b)
+
+  def __array__(self, dtype=None, copy=None):
+    if copy:
+      return np.array(self.pixels, dtype=dtype)
+    return np.asarray(self.pixels, dtype=dtype)
+
+  def __buffer__(self, flags):
+    # zero-copy export of the pixel buffer (PEP 688, Python 3.12+); on older
+    # versions use memoryview(canvas.pixels) or np.asarray(canvas)
+    return memoryview(self.pixels)
 
   def pixel_at(self, x, y):
-    return self.pixels[y][x]
+    r, g, b = self.pixels[y, x].tolist()
+    return Color(r, g, b)
 
   def write_pixel(self, x, y, color):
-    if (x > 0 and x < self.width) and (y > 0 and y < self.height):
-      self.pixels[y][x] = color
+    if (x >= 0 and x < self.width) and (y >= 0 and y < self.height):
+      self.pixels[y, x] = (color.r, color.g, color.b)
       return True
     else:
       return False
 
-  def to_ppm(self, ppm_name):
-    with open(ppm_name, 'w') as f:
-      # write the PPM file header
-      f.write("P3\n")
-      f.write("{0} {1}\n".format(self.width, self.height))
-      f.write("{0}\n".format(MAX_COLOR_VALUE))
-      # write the pixel data
-      for y in range(self.height):
-        row_str = ""
-        for x in range(self.width):
-          color = self.pixel_at(x, y)
-          r = max(min(round(color.r * MAX_COLOR_VALUE), MAX_COLOR_VALUE), 0)
-          r_str = "%d " % r
-          if len(row_str) + len(r_str) > MAX_LINE_LENGTH:
-            f.write(row_str.strip() + "\n")
-            row_str = r_str
-          else:
-            row_str += r_str
-          g = max(min(round(color.g * MAX_COLOR_VALUE), MAX_COLOR_VALUE), 0)
-          g_str = "%d " % g
-          if len(row_str) + len(g_str) > MAX_LINE_LENGTH:
-            f.write(row_str.strip() + "\n")
-            row_str = g_str
-          else:
-            row_str += g_str
-          b = max(min(round(color.b * MAX_COLOR_VALUE), MAX_COLOR_VALUE), 0)
-          b_str = "%d " % b
-          if len(row_str) + len(b_str) > MAX_LINE_LENGTH:
-            f.write(row_str.strip() + "\n")
-            row_str = b_str
-          else:
-            row_str += b_str
-        # write line at end of each row
-        f.write(row_str.strip() + "\n")
+  def write_pixels(self, xs, ys, colors):
+    # write many pixels at once; colors is a single Color, a ColorArray or an
+    # (N,3) array. Coordinates outside the canvas are skipped, and the
+    # returned boolean array marks which pixels were written
+    xs = np.asarray(xs)
+    ys = np.asarray(ys)
+    inside = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+    if isinstance(colors, Color):
+      colors = (colors.r, colors.g, colors.b)
+    else:
+      if isinstance(colors, ColorArray):
+        colors = colors.data
+      colors = np.broadcast_to(colors, (len(inside), 3))[inside]
+    self.pixels[ys[inside], xs[inside]] = colors
+    return inside
+
+  def region(self, x0, y0, x1, y1):
+    # writable view of the pixels x0 <= x < x1, y0 <= y < y1
+    self._check_region(x0, y0, x1, y1)
+    return self.pixels[y0:y1, x0:x1]
+
+  def write_region(self, x0, y0, x1, y1, colors):
+    # colors is a ColorArray or array in row-major order, e.g. the colors
+    # for the rays returned by Camera.rays_for_region, or an (h,w,3) tile
+    self._check_region(x0, y0, x1, y1)
+    if isinstance(colors, ColorArray):
+      colors = colors.data
+    self.pixels[y0:y1, x0:x1] = np.reshape(colors, (y1 - y0, x1 - x0, 3))
+
+  def write_row(self, y, colors):
+    self.write_region(0, y, self.width, y + 1, colors)
+
+  def _check_region(self, x0, y0, x1, y1):
+    if not (0 <= x0 <= x1 <= self.width and 0 <= y0 <= y1 <= self.height):
+      raise ValueError("Region ({0}, {1})-({2}, {3}) is outside the canvas".format(x0, y0, x1, y1))
+
+  def to_ppm(self, ppm_name, binary=False):
+    # P3 (plain text) by default, P6 (raw bytes) when binary is set; rows are
+    # encoded in blocks so large canvases never need a full-size temporary
+    with PPMWriter(ppm_name, self.width, self.height, binary) as writer:
+      for y0, y1 in self.row_blocks():
+        writer.write_rows(self.pixels[y0:y1])
+
+  def to_png(self, png_name, filter_type='adaptive', level=6, background=False):
+    # level is the zlib compression level (0-9). With background set, the
+    # pixels are quantized immediately and filtering, compression and the
+    # write happen on a worker thread; the returned Future completes when
+    # the file is written
+    if filter_type not in PNG_FILTERS:
+      raise ValueError("Unknown PNG filter: {0}".format(filter_type))
+    if background:
+      values = quantize(self.pixels)
+      blocks = (values[y0:y1] for y0, y1 in self.row_blocks())
+      executor = ThreadPoolExecutor(max_workers=1)
+      future = executor.submit(write_png, png_name, self.width, self.height, blocks, filter_type, level)
+      executor.shutdown(wait=False)
+      return future
+    blocks = (quantize(self.pixels[y0:y1]) for y0, y1 in self.row_blocks())
+    write_png(png_name, self.width, self.height, blocks, filter_type, level)
+
+  def to_pfm(self, pfm_name):
+    # unclamped float32 colors as a little-endian PFM, which stores the rows
+    # from bottom to top
+    with open(pfm_name, 'wb') as f:
+      f.write("PF\n{0} {1}\n-1.0\n".format(self.width, self.height).encode('ascii'))
+      # walk the plain row ranges backwards: row_blocks() may release each
+      # block as it advances, so it can't be collected up front
+      for y0, y1 in reversed(list(Canvas.row_blocks(self))):
+        f.write(self.region(0, y0, self.width, y1)[::-1].astype('<f4').tobytes())
+        self.release(y0, y1)
+
+  @staticmethod
+  def from_pfm(pfm_name):
+    # reads color (PF) and grayscale (Pf) files in either byte order
+    with open(pfm_name, 'rb') as f:
+      data = f.read()
+    (kind, width, height, scale), offset = read_image_header(data, 4)
+    if kind not in ('PF', 'Pf'):
+      raise ValueError("{0} is not a PFM file".format(pfm_name))
+    width, height, scale = int(width), int(height), float(scale)
+    channels = 3 if kind == 'PF' else 1
+    dtype = '<f4' if scale < 0 else '>f4'
+    values = np.frombuffer(data, dtype=dtype, count=width * height * channels, offset=offset + 1)
+    c = Canvas(width, height)
+    c.pixels[...] = values.reshape(height, width, channels)[::-1]
+    return c
+
+  @staticmethod
+  def from_ppm(ppm_name):
+    # reads plain (P3) and raw (P6) files, scaling by the file's maxval
+    with open(ppm_name, 'rb') as f:
+      data = f.read()
+    (kind, width, height, maxval), offset = read_image_header(data, 4)
+    width, height, maxval = int(width), int(height), int(maxval)
+    count = width * height * 3
+    if kind == 'P6':
+      # a single whitespace byte separates the header from the samples
+      values = np.frombuffer(data, dtype=np.uint8 if maxval < 256 else '>u2', count=count, offset=offset + 1)
+    elif kind == 'P3':
+      body = data[offset:].decode('ascii')
+      # fromstring can't skip comments (older numpy silently stops at one)
+      if '#' in body:
+        body = re.sub(r"#[^\n]*", " ", body)
+      values = np.fromstring(body, dtype=np.int64, sep=' ')
+      if len(values) != count:
+        raise ValueError("{0} holds {1} samples, expected {2}".format(ppm_name, len(values), count))
+    else:
+      raise ValueError("{0} is not a PPM file".format(ppm_name))
+    c = Canvas(width, height)
+    np.divide(values.reshape(height, width, 3), maxval, out=c.pixels, casting='unsafe')
+    return c
+
+  def release(self, y0, y1):
+    # nothing to drop for pixels held in memory; see MappedCanvas
+    pass
+
+  def row_blocks(self, max_values=ROW_BLOCK_VALUES):
+    # split the rows into (y0, y1) blocks of at most max_values channel values
+    rows = max(1, max_values // max(1, self.width * 3))
+    for y0 in range(0, self.height, rows):
+      yield y0, min(y0 + rows, self.height)
+
+
+class MappedCanvas(Canvas):
+  # Canvas backed by a raw float32 file of height * width * 3 values mapped
+  # into memory, so only the pages being touched are resident. mode 'w+'
+  # creates (or truncates) the file with black pixels, 'r+' opens an existing
+  # file so other processes can write tiles into it, 'r' opens it read-only.
+  # to_ppm and to_png stream the mapping block by block and drop each block's
+  # pages once it is encoded.
+
+  def __init__(self, width, height, path, c = None, mode='w+'):
+    if mode not in ('w+', 'r+', 'r'):
+      raise ValueError("Unknown mode: {0}".format(mode))
+    self.width = width
+    self.height = height
+    self.path = path
+    size = width * height * 3 * 4
+    with open(path, 'w+b' if mode == 'w+' else mode + 'b') as f:
+      if mode == 'w+':
+        f.truncate(size)
+      elif os.fstat(f.fileno()).st_size != size:
+        raise ValueError("{0} does not hold a {1}x{2} canvas".format(path, width, height))
+      access = mmap.ACCESS_READ if mode == 'r' else mmap.ACCESS_WRITE
+      # mmap refuses empty mappings
+      self._mmap = mmap.mmap(f.fileno(), size, access=access) if size else None
+    if self._mmap is None:
+      self.pixels = np.zeros((height, width, 3), dtype=np.float32)
+    else:
+      self.pixels = np.frombuffer(self._mmap, dtype=np.float32).reshape(height, width, 3)
+    if c is not None:
+      for y0, y1 in self.row_blocks():
+        self.pixels[y0:y1] = (c.r, c.g, c.b)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def flush(self):
+    if self._mmap is not None and not self._mmap.closed:
+      self._mmap.flush()
+
+  def close(self):
+    # views taken from pixels or region() must be released before closing
+    self.flush()
+    self.pixels = None
+    if self._mmap is not None:
+      self._mmap.close()
+
+  def release(self, y0, y1):
+    # drop the resident pages holding rows y0 <= y < y1; the data stays in
+    # the file and is paged back in on the next access
+    if self._mmap is None or self._mmap.closed or not hasattr(mmap, 'MADV_DONTNEED'):
+      return
+    row_bytes = self.width * 3 * 4
+    start = y0 * row_bytes // mmap.PAGESIZE * mmap.PAGESIZE
+    end = y1 * row_bytes
+    if end > start:
+      self._mmap.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+  def row_blocks(self, max_values=ROW_BLOCK_VALUES):
+    for y0, y1 in super().row_blocks(max_values):
+      yield y0, y1
+      self.release(y0, y1)
+
+
+class SharedCanvas(Canvas):
+  # Canvas whose pixels live in a multiprocessing.shared_memory block, so
+  # worker processes can write regions in place. The creating process owns
+  # the block: workers attach by name (or receive the canvas as a Process or
+  # Pool argument, which pickles only the name and size) and close() when
+  # done; the owner calls unlink() once every process has closed it. Used
+  # as a context manager it closes on exit and unlinks if it is the owner.
+
+  def __init__(self, width, height, c = None, name=None):
+    self.width = width
+    self.height = height
+    self.owner = name is None
+    size = width * height * 3 * 4
+    if self.owner:
+      # shared memory blocks can't be empty
+      self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+      SHARED_CANVAS_NAMES.add(self.shm.name)
+    else:
+      self.shm = attach_untracked(name)
+    if self.shm.size < size:
+      self.shm.close()
+      raise ValueError("Shared memory {0} does not hold a {1}x{2} canvas".format(name, width, height))
+    self.pixels = np.ndarray((height, width, 3), dtype=np.float32, buffer=self.shm.buf)
+    if self.owner:
+      self.pixels[...] = (c.r, c.g, c.b) if c is not None else 0.0
+
+  @staticmethod
+  def attach(name, width, height):
+    return SharedCanvas(width, height, name=name)
+
+  @property
+  def name(self):
+    return self.shm.name
+
+  def __reduce__(self):
+    return (SharedCanvas.attach, (self.name, self.width, self.height))
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+    if self.owner:
+      self.unlink()
+
+  def close(self):
+    # views taken from pixels or region() must be released before closing
+    self.pixels = None
+    self.shm.close()
+
+  def unlink(self):
+    SHARED_CANVAS_NAMES.discard(self.shm.name)
+    self.shm.unlink()
+
+
+# names of the SharedCanvas blocks this process created and hasn't unlinked
+SHARED_CANVAS_NAMES = set()
+
+
+def attach_untracked(name):
+  # attach to an existing shared memory block without handing it to this
+  # process's resource tracker, which would unlink it when the process
+  # exits even though the owner still uses it. Python 3.13 has track=False
+  # for this. Before that, attaching always registers the block, so it is
+  # unregistered again (POSIX only; the tracker keys blocks by their path,
+  # "/" + name). That step is skipped where the tracker is taken to be the
+  # owner's: in the owner itself and in multiprocessing children, which
+  # inherit their parent's. Unregistering there would drop the owner's own
+  # registration, and an owner that crashed would leak the block
+  if sys.version_info >= (3, 13):
+    return shared_memory.SharedMemory(name=name, track=False)
+  shm = shared_memory.SharedMemory(name=name)
+  if os.name == 'posix' and name not in SHARED_CANVAS_NAMES and multiprocessing.parent_process() is None:
+    resource_tracker.unregister("/" + shm.name, "shared_memory")
+  return shm
+
+
+def ppm_header(width, height, binary=False):
+  return "{0}\n{1} {2}\n{3}\n".format("P6" if binary else "P3", width, height,
+                                       MAX_COLOR_VALUE).encode('ascii')
+
+
+def read_image_header(data, count):
+  # the first count whitespace-separated header tokens of a PPM/PFM file,
+  # skipping # comments, and the offset just past the last one
+  fields = []
+  offset = 0
+  while len(fields) < count:
+    match = HEADER_TOKEN.match(data, offset)
+    if match is None:
+      raise ValueError("Truncated image header")
+    fields.append(match.group(1).decode('ascii'))
+    offset = match.end()
+  return fields, offset
+
+
+def quantize(pixels):
+  # same as max(min(round(c * 255), 255), 0) per channel: np.rint rounds half
+  # to even like round(), and the product is taken in double precision
+  values = np.rint(np.asarray(pixels, dtype=np.float64) * MAX_COLOR_VALUE)
+  np.clip(values, 0, MAX_COLOR_VALUE, out=values)
+  return values.astype(np.uint8)
+
+
+# P3 token for every channel value: its ASCII digits, left aligned in three
+# byte slots, then a separator slot, packed into one uint32 so a lookup is a
+# single take(); the matching mask marks which of the four bytes are used
+PPM_TOKEN_WIDTHS = np.array([len(str(v)) + 1 for v in range(MAX_COLOR_VALUE + 1)], dtype=np.uint8)
+PPM_TOKENS = np.array([list(str(v).ljust(3).encode('ascii') + b" ") for v in range(MAX_COLOR_VALUE + 1)],
+                      dtype=np.uint8).view(np.uint32).ravel()
+PPM_TOKEN_MASKS = np.array([[k < len(str(v)) for k in range(3)] + [True] for v in range(MAX_COLOR_VALUE + 1)],
+                           dtype=np.bool_).view(np.uint32).ravel()
+
+
+def encode_ppm_rows(values):
+  # P3 text for an (h, w, 3) block of quantized rows. Each value becomes its
+  # digits plus a separator; lines are filled greedily up to MAX_LINE_LENGTH
+  # (counting the trailing space) and every image row ends its last line.
+  height = values.shape[0]
+  tokens = values.reshape(height, -1)
+  count = tokens.shape[1]
+  if count == 0:
+    return b"\n" * height
+  tokens = tokens.ravel()
+  ends = np.cumsum(PPM_TOKEN_WIDTHS.take(tokens), dtype=np.int64)
+  # break lines for all rows at once, one output line per iteration
+  line_ends = np.zeros(len(tokens), dtype=bool)
+  starts = np.arange(height) * count
+  limits = starts + count
+  while len(starts):
+    before = np.where(starts > 0, ends[starts - 1], 0)
+    stops = np.minimum(np.searchsorted(ends, before + MAX_LINE_LENGTH, side='right'), limits)
+    line_ends[stops - 1] = True
+    unfinished = stops < limits
+    starts = stops[unfinished]
+    limits = limits[unfinished]
+  chars = PPM_TOKENS.take(tokens).view(np.uint8).reshape(-1, 4)
+  chars[line_ends, 3] = ord('\n')
+  out = chars[PPM_TOKEN_MASKS.take(tokens).view(np.bool_).reshape(-1, 4)]
+  return out.tobytes()
+
+
+def png_chunk(kind, data):
+  return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def png_header(width, height):
+  # 8-bit RGB, deflate compression, adaptive filtering, no interlace
+  ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+  return PNG_SIGNATURE + png_chunk(b"IHDR", ihdr)
+
+
+def png_filter_rows(values, filter_type, previous=None):
+  # filter an (h, w, 3) block of quantized rows; previous is the raw row
+  # above the block (None at the top of the image). Returns (h, 1 + w*3)
+  # bytes, each row prefixed with its filter type.
+  if filter_type not in PNG_FILTERS:
+    raise ValueError("Unknown PNG filter: {0}".format(filter_type))
+  raw = values.reshape(values.shape[0], -1).astype(np.int16)
+  up = np.empty_like(raw)
+  up[0] = 0 if previous is None else previous.reshape(-1)
+  up[1:] = raw[:-1]
+  left = np.zeros_like(raw)
+  left[:, 3:] = raw[:, :-3]
+  up_left = np.zeros_like(raw)
+  up_left[:, 3:] = up[:, :-3]
+  candidates = {
+    'none': lambda: raw,
+    'sub': lambda: raw - left,
+    'up': lambda: raw - up,
+    'average': lambda: raw - (left + up) // 2,
+    'paeth': lambda: raw - paeth_predictor(left, up, up_left),
+  }
+  out = np.empty((raw.shape[0], raw.shape[1] + 1), dtype=np.uint8)
+  if filter_type == 'adaptive':
+    # minimum sum of absolute differences, treating filtered bytes as signed
+    filtered = np.stack([candidates[name]() & 0xFF for name in ('none', 'sub', 'up', 'average', 'paeth')])
+    signed = np.where(filtered > 127, 256 - filtered, filtered)
+    best = np.argmin(signed.sum(axis=2, dtype=np.int64), axis=0)
+    out[:, 0] = best
+    out[:, 1:] = filtered[best, np.arange(raw.shape[0])]
+  else:
+    out[:, 0] = PNG_FILTERS[filter_type]
+    out[:, 1:] = candidates[filter_type]() & 0xFF
+  return out
+
+
+def paeth_predictor(a, b, c):
+  pa = np.abs(b - c)
+  pb = np.abs(a - c)
+  pc = np.abs(a + b - 2 * c)
+  return np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+
+
+def write_png(png_name, width, height, blocks, filter_type='adaptive', level=6):
+  # blocks yields (h, w, 3) arrays of quantized rows from top to bottom
+  with PNGWriter(png_name, width, height, filter_type, level) as writer:
+    for values in blocks:
+      writer.write_values(values)
+
+
+class ImageWriter:
+  # incremental image output: rows are written top to bottom as they are
+  # produced, so only the rows passed in are ever held in memory. close()
+  # finishes the image and checks that every row was written. path may also
+  # be a binary file object, which is left open.
+
+  def __init__(self, path, width, height):
+    self.width = width
+    self.height = height
+    self.rows = 0
+    self.owns_file = isinstance(path, (str, os.PathLike))
+    self.file = open(path, 'wb') if self.owns_file else path
+    self.closed = False
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    if exc_type is None:
+      self.close()
+    else:
+      self._close_file()
+
+  def write_rows(self, pixels):
+    # pixels is an (h, w, 3) float array, a ColorArray or anything that
+    # reshapes to whole rows of colors. Values are rounded to float32 first,
+    # like a Canvas stores them, so the bytes match saving a Canvas
+    if isinstance(pixels, ColorArray):
+      pixels = pixels.data
+    pixels = np.asarray(pixels, dtype=np.float32)
+    self.write_values(quantize(np.reshape(pixels, (-1, self.width, 3))))
+
+  def write_values(self, values):
+    # values is an (h, w, 3) array of already quantized rows
+    if len(values) == 0:
+      return
+    if self.rows + len(values) > self.height:
+      raise ValueError("Image only has {0} rows".format(self.height))
+    self._encode(values)
+    self.rows += len(values)
+
+  def close(self):
+    if self.closed:
+      return
+    try:
+      if self.rows != self.height:
+        raise ValueError("Only {0} of {1} rows were written".format(self.rows, self.height))
+      self._finish()
+    finally:
+      self._close_file()
+
+  def _close_file(self):
+    self.closed = True
+    if self.owns_file:
+      self.file.close()
+
+  def _finish(self):
+    pass
+
+
+class RGBWriter(ImageWriter):
+  # headerless RGB24 samples, as video encoders read them
+
+  def _encode(self, values):
+    self.file.write(values.tobytes())
+
+
+class PPMWriter(ImageWriter):
+
+  def __init__(self, path, width, height, binary=False):
+    super().__init__(path, width, height)
+    self.binary = binary
+    self.file.write(ppm_header(width, height, binary))
+
+  def _encode(self, values):
+    self.file.write(values.tobytes() if self.binary else encode_ppm_rows(values))
+
+
+class PNGWriter(ImageWriter):
+
+  def __init__(self, path, width, height, filter_type='adaptive', level=6):
+    if filter_type not in PNG_FILTERS:
+      raise ValueError("Unknown PNG filter: {0}".format(filter_type))
+    super().__init__(path, width, height)
+    self.filter_type = filter_type
+    self.compressor = zlib.compressobj(level)
+    self.previous = None
+    self.file.write(png_header(width, height))
+
+  def _encode(self, values):
+    data = self.compressor.compress(png_filter_rows(values, self.filter_type, self.previous).tobytes())
+    if data:
+      self.file.write(png_chunk(b"IDAT", data))
+    # the next block filters against the last row of this one
+    self.previous = values[-1].copy()
+
+  def _finish(self):
+    self.file.write(png_chunk(b"IDAT", self.compressor.flush()))
+    self.file.write(png_chunk(b"IEND", b""))
+
+
+class FrameSink:
+  # streams finished frames to an encoder as raw RGB24 (kind 'rgb') or as
+  # back-to-back P6 images (kind 'p6'). target is '-' for stdout, a path
+  # (e.g. a named pipe made with os.mkfifo) or a binary file object, which
+  # is left open. Every frame must have the same size. With background set,
+  # write_frame quantizes the frame and hands it to a writer thread through
+  # a queue of at most queue_size frames, so rendering the next frame
+  # overlaps with the encoder reading this one.
+
+  def __init__(self, target='-', kind='rgb', background=False, queue_size=4):
+    if kind not in FRAME_WRITERS:
+      raise ValueError("Unknown frame kind: {0}".format(kind))
+    self.kind = kind
+    self.frames = 0
+    self.size = None
+    self.owns_file = isinstance(target, (str, os.PathLike)) and target != '-'
+    if target == '-':
+      self.file = sys.stdout.buffer
+    elif self.owns_file:
+      self.file = open(target, 'wb')
+    else:
+      self.file = target
+    self.queue = None
+    self.error = None
+    if background:
+      self.queue = queue.Queue(queue_size)
+      self.thread = threading.Thread(target=self._drain, daemon=True)
+      self.thread.start()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def write_frame(self, frame):
+    # frame is a Canvas or an (h, w, 3) float array
+    pixels = frame.pixels if isinstance(frame, Canvas) else np.asarray(frame)
+    height, width = pixels.shape[:2]
+    if self.size is None:
+      self.size = (width, height)
+    elif self.size != (width, height):
+      raise ValueError("Frame is {0}x{1}, expected {2}x{3}".format(width, height, *self.size))
+    self._raise_error()
+    if self.queue is None:
+      self._write(pixels)
+    else:
+      self.queue.put(quantize(np.asarray(pixels, dtype=np.float32)))
+    self.frames += 1
+
+  def close(self):
+    if self.file is None:
+      return
+    try:
+      if self.queue is not None:
+        self.queue.put(None)
+        self.thread.join()
+      self._raise_error()
+      self.file.flush()
+    finally:
+      if self.owns_file:
+        self.file.close()
+      self.file = None
+
+  def _write(self, pixels):
+    # one image per frame on the shared file; float frames are quantized
+    # by the writer in row blocks, so a large frame needs no full-size copy
+    height, width = pixels.shape[:2]
+    writer_class, options = FRAME_WRITERS[self.kind]
+    with writer_class(self.file, width, height, **options) as writer:
+      if pixels.dtype == np.uint8:
+        writer.write_values(pixels)
+      else:
+        rows = max(1, ROW_BLOCK_VALUES // max(1, width * 3))
+        for y0 in range(0, height, rows):
+          writer.write_rows(pixels[y0:y0 + rows])
+
+  def _drain(self):
+    # keep taking frames after an error so write_frame never blocks forever
+    while True:
+      pixels = self.queue.get()
+      if pixels is None:
+        return
+      if self.error is None:
+        try:
+          self._write(pixels)
+        except Exception as error:
+          self.error = error
+
+  def _raise_error(self):
+    if self.error is not None:
+      error, self.error = self.error, None
+      raise error
+
+
+# writer class and options for each FrameSink kind
+FRAME_WRITERS = {'rgb': (RGBWriter, {}), 'p6': (PPMWriter, {'binary': True})}
+IMAGE_WRITERS = {'.ppm': PPMWriter, '.png': PNGWriter}
+
+
+def image_writer(path, width, height, **options):
+  # pick the writer from the file extension; options go to its constructor
+  extension = os.path.splitext(path)[1].lower()
+  if extension not in IMAGE_WRITERS:
+    raise ValueError("No image writer for {0}".format(path))
+  return IMAGE_WRITERS[extension](path, width, height, **options)
@@ -1,6 +1,94 @@
+import io
+import multiprocessing
+import numpy as np
+import os
+import struct
+import subprocess
+import sys
+import tempfile
 import unittest
+import zlib
+
+from canvas import Canvas, Color, ColorArray, FrameSink, MappedCanvas, SharedCanvas, PNGWriter, PPMWriter, image_writer, MAX_COLOR_VALUE, MAX_LINE_LENGTH, PNG_FILTERS, PNG_SIGNATURE, quantize
+from unittest import mock
+
+
+def reference_ppm(canvas):
+  # the original per-channel P3 writer, kept to check the vectorized encoder
+  text = "P3\n{0} {1}\n{2}\n".format(canvas.width, canvas.height, MAX_COLOR_VALUE)
+  for y in range(canvas.height):
+    row_str = ""
+    for x in range(canvas.width):
+      color = canvas.pixel_at(x, y)
+      for c in (color.r, color.g, color.b):
+        c_str = "%d " % max(min(round(c * MAX_COLOR_VALUE), MAX_COLOR_VALUE), 0)
+        if len(row_str) + len(c_str) > MAX_LINE_LENGTH:
+          text += row_str.strip() + "\n"
+          row_str = c_str
+        else:
+          row_str += c_str
+    text += row_str.strip() + "\n"
+  return text.encode('ascii')
+
+
+def read_png(png_name):
+  # minimal decoder for the 8-bit RGB files written by Canvas.to_png
+  with open(png_name, 'rb') as f:
+    data = f.read()
+  assert data[:8] == PNG_SIGNATURE
+  pos = 8
+  chunks = []
+  while pos < len(data):
+    length, = struct.unpack(">I", data[pos:pos + 4])
+    kind = data[pos + 4:pos + 8]
+    body = data[pos + 8:pos + 8 + length]
+    crc, = struct.unpack(">I", data[pos + 8 + length:pos + 12 + length])
+    assert crc == zlib.crc32(kind + body)
+    chunks.append((kind, body))
+    pos += 12 + length
+  assert chunks[0][0] == b"IHDR" and chunks[-1][0] == b"IEND"
+  width, height = struct.unpack(">II", chunks[0][1][:8])
+  raw = zlib.decompress(b"".join(body for kind, body in chunks if kind == b"IDAT"))
+  stride = width * 3
+  rows = []
+  filters = []
+  prev = [0] * stride
+  for y in range(height):
+    line = raw[y * (stride + 1):(y + 1) * (stride + 1)]
+    filters.append(line[0])
+    row = []
+    for i, v in enumerate(line[1:]):
+      a = row[i - 3] if i >= 3 else 0
+      b = prev[i]
+      c = prev[i - 3] if i >= 3 else 0
+      if line[0] == 1:
+        v += a
+      elif line[0] == 2:
+        v += b
+      elif line[0] == 3:
+        v += (a + b) // 2
+      elif line[0] == 4:
+        p = a + b - c
+        pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+        v += a if pa <= pb and pa <= pc else (b if pb <= pc else c)
+      row.append(v & 0xFF)
+    rows.append(row)
+    prev = row
+  return np.array(rows, dtype=np.uint8).reshape(height, width, 3), filters
+
+
+def fill_shared_rows(canvas, y0, y1, value):
+  # worker for test_shared_canvas; canvas arrives attached by name
+  canvas.write_region(0, y0, canvas.width, y1, np.full((y1 - y0, canvas.width, 3), value))
+  canvas.close()
+
+
+def attach_and_mark(name, width, height):
+  # worker for test_shared_canvas_worker_exit; attaches by name and exits
+  canvas = SharedCanvas.attach(name, width, height)
+  canvas.write_pixel(0, 0, Color(0, 1, 0))
+  canvas.close()
 
-from canvas import Canvas, Color
 
 class CanvasTestCase(unittest.TestCase):
 
@@ -8,12 +96,19 @@ class CanvasTestCase(unittest.TestCase):
     self.c1 = Color(0.9, 0.6, 0.75)
     self.c2 = Color(0.7, 0.1, 0.25)
     self.canvas = Canvas(10, 20)
+    # image files go to a scratch directory rather than the working one
+    self.tmp = tempfile.TemporaryDirectory()
+    self.addCleanup(self.tmp.cleanup)
+
+  def path(self, name):
+    return os.path.join(self.tmp.name, name)
 
   def test_color_init(self):
     c = Color(-0.5, 0.4, 1.7)
     self.assertEqual(c.r, -0.5)
     self.assertEqual(c.g, 0.4)
     self.assertEqual(c.b, 1.7)
+    self.assertFalse(hasattr(c, '__dict__'))
 
   def test_color_operations(self):
     result = self.c1.add(self.c2)
@@ -28,6 +123,33 @@ class CanvasTestCase(unittest.TestCase):
     result = c1.hadamard_product(c2)
     self.assertTrue(result.equals(Color(0.9, 0.2, 0.04)))
 
+  def test_color_fused_operations(self):
+    result = self.c1.add_scaled(self.c2, 0.5)
+    self.assertTrue(result.equals(self.c1.add(self.c2.scalar_multiply(0.5))))
+    result = self.c1.lerp(self.c2, 0.25)
+    self.assertTrue(result.equals(Color(0.85, 0.475, 0.625)))
+    result = Color.weighted_sum((self.c1, self.c2, Color(1, 1, 1)), (1.0, 2.0, 0.5))
+    self.assertTrue(result.equals(Color(2.8, 1.3, 1.75)))
+    out = Color(0, 0, 0)
+    self.assertIs(Color.weighted_sum((self.c1,), (2.0,), out=out), out)
+    self.assertTrue(out.equals(Color(1.8, 1.2, 1.5)))
+    self.assertIs(self.c1.lerp(self.c2, 1.0, out=out), out)
+    self.assertTrue(out.equals(self.c2))
+
+  def test_color_array_operations(self):
+    colors = ColorArray.from_tuples([self.c1, self.c2])
+    self.assertTrue(colors[0].equals(self.c1))
+    self.assertTrue(np.array_equal(colors.g, [0.6, 0.1]))
+    result = colors.add(colors)
+    self.assertTrue(result[1].equals(self.c2.add(self.c2)))
+    result = colors.subtract(self.c2)
+    self.assertTrue(result[0].equals(self.c1.subtract(self.c2)))
+    result = colors.scalar_multiply(2.0)
+    self.assertTrue(result[0].equals(self.c1.scalar_multiply(2.0)))
+    result = colors.hadamard_product(Color(1.0, 0.5, 0.0), np.array([False, True]))
+    self.assertTrue(result[0].equals(self.c1))
+    self.assertTrue(result[1].equals(Color(0.7, 0.05, 0.0)))
+
   def test_canvas_init(self):
     black = Color(0.0, 0.0, 0.0)
     self.assertEqual(self.canvas.width, 10)
@@ -40,6 +162,35 @@ class CanvasTestCase(unittest.TestCase):
     red = Color(1.0, 0.0, 0.0)
     self.canvas.write_pixel(2, 3, red)
     self.assertTrue(self.canvas.pixel_at(2, 3).equals(red))
+    self.assertTrue(self.canvas.write_pixel(0, 0, red))
+    self.assertTrue(self.canvas.pixel_at(0, 0).equals(red))
+    self.assertFalse(self.canvas.write_pixel(10, 0, red))
+    self.assertFalse(self.canvas.write_pixel(0, -1, red))
+
+  def test_canvas_buffer(self):
+    self.assertEqual(self.canvas.pixels.shape, (20, 10, 3))
+    self.assertEqual(self.canvas.pixels.dtype, np.float32)
+    self.assertEqual(self.canvas.pixels.nbytes, 10 * 20 * 12)
+    # np.asarray and memoryview hand out the buffer without copying
+    self.assertTrue(np.shares_memory(np.asarray(self.canvas), self.canvas.pixels))
+    view = memoryview(self.canvas.pixels)
+    self.assertEqual(view.shape, (20, 10, 3))
+    self.canvas.write_pixel(1, 2, self.c1)
+    self.assertAlmostEqual(view[2, 1, 0], 0.9, places=6)
+
+  def test_canvas_write_region(self):
+    colors = ColorArray.from_tuples([self.c1, self.c2] * 3)
+    self.canvas.write_region(4, 5, 7, 7, colors)
+    self.assertTrue(self.canvas.pixel_at(4, 5).equals(self.c1))
+    self.assertTrue(self.canvas.pixel_at(5, 5).equals(self.c2))
+    self.assertTrue(self.canvas.pixel_at(5, 6).equals(self.c1))
+    self.assertTrue(self.canvas.pixel_at(7, 5).equals(Color(0, 0, 0)))
+    self.canvas.write_row(19, np.ones((10, 3)))
+    self.assertTrue(self.canvas.pixel_at(9, 19).equals(Color(1, 1, 1)))
+    tile = self.canvas.region(0, 0, 2, 2)
+    tile[...] = 0.5
+    self.assertTrue(self.canvas.pixel_at(1, 1).equals(Color(0.5, 0.5, 0.5)))
+    self.assertRaises(ValueError, self.canvas.write_region, 8, 0, 11, 1, np.zeros((3, 3)))
 
   def test_canvas_to_ppm(self):
     c = Canvas(5, 3)
@@ -49,7 +200,7 @@ class CanvasTestCase(unittest.TestCase):
     c.write_pixel(0, 0, c1)
     c.write_pixel(2, 1, c2)
     c.write_pixel(4, 2, c3)
-    ppm_name = "canvas.ppm"
+    ppm_name = self.path("canvas.ppm")
     c.to_ppm(ppm_name)
     with open(ppm_name) as f:
       self.assertEqual(f.readline(), "P3\n")
@@ -58,7 +209,7 @@ class CanvasTestCase(unittest.TestCase):
 
   def test_canvas_to_ppm_split_lines(self):
     c = Canvas(10, 2, Color(1.0, 0.8, 0.6))
-    ppm_name = "canvas.ppm"
+    ppm_name = self.path("canvas.ppm")
     c.to_ppm(ppm_name)
     line1 = "255 204 153 255 204 153 255 204 153 255 204 153 255 204 153 255 204\n"
     line2 = "153 255 204 153 255 204 153 255 204 153 255 204 153\n"
@@ -72,3 +223,279 @@ class CanvasTestCase(unittest.TestCase):
       self.assertEqual(f.readline(), line2)
       self.assertEqual(f.readline(), line1)
       self.assertEqual(f.readline(), line2)
+
+  def test_canvas_to_ppm_matches_reference(self):
+    rng = np.random.default_rng(7)
+    for width, height in ((1, 1), (7, 3), (23, 5), (64, 9)):
+      c = Canvas(width, height)
+      # mix of out-of-range values, exact halves and values near zero
+      c.pixels[...] = rng.choice([-0.5, 0.0, 0.02, 0.5, 0.9, 1.0, 1.7], size=(height, width, 3))
+      c.pixels[0, 0] = rng.random(3)
+      ppm_name = self.path("canvas.ppm")
+      c.to_ppm(ppm_name)
+      with open(ppm_name, 'rb') as f:
+        self.assertEqual(f.read(), reference_ppm(c))
+    # small blocks exercise the row-block split
+    c = Canvas(9, 7, Color(0.3, 0.6, 0.9))
+    c.write_pixel(4, 3, Color(1, 0, 0.5))
+    expected = reference_ppm(c)
+    blocks = c.row_blocks
+    c.row_blocks = lambda: blocks(30)
+    c.to_ppm(ppm_name)
+    with open(ppm_name, 'rb') as f:
+      self.assertEqual(f.read(), expected)
+
+  def test_canvas_to_binary_ppm(self):
+    c = Canvas(5, 3)
+    c.write_pixel(0, 0, Color(1.5, 0.0, 0.0))
+    c.write_pixel(2, 1, Color(0.0, 0.5, 0.0))
+    c.write_pixel(4, 2, Color(-0.5, 0.0, 1.0))
+    ppm_name = self.path("canvas.ppm")
+    c.to_ppm(ppm_name, binary=True)
+    with open(ppm_name, 'rb') as f:
+      data = f.read()
+    header = b"P6\n5 3\n255\n"
+    self.assertEqual(data[:len(header)], header)
+    pixels = np.frombuffer(data[len(header):], dtype=np.uint8).reshape(3, 5, 3)
+    self.assertEqual(pixels[0, 0].tolist(), [255, 0, 0])
+    self.assertEqual(pixels[1, 2].tolist(), [0, 128, 0])
+    self.assertEqual(pixels[2, 4].tolist(), [0, 0, 255])
+    self.assertEqual(int(pixels.sum()), 255 + 128 + 255)
+
+  def test_canvas_to_png(self):
+    rng = np.random.default_rng(3)
+    c = Canvas(13, 6)
+    c.pixels[...] = rng.random((6, 13, 3))
+    c.pixels[2] = 0.5
+    expected = quantize(c.pixels)
+    png_name = self.path("canvas.png")
+    for filter_type in PNG_FILTERS:
+      c.to_png(png_name, filter_type=filter_type, level=9)
+      values, filters = read_png(png_name)
+      self.assertTrue(np.array_equal(values, expected))
+      if filter_type != 'adaptive':
+        self.assertEqual(set(filters), {PNG_FILTERS[filter_type]})
+    # rows split across blocks still filter against the row above
+    blocks = c.row_blocks
+    c.row_blocks = lambda: blocks(40)
+    c.to_png(png_name, filter_type='paeth', level=0)
+    self.assertTrue(np.array_equal(read_png(png_name)[0], expected))
+    self.assertRaises(ValueError, c.to_png, png_name, filter_type='median')
+
+  def test_canvas_to_png_background(self):
+    c = Canvas(8, 4, Color(0.2, 0.4, 0.6))
+    png_name = self.path("canvas.png")
+    future = c.to_png(png_name, background=True)
+    # the image is snapshotted, so later writes don't reach the file
+    c.write_pixel(0, 0, Color(1, 1, 1))
+    future.result()
+    values, filters = read_png(png_name)
+    self.assertEqual(values[0, 0].tolist(), [51, 102, 153])
+
+  def test_mapped_canvas(self):
+    with tempfile.TemporaryDirectory() as tmp:
+      path = os.path.join(tmp, "canvas.raw")
+      with MappedCanvas(9, 7, path, Color(0.3, 0.6, 0.9)) as c:
+        self.assertEqual(os.path.getsize(path), 9 * 7 * 3 * 4)
+        self.assertTrue(c.pixel_at(8, 6).equals(Color(0.3, 0.6, 0.9)))
+        # a second mapping of the same file, as a worker would open it
+        with MappedCanvas(9, 7, path, mode='r+') as worker:
+          worker.write_region(2, 1, 5, 3, np.full((2, 3, 3), 0.5))
+          worker.write_pixel(4, 3, Color(1, 0, 0.5))
+        self.assertTrue(c.pixel_at(3, 2).equals(Color(0.5, 0.5, 0.5)))
+        expected = Canvas(9, 7)
+        expected.pixels[...] = c.pixels
+        # streaming through small blocks releases pages as it goes
+        blocks = c.row_blocks
+        c.row_blocks = lambda: blocks(30)
+        c.to_ppm(os.path.join(tmp, "canvas.ppm"))
+        with open(os.path.join(tmp, "canvas.ppm"), 'rb') as f:
+          self.assertEqual(f.read(), reference_ppm(expected))
+        c.to_png(os.path.join(tmp, "canvas.png"))
+        self.assertTrue(np.array_equal(read_png(os.path.join(tmp, "canvas.png"))[0], quantize(expected.pixels)))
+        self.assertTrue(np.array_equal(c.pixels, expected.pixels))
+      with MappedCanvas(9, 7, path, mode='r') as c:
+        self.assertTrue(c.pixel_at(4, 3).equals(Color(1, 0, 0.5)))
+        self.assertRaises(ValueError, c.write_pixel, 0, 0, Color(1, 1, 1))
+      self.assertRaises(ValueError, MappedCanvas, 10, 7, path, mode='r+')
+
+  def test_image_writers(self):
+    c = Canvas(6, 5)
+    c.pixels[...] = np.random.default_rng(5).random((5, 6, 3))
+    with PPMWriter(self.path("canvas.ppm"), 6, 5) as writer:
+      writer.write_rows(ColorArray(c.pixels[0:2].reshape(-1, 3)))
+      writer.write_rows(c.pixels[2:5])
+    with open(self.path("canvas.ppm"), 'rb') as f:
+      self.assertEqual(f.read(), reference_ppm(c))
+    with image_writer(self.path("canvas.png"), 6, 5, filter_type='up') as writer:
+      self.assertIsInstance(writer, PNGWriter)
+      for y in range(5):
+        writer.write_rows(c.pixels[y])
+    values, filters = read_png(self.path("canvas.png"))
+    self.assertTrue(np.array_equal(values, quantize(c.pixels)))
+    self.assertEqual(set(filters), {PNG_FILTERS['up']})
+    writer = PPMWriter(self.path("canvas.ppm"), 6, 5)
+    writer.write_rows(c.pixels[0:4])
+    self.assertRaises(ValueError, writer.write_rows, c.pixels[0:2])
+    self.assertRaises(ValueError, writer.close)
+    self.assertRaises(ValueError, image_writer, self.path("canvas.bmp"), 6, 5)
+    # a file object is written to but left open
+    stream = io.BytesIO()
+    with PPMWriter(stream, 6, 5, binary=True) as writer:
+      writer.write_rows(c.pixels)
+    self.assertFalse(stream.closed)
+    self.assertEqual(stream.getvalue(), b"P6\n6 5\n255\n" + quantize(c.pixels).tobytes())
+
+  def test_canvas_pfm(self):
+    c = Canvas(5, 3)
+    c.pixels[...] = np.random.default_rng(9).normal(0, 4, (3, 5, 3))
+    c.write_pixel(0, 0, Color(12.5, -1.0, 0.25))
+    c.to_pfm(self.path("canvas.pfm"))
+    with open(self.path("canvas.pfm"), 'rb') as f:
+      data = f.read()
+    header = b"PF\n5 3\n-1.0\n"
+    self.assertEqual(data[:len(header)], header)
+    # rows are stored bottom to top
+    self.assertEqual(struct.unpack('<3f', data[-5 * 12:-4 * 12]), (12.5, -1.0, 0.25))
+    self.assertTrue(np.array_equal(Canvas.from_pfm(self.path("canvas.pfm")).pixels, c.pixels))
+    # big-endian grayscale
+    with open(self.path("canvas.pfm"), 'wb') as f:
+      f.write(b"Pf\n2 2\n1.0\n" + np.array([0.0, 0.5, 1.0, 2.0], dtype='>f4').tobytes())
+    g = Canvas.from_pfm(self.path("canvas.pfm"))
+    self.assertTrue(g.pixel_at(0, 0).equals(Color(1.0, 1.0, 1.0)))
+    self.assertTrue(g.pixel_at(1, 1).equals(Color(0.5, 0.5, 0.5)))
+    # a mapped canvas is read one block at a time, bottom up, and each block
+    # is released only after it has been written
+    blocks = Canvas.row_blocks
+    events = []
+    with MappedCanvas(5, 3, self.path("canvas.raw")) as m:
+      m.pixels[...] = c.pixels
+      region = m.region
+      m.region = lambda x0, y0, x1, y1: events.append(('read', y0)) or region(x0, y0, x1, y1)
+      m.release = lambda y0, y1: events.append(('release', y0))
+      with mock.patch.object(Canvas, 'row_blocks', lambda self: blocks(self, 15)):
+        m.to_pfm(self.path("mapped.pfm"))
+    self.assertEqual(events, [('read', 2), ('release', 2), ('read', 1), ('release', 1),
+                              ('read', 0), ('release', 0)])
+    with open(self.path("mapped.pfm"), 'rb') as f:
+      self.assertEqual(f.read(), data)
+
+  def test_canvas_from_ppm(self):
+    c = Canvas(9, 4)
+    c.pixels[...] = np.random.default_rng(4).random((4, 9, 3))
+    expected = quantize(c.pixels) / 255.0
+    for binary in (False, True):
+      c.to_ppm(self.path("canvas.ppm"), binary=binary)
+      self.assertTrue(np.allclose(Canvas.from_ppm(self.path("canvas.ppm")).pixels, expected))
+    with open(self.path("canvas.ppm"), 'wb') as f:
+      f.write(b"P3\n# a comment\n2 1\n# another\n15\n15 0 5\n# inside the data\n0 15 3\n")
+    p = Canvas.from_ppm(self.path("canvas.ppm"))
+    self.assertTrue(p.pixel_at(0, 0).equals(Color(1.0, 0.0, 1.0 / 3.0)))
+    self.assertTrue(p.pixel_at(1, 0).equals(Color(0.0, 1.0, 0.2)))
+    with open(self.path("canvas.ppm"), 'wb') as f:
+      f.write(b"P6 1 1 65535\n" + np.array([65535, 0, 32768], dtype='>u2').tobytes())
+    self.assertTrue(Canvas.from_ppm(self.path("canvas.ppm")).pixel_at(0, 0).equals(Color(1.0, 0.0, 0.5)))
+    with open(self.path("canvas.ppm"), 'wb') as f:
+      f.write(b"P3\n2 1\n255\n1 2 3\n")
+    self.assertRaises(ValueError, Canvas.from_ppm, self.path("canvas.ppm"))
+
+  def test_canvas_write_pixels(self):
+    c = Canvas(10, 20)
+    xs = np.array([2, 9, 10, -1, 3])
+    ys = np.array([3, 19, 0, 5, 20])
+    written = c.write_pixels(xs, ys, Color(1, 0, 0))
+    self.assertEqual(written.tolist(), [True, True, False, False, False])
+    self.assertTrue(c.pixel_at(2, 3).equals(Color(1, 0, 0)))
+    self.assertTrue(c.pixel_at(9, 19).equals(Color(1, 0, 0)))
+    self.assertEqual(int(np.count_nonzero(c.pixels)), 2)
+    colors = ColorArray.from_tuples([Color(0, 1, 0), Color(0, 0, 1), Color(1, 1, 1)])
+    written = c.write_pixels([0, 11, 4], [0, 0, 4], colors)
+    self.assertEqual(written.tolist(), [True, False, True])
+    self.assertTrue(c.pixel_at(0, 0).equals(Color(0, 1, 0)))
+    self.assertTrue(c.pixel_at(4, 4).equals(Color(1, 1, 1)))
+
+  def test_shared_canvas(self):
+    with SharedCanvas(6, 4, Color(0.1, 0.2, 0.3)) as c:
+      self.assertTrue(c.pixel_at(5, 3).equals(Color(0.1, 0.2, 0.3)))
+      attached = SharedCanvas.attach(c.name, 6, 4)
+      self.assertFalse(attached.owner)
+      attached.write_pixel(1, 1, Color(1, 0, 0))
+      attached.close()
+      self.assertTrue(c.pixel_at(1, 1).equals(Color(1, 0, 0)))
+      self.assertRaises(ValueError, SharedCanvas.attach, c.name, 60, 40)
+      context = multiprocessing.get_context('spawn')
+      workers = [context.Process(target=fill_shared_rows, args=(c, y, y + 2, y / 4.0)) for y in (0, 2)]
+      for worker in workers:
+        worker.start()
+      for worker in workers:
+        worker.join()
+        self.assertEqual(worker.exitcode, 0)
+      self.assertTrue(c.pixel_at(5, 0).equals(Color(0, 0, 0)))
+      self.assertTrue(c.pixel_at(0, 3).equals(Color(0.5, 0.5, 0.5)))
+      name = c.name
+    self.assertRaises(FileNotFoundError, SharedCanvas.attach, name, 6, 4)
+
+  def test_shared_canvas_worker_exit(self):
+    # a worker that attached by name must not take the block with it when
+    # it exits, whether it shares this process's resource tracker (a
+    # multiprocessing child) or has its own (an independent interpreter)
+    c = SharedCanvas(3, 2, Color(0.25, 0.5, 0.75))
+    try:
+      worker = multiprocessing.get_context('spawn').Process(target=attach_and_mark, args=(c.name, 3, 2))
+      worker.start()
+      worker.join()
+      self.assertEqual(worker.exitcode, 0)
+      c.write_pixel(0, 0, Color(0, 0, 0))
+      script = "from canvas_tests import attach_and_mark; attach_and_mark({0!r}, 3, 2)".format(c.name)
+      # capturing stderr also waits for the child's resource tracker, which
+      # holds the pipe open until it has done its cleanup
+      result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)))
+      self.assertEqual(result.returncode, 0, result.stderr)
+      self.assertNotIn("leaked", result.stderr)
+      self.assertTrue(c.pixel_at(0, 0).equals(Color(0, 1, 0)))
+      self.assertTrue(c.pixel_at(2, 1).equals(Color(0.25, 0.5, 0.75)))
+      attached = SharedCanvas.attach(c.name, 3, 2)
+      self.assertTrue(attached.pixel_at(0, 0).equals(Color(0, 1, 0)))
+      attached.close()
+    finally:
+      c.close()
+    c.unlink()
+    self.assertRaises(FileNotFoundError, SharedCanvas.attach, c.name, 3, 2)
+    # an owner that dies without unlinking still has its block cleaned up
+    # by its tracker after a multiprocessing worker attached and exited
+    script = ("import multiprocessing, os\n"
+              "from canvas import SharedCanvas\n"
+              "from canvas_tests import attach_and_mark\n"
+              "c = SharedCanvas(3, 2)\n"
+              "worker = multiprocessing.get_context('spawn').Process(target=attach_and_mark, args=(c.name, 3, 2))\n"
+              "worker.start()\n"
+              "worker.join()\n"
+              "print(c.name, flush=True)\n"
+              "os._exit(worker.exitcode)\n")
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    self.assertEqual(result.returncode, 0, result.stderr)
+    self.assertRaises(FileNotFoundError, SharedCanvas.attach, result.stdout.strip(), 3, 2)
+
+  def test_frame_sink(self):
+    frames = [Canvas(4, 3, Color(i / 4.0, 0.5, 1.0 - i / 4.0)) for i in range(5)]
+    raw = b"".join(quantize(f.pixels).tobytes() for f in frames)
+    for background in (False, True):
+      stream = io.BytesIO()
+      with FrameSink(stream, background=background, queue_size=2) as sink:
+        for frame in frames:
+          sink.write_frame(frame)
+      self.assertEqual(sink.frames, 5)
+      self.assertEqual(stream.getvalue(), raw)
+    with FrameSink(self.path("canvas.ppm"), kind='p6') as sink:
+      sink.write_frame(frames[0])
+      sink.write_frame(frames[1].pixels)
+      self.assertRaises(ValueError, sink.write_frame, Canvas(3, 4))
+    with open(self.path("canvas.ppm"), 'rb') as f:
+      data = f.read()
+    header = b"P6\n4 3\n255\n"
+    frame = header + quantize(frames[0].pixels).tobytes()
+    self.assertEqual(data, frame + header + quantize(frames[1].pixels).tobytes())
+    self.assertAlmostEqual(Canvas.from_ppm(self.path("canvas.ppm")).pixel_at(0, 0).g, 128 / 255.0)
+    self.assertRaises(ValueError, FrameSink, io.BytesIO(), kind='yuv')
@@ -6,8 +6,7 @@ from ray_tracer import Camera, PointLight, World
 from shape import Material, Sphere
 from tuple import Point, Vector
 
-if __name__ == '__main__':
-
+def build_world():
   world = World()
   world.light = PointLight(Point(-10, 10, -10), Color(1, 1, 1))
 
@@ -58,13 +57,22 @@ if __name__ == '__main__':
   left_s.material.diffuse = 0.7
   left_s.material.specular = 0.3
   world.add_shape(left_s)
+  return world
 
-  # add a camera and render the scene
-  camera = Camera(300, 200, math.pi / 3.0)
+def build_camera(world, hsize=300, vsize=200):
+  camera = Camera(hsize, vsize, math.pi / 3.0)
   from_p = Point(0, 1.5, -5)
   to_p = Point(0, 1, 0)
   up = Vector(0, 1, 0)
   camera.transform = world.view_transform(from_p, to_p, up)
+  return camera
+
+if __name__ == '__main__':
+
+  world = build_world()
+
+  # add a camera and render the scene
+  camera = build_camera(world)
   print("\nRendering scene to canvas...")
   canvas = camera.render(world)
   print("\nWriting canvas to PPM file...")
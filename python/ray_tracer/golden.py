@@ -0,0 +1,94 @@
+import argparse
+import numpy as np
+import os
+import sys
+
+import ch7_program
+import ch9_program
+import ch10_program
+import ch11_program
+
+from canvas import Canvas
+
+# chapter scenes with their golden render sizes, kept small so the whole set
+# renders in a few seconds
+SCENES = {
+  'ch7': (ch7_program, 60, 40),
+  'ch9': (ch9_program, 60, 30),
+  'ch10': (ch10_program, 60, 30),
+  'ch11': (ch11_program, 60, 30),
+}
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+# largest per-channel difference from the reference that still passes
+DEFAULT_TOLERANCE = 1e-4
+
+
+class Comparison:
+  # per-channel comparison of a render against its reference
+  def __init__(self, image, reference, tolerance=DEFAULT_TOLERANCE):
+    if (image.width, image.height) != (reference.width, reference.height):
+      raise ValueError("Image is {0}x{1}, reference is {2}x{3}".format(
+        image.width, image.height, reference.width, reference.height))
+    self.tolerance = tolerance
+    self.error = np.abs(image.pixels.astype(float) - reference.pixels)
+    self.max_error = float(self.error.max(initial=0.0))
+    self.mean_error = float(self.error.mean()) if self.error.size else 0.0
+    self.failed = np.any(self.error > tolerance, axis=2)
+    self.failed_pixels = int(np.count_nonzero(self.failed))
+
+  def passed(self):
+    return self.failed_pixels == 0
+
+  def diff_image(self):
+    # errors scaled so the tolerance maps to mid gray, with every pixel
+    # over the tolerance in solid red
+    diff = Canvas(self.error.shape[1], self.error.shape[0])
+    diff.pixels[...] = np.minimum(self.error / (2.0 * self.tolerance), 1.0)
+    diff.pixels[self.failed] = (1.0, 0.0, 0.0)
+    return diff
+
+
+def render_scene(name):
+  module, hsize, vsize = SCENES[name]
+  world = module.build_world()
+  return module.build_camera(world, hsize, vsize).render(world)
+
+
+def reference_path(name):
+  return os.path.join(GOLDEN_DIR, name + ".pfm")
+
+
+def check_scene(name, tolerance=DEFAULT_TOLERANCE):
+  return Comparison(render_scene(name), Canvas.from_pfm(reference_path(name)), tolerance)
+
+
+def update_scene(name):
+  os.makedirs(GOLDEN_DIR, exist_ok=True)
+  render_scene(name).to_pfm(reference_path(name))
+
+
+if __name__ == '__main__':
+
+  parser = argparse.ArgumentParser(description="Compare the chapter scenes against their golden images")
+  parser.add_argument('scenes', nargs='*', help="scenes to check (default: all)")
+  parser.add_argument('--update', action='store_true', help="re-render and store the references")
+  parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+  parser.add_argument('--diff-dir', default='.', help="where to write <scene>_diff.png on failure")
+  args = parser.parse_args()
+
+  failures = 0
+  for name in args.scenes or list(SCENES):
+    if args.update:
+      update_scene(name)
+      print("{0:<6} updated {1}".format(name, reference_path(name)))
+      continue
+    comparison = check_scene(name, args.tolerance)
+    status = "ok" if comparison.passed() else "FAILED"
+    print("{0:<6} {1:<6} max {2:.3g} mean {3:.3g} pixels over tolerance {4}".format(
+      name, status, comparison.max_error, comparison.mean_error, comparison.failed_pixels))
+    if not comparison.passed():
+      failures += 1
+      diff_name = os.path.join(args.diff_dir, name + "_diff.png")
+      comparison.diff_image().to_png(diff_name)
+      print("       diff written to " + diff_name)
+  sys.exit(1 if failures else 0)
@@ -0,0 +1,30 @@
+import unittest
+
+from canvas import Canvas, Color
+from golden import Comparison, SCENES, check_scene
+
+class GoldenTestCase(unittest.TestCase):
+
+  def test_comparison(self):
+    reference = Canvas(4, 2, Color(0.5, 0.5, 0.5))
+    image = Canvas(4, 2, Color(0.5, 0.5, 0.5))
+    image.write_pixel(1, 1, Color(0.5, 0.5, 0.75))
+    image.pixels[0, 0, 0] += 5e-5
+    comparison = Comparison(image, reference, tolerance=1e-4)
+    self.assertFalse(comparison.passed())
+    self.assertEqual(comparison.failed_pixels, 1)
+    self.assertAlmostEqual(comparison.max_error, 0.25)
+    diff = comparison.diff_image()
+    self.assertTrue(diff.pixel_at(1, 1).equals(Color(1, 0, 0)))
+    self.assertAlmostEqual(diff.pixel_at(0, 0).r, 0.25, 2)
+    self.assertTrue(Comparison(reference, reference).passed())
+    self.assertRaises(ValueError, Comparison, Canvas(2, 4), reference)
+
+  def test_chapter_scenes(self):
+    for name in SCENES:
+      comparison = check_scene(name)
+      self.assertTrue(comparison.passed(), "{0}: {1} pixels over tolerance, max error {2}".format(
+        name, comparison.failed_pixels, comparison.max_error))
+
+if __name__ == '__main__':
+    unittest.main()
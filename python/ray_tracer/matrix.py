@@ -5,25 +5,81 @@ from enum import Enum
 from tuple import Tuple, Point, Vector
 from utils import EPSILON
 
+AFFINE_ROW = np.array([0.0, 0.0, 0.0, 1.0])
+
+# kernels available for Matrix * Tuple: 'python' works on cached row-major
+# floats, 'numpy' goes through np.matmul
+TUPLE_BACKENDS = ('python', 'numpy')
+tuple_backend = 'python'
+
+
+def set_tuple_backend(name):
+  global tuple_backend
+  if name not in TUPLE_BACKENDS:
+    raise ValueError("Unknown tuple backend: {0}".format(name))
+  tuple_backend = name
+
+
+def affine_inverse(data):
+  # invert [A t; 0 1] as [A^-1 -A^-1*t; 0 1], with A^-1 from the 3x3 adjugate;
+  # plain float arithmetic beats LU on a matrix this small
+  (a, b, c, tx), (d, e, f, ty), (g, h, i, tz) = data[:3].tolist()
+  co_a = e * i - f * h
+  co_b = f * g - d * i
+  co_c = d * h - e * g
+  det = a * co_a + b * co_b + c * co_c
+  if det == 0:
+    raise np.linalg.LinAlgError("Singular matrix")
+  inv_det = 1.0 / det
+  r00 = co_a * inv_det
+  r01 = (c * h - b * i) * inv_det
+  r02 = (b * f - c * e) * inv_det
+  r10 = co_b * inv_det
+  r11 = (a * i - c * g) * inv_det
+  r12 = (c * d - a * f) * inv_det
+  r20 = co_c * inv_det
+  r21 = (b * g - a * h) * inv_det
+  r22 = (a * e - b * d) * inv_det
+  return np.array([[r00, r01, r02, -(r00 * tx + r01 * ty + r02 * tz)],
+                   [r10, r11, r12, -(r10 * tx + r11 * ty + r12 * tz)],
+                   [r20, r21, r22, -(r20 * tx + r21 * ty + r22 * tz)],
+                   [0.0, 0.0, 0.0, 1.0]])
+
 
 class Matrix:
+  # process-wide counters for the inverse/transpose cache
+  cache_hits = 0
+  cache_misses = 0
 
-  def __init__(self, data):
+  def __init__(self, data, affine=None):
     self.data = np.array(data)
+    # affine matrices (bottom row 0 0 0 1) can use the cheap affine inverse
+    if affine is None:
+      affine = self._is_affine()
+    self.affine = affine
+    # transform subclasses set this to a callable returning their exact inverse
+    self._exact_inverse = None
+    self.clear_cache()
 
   def __getitem__(self, key):
     return self.data[key[0], key[1]]
 
   def __setitem__(self, key, value):
     self.data[key[0], key[1]] = value
+    self._exact_inverse = None
+    if key[0] == 3:
+      self.affine = self._is_affine()
+    self.clear_cache()
 
   def __eq__(self, matrix):
     return np.allclose(self.data, matrix.data, atol=EPSILON, rtol=0.0)
 
   def __mul__(self, other):
     if isinstance(other, Matrix):
-      return Matrix(np.matmul(self.data, other.data))
+      return Matrix(np.matmul(self.data, other.data), self.affine and other.affine)
     elif isinstance(other, Tuple):
+      if tuple_backend == 'python':
+        return self._mul_tuple(other)
       b = np.array([other.x, other.y, other.z, other.w])
       result = np.matmul(self.data, b)
       if other.w == 1:
@@ -31,20 +87,116 @@ class Matrix:
       else:
         return Vector(result[0], result[1], result[2])
 
+  def _mul_tuple(self, tup):
+    rows = self._rows
+    if rows is None:
+      rows = self._rows = self.data[:3].ravel().tolist()
+    m00, m01, m02, m03, m10, m11, m12, m13, m20, m21, m22, m23 = rows
+    x, y, z, w = tup.x, tup.y, tup.z, tup.w
+    if w == 1:
+      return Point(m00 * x + m01 * y + m02 * z + m03,
+                   m10 * x + m11 * y + m12 * z + m13,
+                   m20 * x + m21 * y + m22 * z + m23)
+    elif w == 0:
+      return Vector(m00 * x + m01 * y + m02 * z,
+                    m10 * x + m11 * y + m12 * z,
+                    m20 * x + m21 * y + m22 * z)
+    else:
+      return Vector(m00 * x + m01 * y + m02 * z + m03 * w,
+                    m10 * x + m11 * y + m12 * z + m13 * w,
+                    m20 * x + m21 * y + m22 * z + m23 * w)
+
+  def transform_points(self, points, out=None):
+    return self._transform_array(points, 1.0, out)
+
+  def transform_vectors(self, vectors, out=None):
+    return self._transform_array(vectors, 0.0, out)
+
+  def _transform_array(self, tuples, w, out):
+    # tuples is (N,3) with an implied w, or (N,4) carrying its own w column;
+    # each output column is summed in the same order as the Tuple product
+    tuples = np.asarray(tuples, dtype=float)
+    if tuples.ndim != 2 or tuples.shape[1] not in (3, 4):
+      raise ValueError("Expected an (N,3) or (N,4) array of tuples")
+    if out is not None and out.shape != tuples.shape:
+      raise ValueError("Output array must have the same shape as the input")
+    if out is None or np.shares_memory(out, tuples):
+      result = np.empty(tuples.shape)
+    else:
+      result = out
+    x, y, z = tuples[:, 0], tuples[:, 1], tuples[:, 2]
+    m = self.data.tolist()
+    for i in range(tuples.shape[1]):
+      col = result[:, i]
+      np.multiply(x, m[i][0], out=col)
+      col += m[i][1] * y
+      col += m[i][2] * z
+      if tuples.shape[1] == 4:
+        col += m[i][3] * tuples[:, 3]
+      elif w:
+        col += m[i][3]
+    if out is not None and result is not out:
+      out[...] = result
+      return out
+    return result
+
   def transpose(self):
-    return Matrix(self.data.transpose())
+    if self._transpose is None:
+      Matrix.cache_misses += 1
+      self._transpose = Matrix(self.data.transpose())
+    else:
+      Matrix.cache_hits += 1
+    return self._transpose
 
   def determinant(self):
     return round(np.linalg.det(self.data), 5)
 
   def inverse(self):
-    return Matrix(np.linalg.inv(self.data))
+    if self._inverse is None:
+      Matrix.cache_misses += 1
+      if self._exact_inverse is not None:
+        self._inverse = self._exact_inverse()
+      elif self.affine:
+        self._inverse = Matrix(affine_inverse(self.data), True)
+      else:
+        self._inverse = Matrix(np.linalg.inv(self.data))
+    else:
+      Matrix.cache_hits += 1
+    return self._inverse
+
+  def inverse_transpose(self):
+    if self._inverse_transpose is None:
+      Matrix.cache_misses += 1
+      self._inverse_transpose = self.inverse().transpose()
+    else:
+      Matrix.cache_hits += 1
+    return self._inverse_transpose
+
+  def clear_cache(self):
+    # drop derived matrices; called whenever the data changes
+    self._inverse = None
+    self._transpose = None
+    self._inverse_transpose = None
+    self._rows = None
+
+  def _is_affine(self):
+    return self.data.shape == (4, 4) and np.array_equal(self.data[3], AFFINE_ROW)
+
+  @staticmethod
+  def cache_stats():
+    return {'hits': Matrix.cache_hits, 'misses': Matrix.cache_misses}
+
+  @staticmethod
+  def reset_cache_stats():
+    Matrix.cache_hits = 0
+    Matrix.cache_misses = 0
 
 
 class Identity_Matrix(Matrix):
 
   def __init__(self, n):
-    self.data = np.identity(n)
+    super().__init__(np.identity(n))
+    self._exact_inverse = lambda: Identity_Matrix(n)
 
 
 class Translation_Matrix(Identity_Matrix):
@@ -54,6 +206,7 @@ class Translation_Matrix(Identity_Matrix):
     self[0, 3] = x
     self[1, 3] = y
     self[2, 3] = z
+    self._exact_inverse = lambda: Translation_Matrix(-x, -y, -z)
 
 
 class Scaling_Matrix(Identity_Matrix):
@@ -63,6 +216,9 @@ class Scaling_Matrix(Identity_Matrix):
     self[0, 0] = x
     self[1, 1] = y
     self[2, 2] = z
+    # a zero scale is singular; leave it to the generic path to raise
+    if x != 0 and y != 0 and z != 0:
+      self._exact_inverse = lambda: Scaling_Matrix(1.0 / x, 1.0 / y, 1.0 / z)
 
 
 class Rotation_Axis(Enum):
@@ -92,6 +248,8 @@ class Rotation_Matrix(Identity_Matrix):
       self[1, 1] = math.cos(rads)
     else:
       raise TypeError("Invalid Rotation_Axis for rotation matrix")
+    # rotations are orthonormal, so the inverse is just the transpose
+    self._exact_inverse = lambda: Matrix(self.data.transpose(), True)
 
 
 class Shearing_Matrix(Identity_Matrix):
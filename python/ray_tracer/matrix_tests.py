@@ -1,6 +1,9 @@
 import math
+import numpy as np
 import unittest
 
+import matrix
+
 from matrix import Matrix, Identity_Matrix, Translation_Matrix, Scaling_Matrix, Rotation_Axis, Rotation_Matrix, Shearing_Matrix
 from tuple import Point, Vector
 
@@ -174,3 +177,93 @@ class MatrixTestCase(unittest.TestCase):
     T = C * B * A
     result = T * p
     self.assertTrue(result.equals(Point(15, 0, 7)))
+
+  def test_matrix_inverse_cache(self):
+    A = Matrix([[-5, 2, 6, -8], [1, -5, 1, 8], [7, 7, -6, -7], [1, -3, 7, 4]])
+    Matrix.reset_cache_stats()
+    A_inv = A.inverse()
+    self.assertEqual(Matrix.cache_stats(), {'hits': 0, 'misses': 1})
+    self.assertIs(A.inverse(), A_inv)
+    self.assertIs(A.transpose(), A.transpose())
+    self.assertEqual(Matrix.cache_stats(), {'hits': 2, 'misses': 2})
+    self.assertEqual(A.inverse_transpose(), A_inv.transpose())
+    # writing to the matrix invalidates every cached result
+    A[0, 0] = 1
+    A_inv2 = A.inverse()
+    self.assertIsNot(A_inv2, A_inv)
+    self.assertEqual(A * A_inv2, Identity_Matrix(4))
+    self.assertEqual(A.transpose()[0, 0], 1)
+    self.assertEqual(A.inverse_transpose(), A_inv2.transpose())
+
+  def test_transform_exact_inverse(self):
+    T = Translation_Matrix(5, -3, 2)
+    self.assertIsInstance(T.inverse(), Translation_Matrix)
+    self.assertEqual(T.inverse(), Matrix(np.linalg.inv(T.data)))
+    S = Scaling_Matrix(2, 4, -8)
+    self.assertIsInstance(S.inverse(), Scaling_Matrix)
+    self.assertEqual(S.inverse(), Matrix(np.linalg.inv(S.data)))
+    R = Rotation_Matrix(Rotation_Axis.Y, 30)
+    self.assertTrue(np.array_equal(R.inverse().data, R.data.transpose()))
+    # writing to a transform falls back to the generic inverse
+    T[0, 0] = 2
+    self.assertEqual(T * T.inverse(), Identity_Matrix(4))
+
+  def test_affine_inverse(self):
+    A = Translation_Matrix(1, 2, 3) * Rotation_Matrix(Rotation_Axis.X, 40) * \
+        Shearing_Matrix(1, 0.5, 0, 2, 0, 0) * Scaling_Matrix(2, 3, 0.5)
+    self.assertTrue(A.affine)
+    self.assertTrue(np.allclose(A.inverse().data, np.linalg.inv(A.data), rtol=0.0, atol=1e-12))
+    self.assertTrue(A.inverse().affine)
+    self.assertEqual(A * A.inverse(), Identity_Matrix(4))
+    # affine structure is detected from data and dropped when the last row changes
+    B = Matrix([[1, 2, 3, 4], [2, 4, 4, 2], [8, 6, 4, 1], [0, 0, 0, 1]])
+    self.assertTrue(B.affine)
+    B[3, 0] = 1
+    self.assertFalse(B.affine)
+    self.assertFalse((B * A).affine)
+    self.assertRaises(np.linalg.LinAlgError, Scaling_Matrix(1, 0, 1).inverse)
+
+  def test_transform_arrays(self):
+    T = Translation_Matrix(1, 2, 3) * Rotation_Matrix(Rotation_Axis.Z, 30) * Scaling_Matrix(2, 3, 4)
+    a = np.array([[1.0, 2.0, 3.0], [-4.0, 0.5, 2.0], [0.0, 0.0, 0.0]])
+    points = T.transform_points(a)
+    vectors = T.transform_vectors(a)
+    for i in range(len(a)):
+      p = T * Point(*a[i])
+      v = T * Vector(*a[i])
+      self.assertTrue(p.equals(Point(*points[i])))
+      self.assertTrue(v.equals(Vector(*vectors[i])))
+    # (N,4) arrays carry their own w column
+    a4 = np.array([[1.0, 2.0, 3.0, 1.0], [1.0, 2.0, 3.0, 0.0]])
+    result = T.transform_points(a4)
+    self.assertTrue(np.allclose(result, np.matmul(a4, T.data.transpose())))
+    self.assertEqual(result[0, 3], 1.0)
+    self.assertEqual(result[1, 3], 0.0)
+    # in-place transforms write back into the input
+    b = a.copy()
+    self.assertIs(T.transform_points(b, out=b), b)
+    self.assertTrue(np.array_equal(b, points))
+    out = np.empty((3, 3))
+    T.transform_vectors(a, out=out)
+    self.assertTrue(np.array_equal(out, vectors))
+    self.assertRaises(ValueError, T.transform_points, np.zeros((3, 2)))
+
+  def test_tuple_backends(self):
+    T = Translation_Matrix(1, 2, 3) * Rotation_Matrix(Rotation_Axis.X, 30) * Scaling_Matrix(2, 3, 4)
+    p = Point(1, -2, 3)
+    v = Vector(1, -2, 3)
+    results = {}
+    try:
+      for backend in matrix.TUPLE_BACKENDS:
+        matrix.set_tuple_backend(backend)
+        results[backend] = (T * p, T * v)
+    finally:
+      matrix.set_tuple_backend('python')
+    self.assertTrue(results['python'][0].is_point())
+    self.assertTrue(results['python'][1].is_vector())
+    self.assertTrue(results['python'][0].equals(results['numpy'][0]))
+    self.assertTrue(results['python'][1].equals(results['numpy'][1]))
+    self.assertRaises(ValueError, matrix.set_tuple_backend, 'fortran')
+    # the cached rows follow writes to the matrix
+    T[0, 3] = 10
+    self.assertTrue((T * Point(0, 0, 0)).equals(Point(10, 2, 3)))
@@ -4,18 +4,45 @@ from abc import ABC, abstractmethod
 from canvas import Color
 from matrix import Identity_Matrix
 
+# shape transforms remembered per pattern before the cache starts over
+WORLD_TO_PATTERN_CACHE_SIZE = 64
+
 class Pattern(ABC):
   def __init__(self):
     self.transform = Identity_Matrix(4)
     super().__init__()
 
+  @property
+  def transform(self):
+    return self._transform
+
+  @transform.setter
+  def transform(self, transform):
+    self._transform = transform
+    self._world_to_pattern = {}
+
   def set_transform(self, transform):
     self.transform = transform
-  
+
+  def world_to_pattern(self, shape):
+    # the pattern inverse combined with the shape's world-to-object matrix,
+    # so each lookup costs one matrix product instead of two. Entries are
+    # keyed on the shape's matrix, which is replaced whenever it moves, and
+    # remember the pattern inverse they were built from: writing into the
+    # pattern's matrix drops its cached inverse, so the next lookup gets a
+    # new one and rebuilds the entry
+    world_to_object = shape.world_to_object
+    pattern_inverse = self._transform.inverse()
+    entry = self._world_to_pattern.get(id(world_to_object))
+    if entry is None or entry[0] is not world_to_object or entry[1] is not pattern_inverse:
+      if len(self._world_to_pattern) >= WORLD_TO_PATTERN_CACHE_SIZE:
+        self._world_to_pattern.clear()
+      entry = (world_to_object, pattern_inverse, pattern_inverse * world_to_object)
+      self._world_to_pattern[id(world_to_object)] = entry
+    return entry[2]
+
   def pattern_at_shape(self, shape, world_point):
-    object_point = shape.transform.inverse() * world_point
-    pattern_point = self.transform.inverse() * object_point
-    return self.pattern_at(pattern_point)
+    return self.pattern_at(self.world_to_pattern(shape) * world_point)
   
   @abstractmethod
   def pattern_at(self, point):
@@ -49,9 +76,8 @@ class GradientPattern(Pattern):
     self.cb = cb
 
   def pattern_at(self, point):
-    distance = self.cb.subtract(self.ca)
     fraction = point.x - math.floor(point.x)
-    return self.ca.add(distance.scalar_multiply(fraction))
+    return self.ca.lerp(self.cb, fraction)
 
 
 class RingPattern(Pattern):
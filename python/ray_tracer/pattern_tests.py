@@ -34,6 +34,22 @@ class PatternTestCase(unittest.TestCase):
     c = pattern.pattern_at_shape(shape, Point(2.5, 3, 3.5))
     self.assertTrue(c.equals(Color(0.75, 0.5, 0.25)))
 
+  def test_world_to_pattern_cache(self):
+    pattern = TestPattern()
+    pattern.transform = Translation_Matrix(0.5, 1, 1.5)
+    shape = Sphere()
+    shape.transform = Scaling_Matrix(2, 2, 2)
+    m = pattern.world_to_pattern(shape)
+    self.assertIs(pattern.world_to_pattern(shape), m)
+    # moving the shape or the pattern is picked up
+    shape.transform = Translation_Matrix(1, 0, 0)
+    self.assertTrue(pattern.pattern_at_shape(shape, Point(2, 3, 4)).equals(Color(0.5, 2, 2.5)))
+    pattern.transform = Identity_Matrix(4)
+    self.assertTrue(pattern.pattern_at_shape(shape, Point(2, 3, 4)).equals(Color(1, 3, 4)))
+    # so is writing into the pattern's matrix in place
+    pattern.transform[0, 3] = 0.5
+    self.assertTrue(pattern.pattern_at_shape(shape, Point(2, 3, 4)).equals(Color(0.5, 3, 4)))
+
   def test_stripe_pattern(self):
     pattern = StripePattern(self.white, self.black)
     self.assertTrue(pattern.ca.equals(self.white))
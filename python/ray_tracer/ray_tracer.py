@@ -1,14 +1,24 @@
 import math
+import numpy as np
+import time
 
-from canvas import Canvas, Color
+from bounds import inverse_direction
+from bvh import BVH, merge_hits, slab_entry
+from canvas import Canvas, Color, ColorArray, image_writer
 from matrix import Matrix, Identity_Matrix, Scaling_Matrix, Translation_Matrix
 from operator import itemgetter
 from shape import Material, Sphere
 from tuple import Point
+from tuple_array import PointArray, TupleArray
 from utils import EPSILON
 
 
 DEFAULT_REMAINING = 4
+# render_rows finds the primary hits of whole rows at a time, about this many
+# rays per packet
+PACKET_RAYS = 1024
+# without a BVH, closest_hits box-tests about this many shape/ray pairs at once
+CULL_BLOCK_PAIRS = 1 << 18
 
 class Intersection:
   def __init__(self, t, shape):
@@ -34,15 +44,15 @@ class Computations:
     self.t = intersection.t
     self.shape = intersection.shape
     self.point = ray.position(self.t)
-    self.eyev = ray.direction.scalar_multiply(-1.0)
+    self.eyev = ray.direction.negate()
     self.normalv = self.shape.normal_at(self.point)
     if self.normalv.dot(self.eyev) < 0:
       self.inside = True
-      self.normalv = self.normalv.scalar_multiply(-1.0)
+      self.normalv = self.normalv.negate()
     else:
       self.inside = False
-    self.over_point = self.point.add(self.normalv.scalar_multiply(EPSILON))
-    self.under_point = self.point.subtract(self.normalv.scalar_multiply(EPSILON))
+    self.over_point = self.point.add_scaled(self.normalv, EPSILON)
+    self.under_point = self.point.add_scaled(self.normalv, -EPSILON)
     self.reflectv = ray.direction.reflect(self.normalv)
     # set refractive index for exiting/entering shapes
     containers = []
@@ -84,7 +94,7 @@ class Ray:
     self.intersections = []
 
   def position(self, t):
-    return self.origin.add(self.direction.scalar_multiply(t))
+    return self.origin.add_scaled(self.direction, t)
 
   def intersect(self, shape):
     xs = shape.intersect(self)
@@ -116,53 +126,236 @@ class PointLight:
     else:
       color = material.color
     effective_color = color.hadamard_product(self.intensity)
-    ambient = effective_color.scalar_multiply(material.ambient)
 
     if in_shadow:
-      return ambient
+      return effective_color.scalar_multiply(material.ambient)
 
+    # ambient, diffuse and specular are all scaled colors, so they are
+    # combined with one weighted sum instead of three Colors and two adds
+    diffuse = 0.0
+    specular = 0.0
     lightv = self.position.subtract(point).normalize()
     light_dot_normal = lightv.dot(normalv)
-    if light_dot_normal < 0:
-      diffuse = Color(0.0, 0.0, 0.0)
-      specular = Color(0.0, 0.0, 0.0)
-    else:
-      diffuse = effective_color.scalar_multiply(material.diffuse * light_dot_normal)
-      reflectv = lightv.scalar_multiply(-1.0).reflect(normalv)
-      reflect_dot_eye = reflectv.dot(eyev)
-      if reflect_dot_eye < 0:
-        specular = Color(0.0, 0.0, 0.0)
-      else:
-        factor = math.pow(reflect_dot_eye, material.shininess)
-        specular = self.intensity.scalar_multiply(material.specular * factor)
+    if light_dot_normal >= 0:
+      diffuse = material.diffuse * light_dot_normal
+      # reflecting -lightv is the negation of reflecting lightv, so reuse lightv
+      reflect_dot_eye = -lightv.reflect(normalv, out=lightv).dot(eyev)
+      if reflect_dot_eye >= 0:
+        specular = material.specular * math.pow(reflect_dot_eye, material.shininess)
+
+    return Color.weighted_sum((effective_color, effective_color, self.intensity),
+                              (material.ambient, diffuse, specular))
+
 
-    return ambient.add(diffuse.add(specular))
+class RenderStats:
+  # timings for one World.render_views job
+  def __init__(self, prepare_seconds, view_seconds, pixels):
+    self.prepare_seconds = prepare_seconds
+    self.view_seconds = view_seconds
+    self.pixels = pixels
+
+  def total_seconds(self):
+    return self.prepare_seconds + sum(self.view_seconds)
+
+  def per_view_seconds(self):
+    # amortized cost of one view, scene preparation included
+    return self.total_seconds() / max(1, len(self.view_seconds))
+
+  def per_pixel_seconds(self):
+    return self.total_seconds() / max(1, self.pixels)
 
 
 class World:
   def __init__(self):
     self.light = None
     self.shapes = []
+    self.prepared = False
+    # set by build_bvh; prepare() brings the tree up to date after the scene
+    # changes, refitting moved shapes (tracked in dirty) where it can
+    self.use_bvh = False
+    self.bvh = None
+    self.bvh_options = {}
+    self.bvh_builds = 0
+    self.dirty = {}
+    # how many of shapes report their moves here; shapes appended to the list
+    # directly instead of through add_shape are adopted by prepare()
+    self.adopted = 0
+    # shape tests run and rejected by the bounding box check in intersect
+    self.box_tests = 0
+    self.box_rejections = 0
 
   def add_shape(self, shape):
     self.shapes.append(shape)
+    shape.worlds.add(self)
+    self.adopted += 1
+    self.prepared = False
+    if self.bvh is not None:
+      self.bvh.insert(shape)
+
+  def remove_shape(self, shape):
+    self.shapes.remove(shape)
+    shape.worlds.discard(self)
+    self.adopted -= 1
+    self.dirty.pop(shape, None)
+    self.prepared = False
+    if self.bvh is not None:
+      self.bvh.remove(shape)
+
+  def shape_changed(self, shape):
+    # called by a shape of this world whenever its transform is assigned
+    self.dirty[shape] = True
+    self.prepared = False
+
+  def adopt_shapes(self):
+    # start tracking the moves of shapes appended to self.shapes directly;
+    # returns the newly tracked shapes
+    adopted = [shape for shape in self.shapes if self not in shape.worlds]
+    for shape in adopted:
+      shape.worlds.add(self)
+    self.adopted = len(self.shapes)
+    return adopted
+
+  def build_bvh(self, **options):
+    # accelerate intersect and color_at with a BVH over the shapes; options
+    # go to the BVH constructor (leaf_size, bins) and are kept for rebuilds
+    self.adopt_shapes()
+    self.use_bvh = True
+    self.bvh_options = options
+    self.bvh = BVH(self.shapes, **options)
+    self.bvh_builds += 1
+    self.dirty = {}
+    return self.bvh
+
+  def update_bvh(self):
+    # refit the tree around moved shapes; rebuild it instead when a shape
+    # can't be refitted or the updates have degraded it past the threshold
+    if self.bvh is not None and self.dirty and not self.bvh.refit(self.dirty):
+      self.bvh = None
+    if self.bvh is None or self.bvh.needs_rebuild():
+      self.build_bvh(**self.bvh_options)
+    self.dirty = {}
+
+  def prepare(self):
+    # build the scene-side state every render can share; does nothing until
+    # the scene changes again
+    if self.prepared and self.adopted == len(self.shapes):
+      return
+    adopted = self.adopt_shapes()
+    if self.use_bvh:
+      if self.bvh is not None:
+        for shape in adopted:
+          self.bvh.insert(shape)
+      self.update_bvh()
+    for shape in self.shapes:
+      if shape.material.pattern:
+        shape.material.pattern.world_to_pattern(shape)
+    self.prepared = True
+
+  def render_views(self, cameras):
+    # render several views of this world, preparing the scene once; returns
+    # the canvases in camera order and a RenderStats
+    start = time.perf_counter()
+    self.prepare()
+    prepare_seconds = time.perf_counter() - start
+    canvases = []
+    view_seconds = []
+    for camera in cameras:
+      start = time.perf_counter()
+      canvases.append(camera.render(self))
+      view_seconds.append(time.perf_counter() - start)
+    pixels = sum(camera.hsize * camera.vsize for camera in cameras)
+    return canvases, RenderStats(prepare_seconds, view_seconds, pixels)
 
   def intersect(self, ray):
+    if self.use_bvh:
+      self.prepare()
+      shapes = self.bvh.shapes
+      for i in self.bvh.candidates(ray):
+        ray.intersect(shapes[i])
+      return ray.intersections
+    # the slab test against each shape's world box is much cheaper than the
+    # ray transform in Shape.intersect, so run it first
+    origin = (ray.origin.x, ray.origin.y, ray.origin.z)
+    inverse = inverse_direction(ray.direction)
+    rejections = 0
     for shape in self.shapes:
-      ray.intersect(shape)
+      if shape.world_bounds.intersects(origin, inverse):
+        ray.intersect(shape)
+      else:
+        rejections += 1
+    self.box_tests += len(self.shapes)
+    self.box_rejections += rejections
     return ray.intersections
 
+  def closest_hits(self, origins, directions):
+    # the hit of each of N rays at once, given as PointArray/VectorArray or
+    # (N,3) arrays: an array of t (inf on a miss) and a list of the shapes
+    # hit (None on a miss), the same hits color_at would find
+    if isinstance(origins, TupleArray):
+      origins = origins.data
+    if isinstance(directions, TupleArray):
+      directions = directions.data
+    origins = np.asarray(origins, dtype=float)
+    directions = np.asarray(directions, dtype=float)
+    if self.use_bvh:
+      self.prepare()
+      best_t, best_index = self.bvh.intersect_packet(origins, directions)
+      shapes = self.bvh.shapes
+    else:
+      best_t = np.full(len(origins), math.inf)
+      best_index = np.full(len(origins), -1, dtype=np.int64)
+      with np.errstate(divide='ignore'):
+        inverse = 1.0 / directions
+      # the same world box test as intersect, run for blocks of shapes
+      # against the whole packet at once; a shape only gets the rays that
+      # enter its box before their best hit so far
+      count = len(self.shapes)
+      block = max(1, CULL_BLOCK_PAIRS // max(1, len(origins)))
+      tested = 0
+      for start in range(0, count, block):
+        boxes = [shape.world_bounds for shape in self.shapes[start:start + block]]
+        minimum = np.array([(b.minimum.x, b.minimum.y, b.minimum.z) for b in boxes], dtype=float)
+        maximum = np.array([(b.maximum.x, b.maximum.y, b.maximum.z) for b in boxes], dtype=float)
+        entry, crossing = slab_entry(minimum[:, None], maximum[:, None], origins, inverse)
+        for j, i in enumerate(range(start, start + len(boxes))):
+          rays = np.flatnonzero(crossing[j] & (entry[j] <= best_t))
+          tested += len(rays)
+          if len(rays):
+            merge_hits(self.shapes[i].intersect_packet(origins[rays], directions[rays]), i, rays,
+                       best_t, best_index)
+      self.box_tests += len(origins) * count
+      self.box_rejections += len(origins) * count - tested
+      shapes = self.shapes
+    return best_t, [shapes[i] if i >= 0 else None for i in best_index.tolist()]
+
+  def culling_stats(self):
+    # (box tests, rejections) since the last reset
+    return self.box_tests, self.box_rejections
+
+  def reset_culling_stats(self):
+    self.box_tests = 0
+    self.box_rejections = 0
+
   def is_shadowed(self, point):
     v = self.light.position.subtract(point)
     distance = v.magnitude()
     direction = v.normalize()
+    return self.is_occluded(point, direction, distance)
+
+  def is_occluded(self, point, direction, distance):
+    # whether anything lies on the ray from point along direction in
+    # [0, distance); returns at the first such shape instead of collecting
+    # and sorting every intersection like intersect
     ray = Ray(point, direction)
-    self.intersect(ray)
-    hit = ray.hit()
-    if hit and hit.t < distance:
-      return True
-    else:
-      return False
+    if self.use_bvh:
+      self.prepare()
+      return self.bvh.any_hit(ray, distance)
+    origin = (point.x, point.y, point.z)
+    inverse = inverse_direction(direction)
+    for shape in self.shapes:
+      if shape.world_bounds.intersects(origin, inverse) and shape.occludes(ray, distance):
+        return True
+    return False
 
   def shade_hit(self, comps, remaining=DEFAULT_REMAINING):
     shadowed = self.is_shadowed(comps.over_point)
@@ -174,12 +367,37 @@ class World:
     material = comps.shape.material
     if material.reflective > 0.0 and material.transparency > 0.0:
       reflectance = comps.schlick()
-      shade = surface.add(reflected.scalar_multiply(reflectance)).add(refracted.scalar_multiply(1.0 - reflectance))
+      weights = (1.0, reflectance, 1.0 - reflectance)
     else:
-      shade = surface.add(reflected).add(refracted)
-    return shade
+      weights = (1.0, 1.0, 1.0)
+    return Color.weighted_sum((surface, reflected, refracted), weights, out=surface)
 
   def color_at(self, ray, remaining=DEFAULT_REMAINING):
+    if self.use_bvh:
+      self.prepare()
+      closest = self.bvh.closest_hit(ray)
+      if closest is None:
+        return Color(0.0, 0.0, 0.0)
+      return self.color_at_hit(ray, closest[0], self.bvh.shapes[closest[1]], remaining)
+    self.intersect(ray)
+    hit = ray.hit()
+    if hit:
+      comps = hit.prepare_computations(ray)
+      return self.shade_hit(comps, remaining)
+    else:
+      return Color(0.0, 0.0, 0.0)
+
+  def color_at_hit(self, ray, t, shape, remaining=DEFAULT_REMAINING):
+    # color_at for a ray whose hit is already known, e.g. from closest_hits
+    if shape is None:
+      return Color(0.0, 0.0, 0.0)
+    # refraction needs every intersection along the ray to find n1 and n2;
+    # anything else only needs the hit
+    if shape.material.transparency == 0:
+      hit = Intersection(t, shape)
+      ray.intersections = [hit]
+      return self.shade_hit(hit.prepare_computations(ray), remaining)
+    ray.intersections = []
     self.intersect(ray)
     hit = ray.hit()
     if hit:
@@ -218,7 +436,7 @@ class World:
       return Color(0, 0, 0)
 
     cos_t = math.sqrt(1.0 - sin2_t)
-    direction = comps.normalv.scalar_multiply(n_ratio * cos_i - cos_t).subtract(comps.eyev.scalar_multiply(n_ratio))
+    direction = comps.normalv.scalar_multiply(n_ratio * cos_i - cos_t).add_scaled(comps.eyev, -n_ratio)
     refract_ray = Ray(comps.under_point, direction)
     color = self.color_at(refract_ray, remaining - 1)
     return color.scalar_multiply(comps.shape.material.transparency)
@@ -245,7 +463,6 @@ class Camera:
     self.hsize = hsize
     self.vsize = vsize
     self.field_of_view = field_of_view
-    self.transform = Identity_Matrix(4)
     # calculate half_height, half_width, and pixel size
     half_view = math.tan(self.field_of_view / 2.0)
     aspect = self.hsize / self.vsize
@@ -256,23 +473,68 @@ class Camera:
       self.half_width = half_view * aspect
       self.half_height = half_view
     self.pixel_size = (self.half_width * 2.0) / self.hsize
+    self.transform = Identity_Matrix(4)
+
+  @property
+  def transform(self):
+    return self._transform
+
+  @transform.setter
+  def transform(self, transform):
+    # every primary ray starts at the same origin, so invert once up front
+    self._transform = transform
+    self.inverse_transform = transform.inverse()
+    self.origin = self.inverse_transform * Point(0, 0, 0)
 
   def ray_for_pixel(self, px, py):
     xoffset = (px + 0.5) * self.pixel_size
     yoffset = (py + 0.5) * self.pixel_size
     worldx = self.half_width - xoffset
     worldy = self.half_height - yoffset
-    inv_transform = self.transform.inverse()
-    pixel = inv_transform * Point(worldx, worldy, -1.0)
-    origin = inv_transform * Point(0, 0, 0)
-    direction = pixel.subtract(origin).normalize()
-    return Ray(origin, direction)
+    pixel = self.inverse_transform * Point(worldx, worldy, -1.0)
+    direction = pixel.subtract(self.origin).normalize()
+    return Ray(self.origin, direction)
+
+  def rays_for_region(self, x0, y0, x1, y1):
+    # primary rays for pixels x0 <= x < x1, y0 <= y < y1 in row-major order,
+    # computed with the same operations as ray_for_pixel
+    xs = np.arange(x0, x1)
+    ys = np.arange(y0, y1)
+    worldx = self.half_width - (xs + 0.5) * self.pixel_size
+    worldy = self.half_height - (ys + 0.5) * self.pixel_size
+    pixels = np.empty((len(xs) * len(ys), 3))
+    pixels[:, 0] = np.tile(worldx, len(ys))
+    pixels[:, 1] = np.repeat(worldy, len(xs))
+    pixels[:, 2] = -1.0
+    self.inverse_transform.transform_points(pixels, out=pixels)
+    origins = PointArray(np.tile([self.origin.x, self.origin.y, self.origin.z], (len(pixels), 1)))
+    directions = PointArray(pixels).subtract(origins).normalize()
+    return origins, directions
 
   def render(self, world):
     image = Canvas(self.hsize, self.vsize)
-    for y in range(self.vsize):
-      for x in range(self.hsize):
-        ray = self.ray_for_pixel(x, y)
-        color = world.color_at(ray)
-        image.write_pixel(x, y, color)
+    for y, row in self.render_rows(world):
+      image.write_row(y, row)
     return image
+
+  def render_rows(self, world):
+    # yield (y, ColorArray) for each finished row from top to bottom; the
+    # primary hits come from World.closest_hits a block of rows at a time
+    world.prepare()
+    rows = max(1, PACKET_RAYS // self.hsize)
+    for y0 in range(0, self.vsize, rows):
+      y1 = min(y0 + rows, self.vsize)
+      origins, directions = self.rays_for_region(0, y0, self.hsize, y1)
+      ts, shapes = world.closest_hits(origins, directions)
+      for y in range(y0, y1):
+        row = slice((y - y0) * self.hsize, (y - y0 + 1) * self.hsize)
+        colors = [world.color_at_hit(Ray(self.origin, direction), t, shape)
+                  for direction, t, shape in zip(directions[row].to_tuples(), ts[row].tolist(), shapes[row])]
+        yield y, ColorArray.from_tuples(colors)
+
+  def render_to_file(self, world, path, **options):
+    # stream rows straight into a PPM or PNG file (chosen by extension)
+    # without building a Canvas; options go to the writer, e.g. binary=True
+    with image_writer(path, self.hsize, self.vsize, **options) as writer:
+      for y, row in self.render_rows(world):
+        writer.write_rows(row)
@@ -1,4 +1,7 @@
 import math
+import numpy as np
+import os
+import tempfile
 import unittest
 
 from canvas import Color
@@ -268,6 +271,22 @@ class RayTracerTestCase(unittest.TestCase):
     self.assertTrue(r.origin.equals(Point(0, 2, -5)))
     self.assertTrue(r.direction.equals(Vector(math.sqrt(2.0)/2.0, 0, -math.sqrt(2.0)/2.0)))
 
+  def test_camera_rays_for_region(self):
+    c = Camera(21, 11, math.pi / 2.0)
+    c.transform = Rotation_Matrix(Rotation_Axis.Y, 45) * Translation_Matrix(0, -2, 5)
+    origins, directions = c.rays_for_region(3, 2, 9, 6)
+    self.assertEqual(len(directions), 24)
+    i = 0
+    for y in range(2, 6):
+      for x in range(3, 9):
+        r = c.ray_for_pixel(x, y)
+        self.assertEqual(origins.data[i].tolist(), [r.origin.x, r.origin.y, r.origin.z])
+        self.assertEqual(directions.data[i].tolist(), [r.direction.x, r.direction.y, r.direction.z])
+        i += 1
+    # the cached inverse follows a new transform
+    c.transform = Translation_Matrix(0, 0, 5)
+    self.assertTrue(c.ray_for_pixel(10, 5).origin.equals(Point(0, 0, -5)))
+
   def test_camera_render(self):
     w = World.default_world()
     c = Camera(11, 11, math.pi / 2.0)
@@ -278,6 +297,87 @@ class RayTracerTestCase(unittest.TestCase):
     image = c.render(w)
     self.assertTrue(image.pixel_at(5, 5).equals(Color(0.38066, 0.47583, 0.2855)))
 
+  def test_camera_render_to_file(self):
+    w = World.default_world()
+    c = Camera(11, 7, math.pi / 2.0)
+    c.transform = w.view_transform(Point(0, 0, -5), Point(0, 0, 0), Vector(0, 1, 0))
+    rows = list(c.render_rows(w))
+    self.assertEqual([y for y, row in rows], list(range(7)))
+    self.assertEqual(len(rows[0][1]), 11)
+    # a flat sphere whose channels sit on rounding boundaries, where a
+    # float64 row and the Canvas's float32 copy of it quantize differently
+    s = Sphere()
+    s.material.color = Color(0.5 / 255, 1.5 / 255, 2.5 / 255)
+    s.material.ambient = 1.0
+    s.material.diffuse = 0.0
+    s.material.specular = 0.0
+    flat = World()
+    flat.light = w.light
+    flat.add_shape(s)
+    with tempfile.TemporaryDirectory() as tmp:
+      for world in (w, flat):
+        image = c.render(world)
+        for name, options in (("canvas.ppm", {}), ("canvas.ppm", {'binary': True}), ("canvas.png", {})):
+          path = os.path.join(tmp, name)
+          c.render_to_file(world, path, **options)
+          with open(path, 'rb') as f:
+            streamed = f.read()
+          if name.endswith(".png"):
+            image.to_png(path)
+          else:
+            image.to_ppm(path, **options)
+          with open(path, 'rb') as f:
+            self.assertEqual(streamed, f.read())
+      self.assertEqual(image.pixels[3, 5].tolist(), np.float32([0.5 / 255, 1.5 / 255, 2.5 / 255]).tolist())
+
+  def test_world_render_views(self):
+    w = World.default_world()
+    cameras = []
+    for angle in (0.0, math.pi / 2.0, math.pi):
+      c = Camera(9, 5, math.pi / 2.0)
+      c.transform = w.view_transform(Point(5 * math.sin(angle), 0, -5 * math.cos(angle)), Point(0, 0, 0), Vector(0, 1, 0))
+      cameras.append(c)
+    canvases, stats = w.render_views(cameras)
+    self.assertTrue(w.prepared)
+    self.assertEqual(len(canvases), 3)
+    self.assertEqual(len(stats.view_seconds), 3)
+    self.assertEqual(stats.pixels, 3 * 9 * 5)
+    self.assertAlmostEqual(stats.per_view_seconds() * 3, stats.total_seconds())
+    for camera, canvas in zip(cameras, canvases):
+      self.assertTrue((canvas.pixels == camera.render(w).pixels).all())
+    w.add_shape(Sphere())
+    self.assertFalse(w.prepared)
+
+  def test_world_intersect_culling(self):
+    w = World.default_world()
+    s = Sphere()
+    s.transform = Translation_Matrix(10, 0, 0)
+    w.add_shape(s)
+    r = Ray(Point(0, 0, -5), Vector(0, 0, 1))
+    xs = w.intersect(r)
+    self.assertEqual([i.t for i in xs], [4, 4.5, 5.5, 6])
+    self.assertEqual(w.culling_stats(), (3, 1))
+    # the whole line is tested, so hits behind the origin are still found
+    r = Ray(Point(10, 0, 5), Vector(0, 0, 1))
+    self.assertEqual([i.t for i in w.intersect(r)], [-6, -4])
+    self.assertEqual(w.culling_stats(), (6, 3))
+    w.reset_culling_stats()
+    self.assertEqual(w.culling_stats(), (0, 0))
+
+  def test_world_closest_hits_culling(self):
+    w = World.default_world()
+    s = Sphere()
+    s.transform = Translation_Matrix(10, 0, 0)
+    w.add_shape(s)
+    origins = np.array([(0, 0, -5), (10, 0, -5), (0, 5, -5)], dtype=float)
+    directions = np.array([(0, 0, 1)] * 3, dtype=float)
+    t, shapes = w.closest_hits(origins, directions)
+    self.assertEqual(t.tolist(), [4, 4, math.inf])
+    self.assertEqual(shapes, [w.shapes[0], s, None])
+    # each ray only reaches the shape it hits; the inner sphere's box is
+    # behind the first ray's hit on the outer one
+    self.assertEqual(w.culling_stats(), (9, 7))
+
   def test_world_is_shadowed(self):
     w = World.default_world()
     p = Point(0, 10, 0)
@@ -289,6 +389,23 @@ class RayTracerTestCase(unittest.TestCase):
     p = Point(-2, 2, -2)
     self.assertEqual(w.is_shadowed(p), False)
 
+  def test_world_is_occluded(self):
+    w = World.default_world()
+    p = Point(0, 0, -5)
+    v = Vector(0, 0, 1)
+    # the outer sphere is hit at t = 4 and t = 6
+    self.assertTrue(w.is_occluded(p, v, 10))
+    self.assertTrue(w.is_occluded(p, v, 4.5))
+    self.assertFalse(w.is_occluded(p, v, 4))
+    self.assertFalse(w.is_occluded(p, Vector(0, 0, -1), 10))
+    # hits behind the origin don't count
+    self.assertFalse(w.is_occluded(Point(0, 0, 7), v, 10))
+    w.build_bvh()
+    self.assertTrue(w.is_occluded(p, v, 4.5))
+    self.assertFalse(w.is_occluded(p, v, 4))
+    self.assertEqual(w.is_shadowed(Point(10, -10, 10)), True)
+    self.assertEqual(w.is_shadowed(Point(-2, 2, -2)), False)
+
   def test_reflection_vector(self):
     shape = Plane()
     r = Ray(Point(0, 1, -1), Vector(0, -math.sqrt(2.0)/2.0, math.sqrt(2.0)/2.0))
@@ -1,7 +1,9 @@
 import math
+import numpy as np
 import uuid
 
 from abc import ABC, abstractmethod
+from bounds import BoundingBox
 from canvas import Color
 from matrix import Identity_Matrix
 from tuple import Point, Vector
@@ -39,30 +41,92 @@ class Shape(ABC):
   def __init__(self):
     self.uid = str(uuid.uuid4())
     self.origin = Point(0, 0, 0)
+    # the Worlds this shape belongs to, told whenever the shape moves
+    self.worlds = set()
     self.transform = Identity_Matrix(4)
     self.material = Material()
     self.local_ray = None
     super().__init__()
 
+  @property
+  def transform(self):
+    return self._transform
+
+  @transform.setter
+  def transform(self, transform):
+    # precompute the matrices every intersect/normal call needs; assign a new
+    # matrix (rather than writing into this one) to move the shape
+    self._transform = transform
+    self.world_to_object = transform.inverse()
+    self.normal_matrix = transform.inverse_transpose()
+    self._world_bounds = None
+    self.transform_changed()
+    for world in self.worlds:
+      world.shape_changed(self)
+
   def set_transform(self, transform):
     self.transform = transform
 
+  def transform_changed(self):
+    # hook for subclasses caching anything else derived from the transform
+    pass
+
+  def bounds(self):
+    # object-space bounding box; unbounded unless a subclass knows better
+    return BoundingBox.infinite()
+
+  @property
+  def world_bounds(self):
+    # world-space box around bounds(), padded by EPSILON so surface points
+    # that round slightly outside still fall inside
+    if self._world_bounds is None:
+      self._world_bounds = self.bounds().transform(self._transform).padded(EPSILON)
+    return self._world_bounds
+
   def normal_at(self, world_point):
-    inv_transform = self.transform.inverse()
-    object_point = inv_transform * world_point
+    object_point = self.world_to_object * world_point
     object_normal = object_point.subtract(self.origin)
-    world_normal = inv_transform.transpose() * object_normal
+    world_normal = self.normal_matrix * object_normal
     world_normal.w = 0
     return world_normal.normalize()
 
   def intersect(self, ray):
-    self.local_ray = ray.transform(self.transform.inverse())
+    self.local_ray = ray.transform(self.world_to_object)
     return self.local_intersect(self.local_ray)
 
   @abstractmethod
   def local_intersect(self, ray):
     pass
 
+  def occludes(self, ray, distance):
+    # whether ray hits this shape anywhere in [0, distance), without
+    # keeping the local ray or collecting the intersections
+    return self.local_occludes(ray.transform(self.world_to_object), distance)
+
+  def local_occludes(self, ray, distance):
+    for t in self.local_intersect(ray):
+      if 0 <= t < distance:
+        return True
+    return False
+
+  def intersect_packet(self, origins, directions):
+    # intersect N rays at once, given as (N,3) world-space origin and
+    # direction arrays; returns an (N,k) array of t values, NaN where a ray
+    # has fewer than k intersections
+    return self.local_intersect_packet(self.world_to_object.transform_points(origins),
+                                       self.world_to_object.transform_vectors(directions))
+
+  def local_intersect_packet(self, origins, directions):
+    # one ray at a time unless a subclass vectorizes it; imported here since
+    # ray_tracer imports this module
+    from ray_tracer import Ray
+    hits = [self.local_intersect(Ray(Point(*o), Vector(*d)))
+            for o, d in zip(origins.tolist(), directions.tolist())]
+    ts = np.full((len(hits), max([len(xs) for xs in hits], default=0)), np.nan)
+    for row, xs in zip(ts, hits):
+      row[:len(xs)] = xs
+    return ts
+
 class TestShape(Shape):
 
   def local_intersect(self, ray):
@@ -84,6 +148,25 @@ class Sphere(Shape):
       t2 = (-1.0 * b + math.sqrt(discrim)) / (2 * a)
       return [t1, t2]
 
+  def local_intersect_packet(self, origins, directions):
+    # local_intersect for every ray at once, with the same arithmetic
+    sx = origins[:, 0] - self.origin.x
+    sy = origins[:, 1] - self.origin.y
+    sz = origins[:, 2] - self.origin.z
+    dx, dy, dz = directions[:, 0], directions[:, 1], directions[:, 2]
+    a = (dx * dx) + (dy * dy) + (dz * dz)
+    b = 2.0 * ((dx * sx) + (dy * sy) + (dz * sz))
+    c = ((sx * sx) + (sy * sy) + (sz * sz)) - 1.0
+    discrim = (b * b) - (4 * a * c)
+    root = np.sqrt(np.where(discrim < 0, np.nan, discrim))
+    ts = np.empty((len(origins), 2))
+    ts[:, 0] = (-1.0 * b - root) / (2 * a)
+    ts[:, 1] = (-1.0 * b + root) / (2 * a)
+    return ts
+
+  def bounds(self):
+    return BoundingBox(Point(-1, -1, -1), Point(1, 1, 1))
+
   @staticmethod
   def glass_sphere():
     s = Sphere()
@@ -95,15 +178,25 @@ class Sphere(Shape):
 class Plane(Shape):
 
   def __init__(self):
-    super().__init__()
     # all points on the plane have the same object normal
     self.object_normal = Vector(0, 1, 0)
+    super().__init__()
+
+  def transform_changed(self):
+    # ...and therefore the same world normal
+    self.world_normal = (self.normal_matrix * self.object_normal).normalize()
 
   def normal_at(self, world_point):
-    inv_transform = self.transform.inverse()
-    world_normal = inv_transform.transpose() * self.object_normal
-    world_normal.w = 0
-    return world_normal.normalize()
+    return Vector(self.world_normal.x, self.world_normal.y, self.world_normal.z)
+
+  def local_intersect_packet(self, origins, directions):
+    dy = directions[:, 1]
+    parallel = np.abs(dy) < EPSILON
+    ts = (-1.0 * origins[:, 1]) / np.where(parallel, 1.0, dy)
+    return np.where(parallel, np.nan, ts)[:, np.newaxis]
+
+  def bounds(self):
+    return BoundingBox(Point(-math.inf, 0, -math.inf), Point(math.inf, 0, math.inf))
 
   def local_intersect(self, ray):
     if abs(ray.direction.y) < EPSILON:
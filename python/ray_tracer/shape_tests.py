@@ -1,4 +1,5 @@
 import math
+import numpy as np
 import unittest
 
 from canvas import Color
@@ -6,6 +7,7 @@ from matrix import Identity_Matrix, Rotation_Axis, Rotation_Matrix, Scaling_Matr
 from ray_tracer import Ray
 from shape import Material, Plane, Sphere, TestShape
 from tuple import Point, Vector
+from utils import EPSILON
 
 class ShapeTestCase(unittest.TestCase):
 
@@ -127,6 +129,39 @@ class ShapeTestCase(unittest.TestCase):
     plane = Plane()
     n1 = plane.normal_at(Point(0, 0, 0))
     self.assertTrue(n1.equals(Vector(0, 1, 0)))
+    # assigning the transform directly refreshes the cached world normal
+    plane.transform = Rotation_Matrix(Rotation_Axis.Z, 90)
+    n2 = plane.normal_at(Point(0, 0, 0))
+    self.assertTrue(n2.equals(Vector(-1, 0, 0)))
+    self.assertIsNot(n2, plane.normal_at(Point(0, 0, 0)))
+
+  def test_shape_transform_matrices(self):
+    s = Sphere()
+    self.assertEqual(s.world_to_object, Identity_Matrix(4))
+    s.transform = Translation_Matrix(2, 3, 4) * Scaling_Matrix(2, 2, 2)
+    self.assertEqual(s.world_to_object, s.transform.inverse())
+    self.assertEqual(s.normal_matrix, s.transform.inverse().transpose())
+    s.set_transform(Translation_Matrix(1, 0, 0))
+    self.assertEqual(s.world_to_object, Translation_Matrix(-1, 0, 0))
+
+  def test_shape_bounds(self):
+    self.assertTrue(TestShape().bounds().is_infinite())
+    s = Sphere()
+    self.assertTrue(s.bounds().maximum.equals(Point(1, 1, 1)))
+    s.transform = Translation_Matrix(2, 3, 4) * Scaling_Matrix(2, 1, 1)
+    box = s.world_bounds
+    self.assertIs(s.world_bounds, box)
+    # padded by EPSILON on every side
+    self.assertTrue(box.minimum.equals(Point(-EPSILON, 2 - EPSILON, 3 - EPSILON)))
+    self.assertTrue(box.maximum.equals(Point(4 + EPSILON, 4 + EPSILON, 5 + EPSILON)))
+    # moving the shape refreshes its world box
+    s.transform = Translation_Matrix(-2, 0, 0)
+    self.assertTrue(s.world_bounds.maximum.equals(Point(-1 + EPSILON, 1 + EPSILON, 1 + EPSILON)))
+    plane = Plane()
+    self.assertEqual(plane.world_bounds.maximum.x, math.inf)
+    self.assertTrue(plane.world_bounds.maximum.y > 0)
+    plane.transform = Translation_Matrix(0, -1, 0)
+    self.assertTrue(plane.world_bounds.maximum.y < 0)
 
   def test_plane_intersect(self):
     plane = Plane()
@@ -145,6 +180,39 @@ class ShapeTestCase(unittest.TestCase):
     self.assertEqual(len(xs), 1)
     self.assertEqual(xs[0], 1)
 
+  def test_shape_occludes(self):
+    s = Sphere()
+    s.transform = Scaling_Matrix(2, 2, 2)
+    r = Ray(Point(0, 0, -5), Vector(0, 0, 1))
+    self.assertTrue(s.occludes(r, 3.5))
+    self.assertFalse(s.occludes(r, 3))
+    self.assertFalse(s.occludes(Ray(Point(0, 0, 5), Vector(0, 0, 1)), 10))
+    # from inside only the far intersection counts
+    self.assertTrue(s.occludes(Ray(Point(0, 0, 0), Vector(0, 0, 1)), 2.5))
+    self.assertFalse(s.occludes(Ray(Point(0, 0, 0), Vector(0, 0, 1)), 2))
+    p = Plane()
+    self.assertTrue(p.occludes(Ray(Point(0, 1, 0), Vector(0, -1, 0)), 1.5))
+    self.assertFalse(p.occludes(Ray(Point(0, 1, 0), Vector(0, -1, 0)), 1))
+    self.assertFalse(p.occludes(Ray(Point(0, 1, 0), Vector(0, 0, 1)), 10))
+
+  def test_intersect_packet(self):
+    sphere = Sphere()
+    sphere.transform = Translation_Matrix(1, 0, 0) * Scaling_Matrix(2, 0.5, 1)
+    plane = Plane()
+    plane.transform = Rotation_Matrix(Rotation_Axis.X, 0.3)
+    rays = [(Point(0, 0, -5), Vector(0, 0, 1)), (Point(1, 0.4, -5), Vector(0.1, 0, 1)),
+            (Point(0, 2, -5), Vector(0, 0, 1)), (Point(0, 1, 0), Vector(0, -1, 0)),
+            (Point(3, 0, 0), Vector(-1, 0, 0))]
+    origins = np.array([(o.x, o.y, o.z) for o, d in rays])
+    directions = np.array([(d.x, d.y, d.z) for o, d in rays])
+    for shape in (sphere, plane):
+      ts = shape.intersect_packet(origins, directions)
+      for (origin, direction), row in zip(rays, ts.tolist()):
+        xs = shape.intersect(Ray(origin, direction))
+        self.assertEqual([t for t in row if not math.isnan(t)], xs)
+    # shapes without a vectorized local_intersect go one ray at a time
+    self.assertEqual(TestShape().intersect_packet(origins, directions).shape, (5, 0))
+
   def test_glass_sphere(self):
     s = Sphere.glass_sphere()
     self.assertEqual(s.material.transparency, 1.0)
@@ -1,7 +1,6 @@
 
 import math
 
-from abc import ABC, abstractmethod
 from utils import float_equal
 
 
@@ -13,14 +12,25 @@ class InvalidOperationError(TupleException):
   pass
 
 
-class Tuple(ABC):
+# tuples are allocated in huge numbers while rendering, so they use
+# __slots__ rather than a per-instance __dict__, and skip ABC so that
+# isinstance checks on them stay cheap
+class Tuple:
+  __slots__ = ('x', 'y', 'z', 'w')
+
+  def __init_subclass__(cls, **kwargs):
+    # the w-type rules live in each subclass's add and subtract
+    super().__init_subclass__(**kwargs)
+    for name in ('add', 'subtract'):
+      if not callable(getattr(cls, name, None)):
+        raise TypeError("{0} must define {1}".format(cls.__name__, name))
+
   def __init__(self, x, y, z, w):
     self.x = x
     self.y = y
     self.z = z
     self.w = w
-    super().__init__()
-    
+
   def equals(self, tup):
     if float_equal(self.x, tup.x) and float_equal(self.y, tup.y) \
     and float_equal(self.z, tup.z) and float_equal(self.w, tup.w):
@@ -34,18 +44,43 @@ class Tuple(ABC):
   def is_vector(self):
     return self.w == 0.0
 
-  @abstractmethod
-  def add(self, tup):
-    pass
-
-  @abstractmethod
-  def subtract(self, tup):
-    pass
+  def add_scaled(self, vec, scalar, out=None):
+    # fused self + vec * scalar, optionally written into an existing tuple
+    if vec.is_point():
+      raise InvalidOperationError("Can't add a scaled Point")
+    x = self.x + vec.x * scalar
+    y = self.y + vec.y * scalar
+    z = self.z + vec.z * scalar
+    if out is None:
+      return type(self)(x, y, z)
+    out.x = x
+    out.y = y
+    out.z = z
+    return out
+
+  def lerp(self, tup, fraction, out=None):
+    # fused self + (tup - self) * fraction between two points or two vectors
+    if tup.w != self.w:
+      raise InvalidOperationError("Can't interpolate between a Point and a Vector")
+    x = self.x + (tup.x - self.x) * fraction
+    y = self.y + (tup.y - self.y) * fraction
+    z = self.z + (tup.z - self.z) * fraction
+    if out is None:
+      return type(self)(x, y, z)
+    out.x = x
+    out.y = y
+    out.z = z
+    return out
 
 
 class Point(Tuple):
+  __slots__ = ()
+
   def __init__(self, x, y, z):
-    super().__init__(x, y, z, 1.0)
+    self.x = x
+    self.y = y
+    self.z = z
+    self.w = 1.0
     
   def add(self, tup):
     if tup.is_point():
@@ -61,8 +96,13 @@ class Point(Tuple):
 
 
 class Vector(Tuple):
+  __slots__ = ()
+
   def __init__(self, x, y, z):
-    super().__init__(x, y, z, 0.0)
+    self.x = x
+    self.y = y
+    self.z = z
+    self.w = 0.0
     
   def add(self, tup):
     if tup.is_point():
@@ -83,16 +123,20 @@ class Vector(Tuple):
     return Vector(self.x / scalar, self.y / scalar, self.z / scalar)
 
   def negate(self):
-    return self.scalar_multiply(-1.0)
+    return Vector(-self.x, -self.y, -self.z)
 
   def magnitude(self):
-    return math.sqrt(self.x**2 + self.y**2 + self.z**2)
+    return math.sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
 
   def normalize(self):
-    if float_equal(self.magnitude(), 0.0):
+    return self.normalize_with_length()[0]
+
+  def normalize_with_length(self):
+    # returns the unit vector together with the original magnitude
+    magnitude = math.sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
+    if float_equal(magnitude, 0.0):
       raise InvalidOperationError("Can't normalize a Vector with zero magnitude")
-    else:
-      return self.scalar_divide(self.magnitude())
+    return Vector(self.x / magnitude, self.y / magnitude, self.z / magnitude), magnitude
 
   def dot(self, vec):
     return (self.x * vec.x) + (self.y * vec.y) + (self.z * vec.z)
@@ -103,5 +147,14 @@ class Vector(Tuple):
     z = (self.x * vec.y) - (self.y * vec.x)
     return Vector(x, y, z)
 
-  def reflect(self, normal):
-    return self.subtract(normal.scalar_multiply(2.0 * self.dot(normal)))
+  def reflect(self, normal, out=None):
+    scale = 2.0 * ((self.x * normal.x) + (self.y * normal.y) + (self.z * normal.z))
+    x = self.x - normal.x * scale
+    y = self.y - normal.y * scale
+    z = self.z - normal.z * scale
+    if out is None:
+      return Vector(x, y, z)
+    out.x = x
+    out.y = y
+    out.z = z
+    return out
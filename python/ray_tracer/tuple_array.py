@@ -0,0 +1,181 @@
+import numpy as np
+
+from tuple import InvalidOperationError, Point, Tuple, Vector
+from utils import EPSILON
+
+
+class TupleArray:
+  # structure-of-arrays counterpart of Tuple: an (N,3) float array with one
+  # lane per element. Operations accept other arrays, single elements
+  # (broadcast to every lane) or per-lane scalars as (N,) arrays, plus an
+  # optional boolean mask; lanes outside the mask keep their current value,
+  # or 0.0 for per-lane scalar results.
+  __slots__ = ('data',)
+
+  def __init__(self, data):
+    data = np.asarray(data, dtype=float)
+    if data.ndim != 2 or data.shape[1] != 3:
+      raise ValueError("Expected an (N,3) array")
+    self.data = data
+
+  @classmethod
+  def from_tuples(cls, elements):
+    return cls(np.array([cls._row(e) for e in elements], dtype=float).reshape(-1, 3))
+
+  @classmethod
+  def zeros(cls, n):
+    return cls(np.zeros((n, 3)))
+
+  @property
+  def x(self):
+    return self.data[:, 0]
+
+  @property
+  def y(self):
+    return self.data[:, 1]
+
+  @property
+  def z(self):
+    return self.data[:, 2]
+
+  def __len__(self):
+    return len(self.data)
+
+  def __getitem__(self, key):
+    if isinstance(key, (int, np.integer)):
+      return self._element(*self.data[key].tolist())
+    return type(self)(self.data[key])
+
+  def to_tuples(self):
+    return [self._element(*row) for row in self.data.tolist()]
+
+  def copy(self):
+    return type(self)(self.data.copy())
+
+  def equals(self, other):
+    return bool(np.all(np.abs(self.data - self._lanes(other, None)) < EPSILON))
+
+  def where(self, mask, other):
+    mask = np.asarray(mask, dtype=bool)
+    return type(self)(np.where(mask[:, np.newaxis], self.data, self._lanes(other, None)))
+
+  @staticmethod
+  def _row(element):
+    return (element.x, element.y, element.z)
+
+  def _lanes(self, operand, mask):
+    # select the lanes of an array operand; single elements and scalars broadcast
+    if isinstance(operand, TupleArray):
+      operand = operand.data
+    elif isinstance(operand, np.ndarray):
+      pass
+    elif isinstance(operand, (int, float, np.generic)):
+      return operand
+    else:
+      return np.array([self._row(operand)], dtype=float)
+    if mask is not None:
+      operand = operand[mask]
+    if operand.ndim == 1:
+      operand = operand[:, np.newaxis]
+    return operand
+
+  def _apply(self, fn, mask, *operands):
+    if mask is None:
+      return fn(self.data, *[self._lanes(o, None) for o in operands])
+    mask = np.asarray(mask, dtype=bool)
+    selected = fn(self.data[mask], *[self._lanes(o, mask) for o in operands])
+    if selected.ndim == 1:
+      result = np.zeros(len(self))
+    else:
+      result = self.data.copy()
+    result[mask] = selected
+    return result
+
+
+def _is_point(operand):
+  return isinstance(operand, PointArray) or (isinstance(operand, Tuple) and operand.is_point())
+
+
+def _dot(a, b):
+  return a[:, 0] * b[:, 0] + a[:, 1] * b[:, 1] + a[:, 2] * b[:, 2]
+
+
+def _magnitude(data):
+  return np.sqrt(_dot(data, data))
+
+
+def _normalize(data):
+  magnitude = _magnitude(data)
+  if np.any(np.abs(magnitude) < EPSILON):
+    raise InvalidOperationError("Can't normalize a Vector with zero magnitude")
+  return data / magnitude[:, np.newaxis]
+
+
+def _cross(a, b):
+  result = np.empty(np.broadcast_shapes(a.shape, b.shape))
+  result[:, 0] = a[:, 1] * b[:, 2] - a[:, 2] * b[:, 1]
+  result[:, 1] = a[:, 2] * b[:, 0] - a[:, 0] * b[:, 2]
+  result[:, 2] = a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]
+  return result
+
+
+def _reflect(data, normal):
+  return data - normal * (2.0 * _dot(data, normal))[:, np.newaxis]
+
+
+class PointArray(TupleArray):
+  __slots__ = ()
+  _element = Point
+
+  def add(self, tup, mask=None):
+    if _is_point(tup):
+      raise InvalidOperationError("Can't add a Point to another Point")
+    return PointArray(self._apply(np.add, mask, tup))
+
+  def subtract(self, tup, mask=None):
+    data = self._apply(np.subtract, mask, tup)
+    if _is_point(tup):
+      return VectorArray(data)
+    else:
+      return PointArray(data)
+
+
+class VectorArray(TupleArray):
+  __slots__ = ()
+  _element = Vector
+
+  def add(self, tup, mask=None):
+    data = self._apply(np.add, mask, tup)
+    if _is_point(tup):
+      return PointArray(data)
+    else:
+      return VectorArray(data)
+
+  def subtract(self, tup, mask=None):
+    if _is_point(tup):
+      raise InvalidOperationError("Can't subtract a Point from a Vector")
+    return VectorArray(self._apply(np.subtract, mask, tup))
+
+  def scalar_multiply(self, scalar, mask=None):
+    return VectorArray(self._apply(np.multiply, mask, scalar))
+
+  def scalar_divide(self, scalar, mask=None):
+    return VectorArray(self._apply(np.divide, mask, scalar))
+
+  def negate(self, mask=None):
+    return VectorArray(self._apply(np.negative, mask))
+
+  def magnitude(self, mask=None):
+    return self._apply(_magnitude, mask)
+
+  def normalize(self, mask=None):
+    return VectorArray(self._apply(_normalize, mask))
+
+  def dot(self, vec, mask=None):
+    return self._apply(_dot, mask, vec)
+
+  def cross(self, vec, mask=None):
+    return VectorArray(self._apply(_cross, mask, vec))
+
+  def reflect(self, normal, mask=None):
+    return VectorArray(self._apply(_reflect, mask, normal))
@@ -0,0 +1,83 @@
+import numpy as np
+import unittest
+
+from tuple import Point, Vector, InvalidOperationError
+from tuple_array import PointArray, VectorArray
+
+class TupleArrayTestCase(unittest.TestCase):
+
+  def setUp(self):
+    self.points = PointArray([[4.3, -4.2, 3.1], [3.0, -2.0, 5.0], [0.0, 0.0, 0.0]])
+    self.vectors = VectorArray([[4.3, -4.2, 3.1], [3.0, -2.0, 5.0], [0.0, 1.0, 0.0]])
+
+  def test_tuple_array_create(self):
+    self.assertEqual(len(self.points), 3)
+    p = self.points[1]
+    self.assertTrue(p.is_point())
+    self.assertTrue(p.equals(Point(3.0, -2.0, 5.0)))
+    v = self.vectors[2]
+    self.assertTrue(v.is_vector())
+    self.assertTrue(v.equals(Vector(0, 1, 0)))
+    self.assertTrue(np.array_equal(self.points.y, [-4.2, -2.0, 0.0]))
+    vectors = VectorArray.from_tuples([Vector(1, 2, 3), Vector(4, 5, 6)])
+    self.assertTrue(vectors.equals(VectorArray([[1, 2, 3], [4, 5, 6]])))
+    self.assertTrue(vectors.to_tuples()[1].equals(Vector(4, 5, 6)))
+    self.assertIsInstance(self.points[0:2], PointArray)
+    self.assertRaises(ValueError, VectorArray, np.zeros((2, 4)))
+
+  def test_tuple_array_add_subtract(self):
+    result = self.points.add(self.vectors)
+    self.assertIsInstance(result, PointArray)
+    self.assertTrue(result[0].equals(Point(8.6, -8.4, 6.2)))
+    result = self.vectors.add(self.points)
+    self.assertIsInstance(result, PointArray)
+    result = self.points.subtract(self.points)
+    self.assertIsInstance(result, VectorArray)
+    self.assertTrue(result.equals(VectorArray.zeros(3)))
+    # single tuples broadcast to every lane
+    result = self.points.subtract(Point(1, 1, 1))
+    self.assertIsInstance(result, VectorArray)
+    self.assertTrue(result[2].equals(Vector(-1, -1, -1)))
+    with self.assertRaises(InvalidOperationError):
+      self.points.add(self.points)
+    with self.assertRaises(InvalidOperationError):
+      self.vectors.subtract(Point(0, 0, 0))
+
+  def test_vector_array_operations(self):
+    vectors = self.vectors.to_tuples()
+    others = [Vector(1, 2, 3), Vector(-1, 0.5, 2), Vector(0, 0, 1)]
+    other_array = VectorArray.from_tuples(others)
+    dots = self.vectors.dot(other_array)
+    crosses = self.vectors.cross(other_array)
+    normals = self.vectors.normalize()
+    magnitudes = self.vectors.magnitude()
+    reflections = self.vectors.reflect(other_array.normalize())
+    for i in range(3):
+      self.assertEqual(dots[i], vectors[i].dot(others[i]))
+      self.assertTrue(crosses[i].equals(vectors[i].cross(others[i])))
+      self.assertTrue(normals[i].equals(vectors[i].normalize()))
+      self.assertEqual(magnitudes[i], vectors[i].magnitude())
+      self.assertTrue(reflections[i].equals(vectors[i].reflect(others[i].normalize())))
+    result = self.vectors.scalar_multiply(np.array([1.0, 2.0, 0.5]))
+    self.assertTrue(result[1].equals(Vector(6, -4, 10)))
+    result = self.vectors.scalar_divide(2.0).negate()
+    self.assertTrue(result[2].equals(Vector(0, -0.5, 0)))
+    with self.assertRaises(InvalidOperationError):
+      VectorArray.zeros(2).normalize()
+
+  def test_tuple_array_masks(self):
+    vectors = VectorArray([[3, 0, 0], [0, 0, 0], [0, 4, 0]])
+    mask = np.array([True, False, True])
+    # masked-out lanes keep their value and are never evaluated
+    result = vectors.normalize(mask)
+    self.assertTrue(result.equals(VectorArray([[1, 0, 0], [0, 0, 0], [0, 1, 0]])))
+    result = vectors.add(Vector(1, 1, 1), mask)
+    self.assertTrue(result.equals(VectorArray([[4, 1, 1], [0, 0, 0], [1, 5, 1]])))
+    result = vectors.magnitude(mask)
+    self.assertTrue(np.array_equal(result, [3.0, 0.0, 4.0]))
+    result = vectors.where(mask, Vector(9, 9, 9))
+    self.assertTrue(result.equals(VectorArray([[3, 0, 0], [9, 9, 9], [0, 4, 0]])))
+
+
+if __name__ == '__main__':
+    unittest.main()
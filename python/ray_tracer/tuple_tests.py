@@ -1,7 +1,7 @@
 import math
 import unittest
 
-from tuple import Point, Vector, InvalidOperationError
+from tuple import Point, Tuple, Vector, InvalidOperationError
 
 class TupleTestCase(unittest.TestCase):
 
@@ -31,7 +31,22 @@ class TupleTestCase(unittest.TestCase):
     self.assertTrue(self.pt_a.equals(Point(4.3, -4.2, 3.1)))
     self.assertTrue(self.vec_a.equals(Vector(4.3, -4.2, 3.1)))
     self.assertFalse(self.pt_a.equals(self.vec_a))
-    
+
+  def test_slots(self):
+    self.assertFalse(hasattr(self.pt_a, '__dict__'))
+    self.assertFalse(hasattr(self.vec_a, '__dict__'))
+    with self.assertRaises(AttributeError):
+      self.pt_a.v = 1.0
+    # coordinates stay writable
+    self.vec_a.w = 1.0
+    self.assertTrue(self.vec_a.is_point())
+    # subclasses have to define add and subtract
+    with self.assertRaises(TypeError):
+      class Partial(Tuple):
+        __slots__ = ()
+        def add(self, tup):
+          return self
+
   def test_add(self):
     # adding 2 vectors produces a vector
     add_vecs = self.vec_a.add(self.vec_b)
@@ -136,5 +151,47 @@ class TupleTestCase(unittest.TestCase):
     self.assertTrue(r.equals(Vector(1, 0, 0)))
 
 
+  def test_fused_operations(self):
+    p = Point(1, 2, 3)
+    v = Vector(0.5, -1, 2)
+    result = p.add_scaled(v, 2.0)
+    self.assertTrue(result.is_point())
+    self.assertTrue(result.equals(p.add(v.scalar_multiply(2.0))))
+    result = v.add_scaled(v, -1.0)
+    self.assertTrue(result.is_vector())
+    self.assertTrue(result.equals(Vector(0, 0, 0)))
+    # out= overwrites an existing tuple instead of allocating
+    out = Point(0, 0, 0)
+    self.assertIs(p.add_scaled(v, 0.5, out=out), out)
+    self.assertTrue(out.equals(Point(1.25, 1.5, 4)))
+    unit, length = Vector(0, 3, 4).normalize_with_length()
+    self.assertEqual(length, 5.0)
+    self.assertTrue(unit.equals(Vector(0, 0.6, 0.8)))
+    n = Vector(0, 1, 0)
+    out = Vector(1, -1, 0)
+    self.assertIs(out.reflect(n, out=out), out)
+    self.assertTrue(out.equals(Vector(1, 1, 0)))
+    self.assertTrue(v.negate().equals(v.scalar_multiply(-1.0)))
+    # the same w rules as add
+    self.assertRaises(InvalidOperationError, p.add_scaled, p, 2.0)
+    self.assertRaises(InvalidOperationError, v.add_scaled, p, 0.5)
+
+  def test_lerp(self):
+    a = Point(1, 2, 3)
+    b = Point(3, 0, 3)
+    result = a.lerp(b, 0.25)
+    self.assertTrue(result.is_point())
+    self.assertTrue(result.equals(Point(1.5, 1.5, 3)))
+    self.assertTrue(a.lerp(b, 0.0).equals(a))
+    self.assertTrue(a.lerp(b, 1.0).equals(b))
+    result = Vector(0, 0, 2).lerp(Vector(4, 0, 0), 0.5)
+    self.assertTrue(result.is_vector())
+    self.assertTrue(result.equals(Vector(2, 0, 1)))
+    out = Point(0, 0, 0)
+    self.assertIs(a.lerp(b, 0.5, out=out), out)
+    self.assertTrue(out.equals(Point(2, 1, 3)))
+    self.assertRaises(InvalidOperationError, a.lerp, Vector(1, 0, 0), 0.5)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,6 +1,9 @@
+import numpy as np
+import sys
 
 from canvas import Canvas, Color
 from tuple import Point, Vector
+from tuple_array import TupleArray
 
 class Projectile():
   def __init__(self, position, velocity):
@@ -11,32 +14,67 @@ class Environment():
   def __init__(self, gravity, wind):
     self.gravity = gravity
     self.wind = wind
-    
+
 def tick(env, proj):
   position = proj.position.add(proj.velocity)
   velocity = proj.velocity.add(env.gravity.add(env.wind))
   return Projectile(position, velocity)
 
+def simulate_trajectories(env, positions, velocities, max_steps=100000):
+  # step every projectile with the same arithmetic as tick until all of them
+  # have reached y <= 0. positions and velocities are PointArray/VectorArray
+  # or (N,3) arrays. Returns the (steps+1, N, 3) path, starting with the
+  # launch positions, and a (steps+1, N) mask of the positions each
+  # projectile actually reached
+  if isinstance(positions, TupleArray):
+    positions = positions.data
+  if isinstance(velocities, TupleArray):
+    velocities = velocities.data
+  position = np.array(positions, dtype=float)
+  velocity = np.array(velocities, dtype=float)
+  step = env.gravity.add(env.wind)
+  step = np.array([step.x, step.y, step.z])
+  path = [position.copy()]
+  reached = [np.ones(len(position), dtype=bool)]
+  flying = position[:, 1] > 0
+  while np.any(flying) and len(path) <= max_steps:
+    position[flying] += velocity[flying]
+    velocity[flying] += step
+    path.append(position.copy())
+    reached.append(flying.copy())
+    flying &= position[:, 1] > 0
+  return np.stack(path), np.stack(reached)
+
+def rasterize(canvas, path, reached, color):
+  # plot every reached position with y pointing up; returns how many pixels
+  # landed on the canvas
+  xs = np.rint(path[..., 0][reached]).astype(int)
+  ys = canvas.height - np.rint(path[..., 1][reached]).astype(int)
+  return int(np.count_nonzero(canvas.write_pixels(xs, ys, color)))
+
 if __name__ == '__main__':
 
+  # python virtual_cannon.py [count] fires count projectiles with launch
+  # speeds spread up to the original 11.25
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+
   start = Point(0, 1, 0)
-  velocity = Vector(1, 1.8, 0).normalize().scalar_multiply(11.25)
-  p = Projectile(start, velocity)
+  direction = Vector(1, 1.8, 0).normalize()
+  speeds = np.linspace(11.25, 11.25 / 4.0, count)
+  positions = np.tile([start.x, start.y, start.z], (count, 1))
+  velocities = np.outer(speeds, [direction.x, direction.y, direction.z])
 
   gravity = Vector(0, -0.1, 0)
   wind = Vector(-0.01, 0, 0)
   e = Environment(gravity, wind)
-  
+
   canvas = Canvas(900, 550)
   red = Color(1, 0, 0)
-  canvas.write_pixel(start.x, canvas.height - start.y, red)
-
-  while p.position.y > 0:
-    p = tick(e, p)
-    x = round(p.position.x)
-    y = canvas.height - round(p.position.y)
-    canvas.write_pixel(x, y, red)
-    print("x=" + str(x) + ", y=" + str(y))
+
+  path, reached = simulate_trajectories(e, positions, velocities)
+  plotted = rasterize(canvas, path, reached, red)
+  print("Plotted " + str(plotted) + " of " + str(int(reached.sum())) + " positions in " +
+        str(len(path) - 1) + " steps")
 
   print("Writing canvas to PPM file...")
   canvas.to_ppm("canvas.ppm")
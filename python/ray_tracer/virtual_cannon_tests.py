@@ -0,0 +1,53 @@
+import numpy as np
+import unittest
+
+from canvas import Canvas, Color
+from tuple import Point, Vector
+from virtual_cannon import Environment, Projectile, rasterize, simulate_trajectories, tick
+
+class VirtualCannonTestCase(unittest.TestCase):
+
+  def test_simulate_trajectories(self):
+    env = Environment(Vector(0, -0.1, 0), Vector(-0.01, 0, 0))
+    starts = [Point(0, 1, 0), Point(2, 0.5, -1), Point(0, 0, 0)]
+    velocities = [Vector(1, 1.8, 0).normalize().scalar_multiply(11.25), Vector(0.3, 0.2, 0.1), Vector(1, 1, 0)]
+    path, reached = simulate_trajectories(env, [(p.x, p.y, p.z) for p in starts],
+                                          [(v.x, v.y, v.z) for v in velocities])
+    for i, (start, velocity) in enumerate(zip(starts, velocities)):
+      proj = Projectile(start, velocity)
+      positions = [proj.position]
+      while proj.position.y > 0:
+        proj = tick(env, proj)
+        positions.append(proj.position)
+      # same step count and exactly the same positions as tick
+      self.assertEqual(int(reached[:, i].sum()), len(positions))
+      self.assertTrue(reached[:len(positions), i].all())
+      self.assertEqual(path[reached[:, i], i].tolist(), [[p.x, p.y, p.z] for p in positions])
+    # the path runs until the slowest projectile lands, and one that starts
+    # on the ground never moves
+    self.assertEqual(len(path), max(int(n) for n in reached.sum(axis=0)))
+    self.assertEqual(int(reached[:, 2].sum()), 1)
+    # an ever-rising projectile is cut off at max_steps
+    path, reached = simulate_trajectories(Environment(Vector(0, 0, 0), Vector(0, 0, 0)),
+                                          np.array([[0.0, 1.0, 0.0]]), np.array([[0.0, 1.0, 0.0]]),
+                                          max_steps=10)
+    self.assertEqual(len(path), 11)
+    self.assertEqual(path[-1, 0].tolist(), [0.0, 11.0, 0.0])
+
+  def test_rasterize(self):
+    canvas = Canvas(10, 5)
+    red = Color(1, 0, 0)
+    path = np.array([[[2.2, 1.0, 0.0], [-3.0, 2.0, 0.0]],
+                     [[4.0, 3.6, 0.0], [12.0, 2.0, 0.0]],
+                     [[6.0, 8.0, 0.0], [1.0, 4.0, 0.0]]])
+    reached = np.array([[True, True], [True, True], [True, False]])
+    # off-canvas positions are clipped and only the rest counted
+    self.assertEqual(rasterize(canvas, path, reached, red), 2)
+    self.assertTrue(canvas.pixel_at(2, 4).equals(red))
+    self.assertTrue(canvas.pixel_at(4, 1).equals(red))
+    # positions a projectile never reached aren't drawn
+    self.assertTrue(canvas.pixel_at(1, 1).equals(Color(0, 0, 0)))
+    self.assertEqual(int(np.count_nonzero(canvas.pixels)), 2)
+
+if __name__ == '__main__':
+    unittest.main()